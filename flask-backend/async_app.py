@@ -0,0 +1,382 @@
+"""
+Async (ASGI) serving mode for the cover letter API.
+
+Serves /api/cover-letter, /api/chat, /api/get-cv, /api/health, /api/live and
+/api/ready with the same JSON contracts as the Flask app in main.py, but on an
+event loop: embedding and generation go through the async Gemini clients, so
+one process can keep many LLM calls in flight instead of holding a thread per
+request.
+
+It shares its model client, retrieval handles and readiness checks with main.py
+through services.py, without importing (and starting) the Flask app.
+
+Run with:
+    python flask-backend/async_app.py
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from coalesce import AsyncSingleFlight, request_key
+from context import CONTEXT_CANDIDATES, pack_context
+
+from embedder import (
+    DEFAULT_CV_ID, RETRIEVAL_MODE, embed_cv, embed_query_async, index_is_current, query_collection,
+    query_embedding_cache
+)
+from generation import (
+    COVER_LETTER_GENERATION_CONFIG, CHAT_GENERATION_CONFIG,
+    build_cover_letter_prompt, build_cover_letter_request, build_chat_prompt, get_response_text, usage_to_dict,
+    generation_cache, semantic_cache, prefix_cache, generation_upstream, UNAVAILABLE_ERRORS, degraded_cover_letter, remember_letter
+)
+import metrics
+from metrics import LEXICAL_FALLBACKS, record_usage, span
+from request_logging import annotate, configure_logging, log_payload, log_request, sample_payload
+from readiness import READY, DEGRADED
+from services import EMBED_QUERY_TIMEOUT, api_key, collections, cors_headers, init, model, readiness, upstream_health
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Concurrency caps per upstream; requests beyond the cap wait for a free slot
+GENERATION_CONCURRENCY = int(os.getenv('GENERATION_CONCURRENCY', '256'))
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '64'))
+
+generation_semaphore = asyncio.Semaphore(GENERATION_CONCURRENCY)
+embedding_semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+# Merges identical concurrent generation requests into one upstream call
+generation_flight = AsyncSingleFlight()
+
+
+async def embed_query(message):
+    """Embed the job description through the async client under the embedding cap
+
+    Returns None when the request has to be answered lexically (see main.embed_query).
+    """
+    if RETRIEVAL_MODE == 'lexical':
+        return None
+    async with embedding_semaphore:
+        with span("embed_query"):
+            if RETRIEVAL_MODE != 'hybrid':
+                return await embed_query_async(message)
+            # Shielded, so a slow embedding still completes and fills the query cache
+            task = asyncio.ensure_future(embed_query_async(message))
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), EMBED_QUERY_TIMEOUT)
+            except asyncio.TimeoutError:
+                reason = 'timeout'
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            except UNAVAILABLE_ERRORS:
+                reason = 'unavailable'
+    LEXICAL_FALLBACKS.inc(reason=reason)
+    annotate(retrieval_fallback=reason)
+    return None
+
+
+async def resolve_cv(data):
+    """The requested cv_id and its collection, or an error response"""
+    cv_id = data.get('cv_id') or DEFAULT_CV_ID
+    try:
+        # Opening a collection that isn't cached yet goes to Chroma, so keep it off the loop
+        collection = await run_in_threadpool(collections.get, cv_id)
+    except ValueError as e:
+        return None, None, JSONResponse({'error': str(e)}, status_code=400)
+    if collection is None:
+        return None, None, JSONResponse({'error': f"No CV found for cv_id '{cv_id}'"}, status_code=404)
+    annotate(cv_id=cv_id)
+    return cv_id, collection, None
+
+
+def query_cv(message, query_embedding, cv_id, collection):
+    lexical_index = collections.lexical(cv_id) if RETRIEVAL_MODE != 'vector' else None
+    mode = 'lexical' if query_embedding is None else RETRIEVAL_MODE
+    return query_collection(
+        collection, message, n_results=CONTEXT_CANDIDATES, query_embedding=query_embedding,
+        lexical_index=lexical_index, mode=mode, embedding_function=collections.embedding_function
+    )
+
+
+async def retrieve_matched_chunks(message, query_embedding, cv_id, collection):
+    """Query Chroma (and the BM25 index) with the precomputed query embedding, off the event loop"""
+    with span("chroma_query"):
+        results = await run_in_threadpool(query_cv, message, query_embedding, cv_id, collection)
+    with span("pack_context"):
+        matched_chunks, context_tokens = pack_context(results['documents'][0])
+    annotate(retrieved_chunks=len(results['documents'][0]), matched_chunks=len(matched_chunks),
+             context_tokens=context_tokens)
+    log_payload(matched_chunks=matched_chunks)
+    return matched_chunks
+
+
+async def generate(prompt, generation_config, request_text=None):
+    """Run a Gemini generation through the async client under the generation cap
+
+    With request_text, the prompt is COVER_LETTER_PREFIX + request_text and is
+    sent through the cached prefix when available.
+    """
+    async with generation_semaphore:
+        with span("generate"):
+            if request_text is not None:
+                response = await generation_upstream.call_async(
+                    prefix_cache.generate_async, model, request_text, prompt, generation_config
+                )
+            else:
+                response = await generation_upstream.call_async(
+                    model.generate_content_async, contents=prompt, generation_config=generation_config
+                )
+    response_text = get_response_text(response)
+    record_usage(usage_to_dict(response))
+    generation_cache.set(prompt, generation_config, response_text)
+    return response_text
+
+
+def cached_payload(prompt, generation_config):
+    """Response payload for a cached letter for this prompt, if there is one"""
+    cached_text = generation_cache.get(prompt, generation_config)
+    if cached_text is not None:
+        return {'response': cached_text, 'cache': 'exact'}
+    return None
+
+
+async def cover_letter_pipeline(message, use_cache, cv_id, collection):
+    """Embed, retrieve and generate a cover letter; returns the JSON response payload"""
+    query_embedding = await embed_query(message)
+    if use_cache and query_embedding is not None:
+        semantic_hit = semantic_cache.get(query_embedding, scope=cv_id)
+        if semantic_hit is not None:
+            cached_text, similarity = semantic_hit
+            return {'response': cached_text, 'cache': 'semantic', 'similarity': round(similarity, 4)}
+
+    matched_chunks = await retrieve_matched_chunks(message, query_embedding, cv_id, collection)
+    with span("build_prompt"):
+        request_text = build_cover_letter_request(matched_chunks, message)
+        prompt = build_cover_letter_prompt(matched_chunks, message)
+    if use_cache:
+        cached = cached_payload(prompt, COVER_LETTER_GENERATION_CONFIG)
+        if cached is not None:
+            return cached
+
+    try:
+        response_text = await generate(prompt, COVER_LETTER_GENERATION_CONFIG, request_text)
+    except UNAVAILABLE_ERRORS as e:
+        payload = degraded_cover_letter(e, message, cv_id, prompt, query_embedding, matched_chunks)
+        if payload is None:
+            raise
+        return payload
+    if query_embedding is not None:
+        semantic_cache.set(query_embedding, response_text, scope=cv_id)
+    remember_letter(message, cv_id, response_text)
+    return {'response': response_text}
+
+
+async def chat_pipeline(message, use_cache=True):
+    """Generate a chat response; returns the JSON response payload"""
+    with span("build_prompt"):
+        prompt = build_chat_prompt(message)
+    if use_cache:
+        cached = cached_payload(prompt, CHAT_GENERATION_CONFIG)
+        if cached is not None:
+            return cached
+
+    response_text = await generate(prompt, CHAT_GENERATION_CONFIG)
+    return {'response': response_text}
+
+
+def unavailable_response(error):
+    """503 for a request shed by the upstream limits or circuit breaker, or failed by Gemini"""
+    reason = getattr(error, 'reason', None) or type(error).__name__
+    logger.warning(f"Gemini unavailable ({reason}): {error}")
+    annotate(unavailable=reason)
+    return JSONResponse({'error': 'The AI service is busy or unavailable, please try again shortly'},
+                        status_code=503, headers={'Retry-After': str(max(1, round(getattr(error, 'retry_after', 1))))})
+
+
+async def read_message(request, missing_error):
+    """(data, message) from a request's JSON body, or an error response if the body isn't
+    a JSON object or its message isn't a non-empty string"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return None, None, JSONResponse({'error': 'Request body must be a JSON object'}, status_code=400)
+    message = data.get('message')
+    if not isinstance(message, str) or not message.strip():
+        return None, None, JSONResponse({'error': missing_error}, status_code=400)
+    annotate(message_chars=len(message), message=message)
+    return data, message, None
+
+
+async def generate_cover_letter(request):
+    """Dedicated endpoint for cover letter generation"""
+    data, message, error = await read_message(request, 'No job details provided')
+    if error:
+        return error
+    log_payload(headers=dict(request.headers), data=data)
+    cv_id, collection, error = await resolve_cv(data)
+    if error:
+        return error
+
+    try:
+        use_cache = not data.get('regenerate', False)
+        key = request_key('cover-letter', message, use_cache=use_cache, cv_id=cv_id)
+        payload = await generation_flight.do(
+            key, lambda: cover_letter_pipeline(message, use_cache, cv_id, collection)
+        )
+        annotate(cache=payload.get('cache'))
+        return JSONResponse(payload)
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception(f"Error generating cover letter: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def cover_letter(request):
+    data, message, error = await read_message(request, 'No message provided')
+    if error:
+        return error
+    log_payload(headers=dict(request.headers), data=data)
+
+    try:
+        use_cache = not data.get('regenerate', False)
+        key = request_key('chat', message, use_cache=use_cache)
+        payload = await generation_flight.do(key, lambda: chat_pipeline(message, use_cache))
+        annotate(cache=payload.get('cache'))
+        return JSONResponse(payload)
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception(f"Error generating response: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    status, upstreams = upstream_health()
+    return JSONResponse({
+        'status': status,
+        'api_key_configured': bool(api_key),
+        'cors_configured': True,
+        'origins_allowed': cors_headers['origins'],
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'generation_cache': generation_cache.stats(),
+        'semantic_cache': semantic_cache.stats(),
+        'prefix_cache': prefix_cache.stats(),
+        'upstreams': upstreams,
+        'coalescing': generation_flight.stats(),
+        'collections': collections.stats(),
+        'readiness': readiness.status()[1]
+    })
+
+
+async def liveness(request):
+    """Liveness probe: the process is up and serving requests"""
+    return JSONResponse({'status': 'alive'})
+
+
+async def readiness_probe(request):
+    """Readiness probe from the cached background checks; 503 until the service can answer requests"""
+    status, details = readiness.status()
+    return JSONResponse(details, status_code=200 if status in (READY, DEGRADED) else 503)
+
+
+async def prometheus_metrics(request):
+    """Stage latency histograms, in-flight requests, retries and token usage in Prometheus text format"""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def get_cv(request):
+    """Check if embedded CV is present in Chroma DB"""
+    cv_id = request.query_params.get('cv_id') or DEFAULT_CV_ID
+    try:
+        # Cached until the CV is re-indexed, so polling this doesn't query Chroma
+        count = await run_in_threadpool(collections.count, cv_id)
+        if count == 0:
+            return JSONResponse({'embedded': False, 'message': 'No CV found in Chroma DB'})
+        return JSONResponse({'embedded': True, 'message': f'{count} document(s) found in Chroma DB'})
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception(f"Error checking Chroma DB: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware that times each request and logs its record as one JSON line"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = scope['path'] if scope['path'] in ROUTE_PATHS else 'unmatched'
+        record = sample_payload(metrics.start_request(route))
+        record['method'] = scope['method']
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            log_request(logger, metrics.finish_request(record, status[0]))
+
+
+ROUTE_PATHS = {'/api/cover-letter', '/api/chat', '/api/health', '/api/live', '/api/ready', '/api/get-cv', '/api/metrics'}
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Opens the default CV's collection, so off the event loop
+    await run_in_threadpool(init)
+    yield
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/api/cover-letter', generate_cover_letter, methods=['POST']),
+        Route('/api/chat', cover_letter, methods=['POST']),
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/live', liveness, methods=['GET']),
+        Route('/api/ready', readiness_probe, methods=['GET']),
+        Route('/api/get-cv', get_cv, methods=['GET']),
+        Route('/api/metrics', prometheus_metrics, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(RequestMetricsMiddleware),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=cors_headers['origins'],
+            allow_methods=cors_headers['methods'],
+            allow_headers=cors_headers['allow_headers'],
+            allow_credentials=cors_headers['supports_credentials'],
+            max_age=cors_headers['max_age']
+        )
+    ]
+)
+
+if __name__ == '__main__':
+    if index_is_current():
+        logger.info("CV index is up to date, skipping ingestion")
+    else:
+        embed_cv()
+    logger.info("Starting async API server...")
+    uvicorn.run(app, port=5001, host='0.0.0.0')
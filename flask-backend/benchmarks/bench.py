@@ -0,0 +1,397 @@
+"""
+End-to-end benchmarks for the cover letter backend, run against the fake Gemini upstream.
+
+HTTP load (starts benchmarks/serve.py in a subprocess unless --url is given):
+    python flask-backend/benchmarks/bench.py http --mode flask --endpoint cover-letter --concurrency 1,8,32
+    python flask-backend/benchmarks/bench.py http --mode async --endpoint chat --concurrency 64,256 --requests 1000
+
+Scaling with worker processes (server.py); with no upstream latency the app's
+own CPU time is the bottleneck, so throughput should grow with the worker count
+up to the number of cores:
+    FAKE_GEMINI_LATENCY=0 FAKE_GEMINI_TOKENS_PER_SECOND=1000000 \
+        python flask-backend/benchmarks/bench.py http --workers 1,2,4 --concurrency 32
+
+CV ingestion through embedder.embed_cv (in process):
+    python flask-backend/benchmarks/bench.py ingest --pages 20
+
+Retrieval backends (Chroma vs the NumPy index), per query and at cold start:
+    python flask-backend/benchmarks/bench.py retrieval --pages 20 --queries 2000
+
+Cold start: module import times, and how soon a freshly started server answers
+/api/health and serves the API, eager (import main) vs the app factory (wsgi.py):
+    python flask-backend/benchmarks/bench.py startup --repeat 5
+
+Reports p50/p95/p99 latency, throughput and upstream (fake Gemini) call counts.
+Fake upstream behaviour is set with the FAKE_GEMINI_* environment variables,
+see fake_gemini.py. Use --json to also write the results to a file.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+JOB_DESCRIPTION = (
+    "Frontend Engineer at ePages. We are looking for a developer with strong JavaScript/TypeScript "
+    "and React skills who writes DRY, maintainable code, is familiar with Git, HTML, CSS and testing "
+    "(Testing Library, Cypress) and enjoys working with REST APIs. Posting #{index}"
+)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, elapsed, errors):
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+def print_table(rows, columns):
+    widths = [max(len(column), *(len(str(row.get(column, ''))) for row in rows)) for column in columns]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(column, '')).rjust(width) for column, width in zip(columns, widths)))
+
+
+# HTTP load
+
+def wait_for_server(url, process=None, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {process.returncode}")
+        try:
+            # Ready means the startup warmup's upstream calls are done and won't be counted in the results
+            if requests.get(f"{url}/api/ready", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Benchmark server at {url} did not become ready within {timeout}s")
+
+
+def run_load(url, endpoint, concurrency, total, same_message):
+    """Send `total` requests from `concurrency` worker threads; returns (latencies, elapsed, errors)"""
+    latencies = []
+    errors = [0]
+    next_index = [0]
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= total:
+                    return
+                next_index[0] += 1
+            message = JOB_DESCRIPTION.format(index=0 if same_message else index)
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{url}/api/{endpoint}", json={'message': message}, timeout=300)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            duration = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(duration)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start, errors[0]
+
+
+def run_levels(args, url, workers):
+    rows = []
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        requests.post(f"{url}/__fake/reset")
+        total = args.requests or max(20, concurrency * 4)
+        latencies, elapsed, errors = run_load(url, args.endpoint, concurrency, total, args.same_message)
+        row = {"mode": args.mode, "endpoint": args.endpoint, "workers": workers, "concurrency": concurrency}
+        row.update(summarize(latencies, elapsed, errors))
+        upstream = requests.get(f"{url}/__fake/stats").json()
+        row["generate_calls"] = upstream["generate_calls"] + upstream["stream_calls"]
+        row["embed_calls"] = upstream["embed_calls"]
+        rows.append(row)
+    return rows
+
+
+def bench_http(args):
+    if args.url is not None:
+        rows = run_levels(args, args.url, None)
+    else:
+        rows = []
+        url = f"http://127.0.0.1:{args.port}"
+        for workers in [int(w) for w in args.workers.split(',')]:
+            process = subprocess.Popen([
+                sys.executable, os.path.join(BENCHMARK_DIR, 'serve.py'),
+                '--mode', args.mode, '--port', str(args.port), '--workers', str(workers)
+            ])
+            try:
+                wait_for_server(url, process)
+                rows.extend(run_levels(args, url, workers))
+            finally:
+                process.terminate()
+                process.wait()
+    print_table(rows, ["mode", "endpoint", "workers", "concurrency", "requests", "errors", "throughput_rps",
+                       "p50_ms", "p95_ms", "p99_ms", "generate_calls", "embed_calls"])
+    return rows
+
+
+# Ingestion
+
+def bench_ingest(args):
+    from fake_gemini import FakeGemini
+    from sample_cv import write_sample_pdf
+
+    workdir = tempfile.mkdtemp(prefix='cover-letter-bench-')
+    os.environ.setdefault('GOOGLE_API_KEY', 'fake-key')
+    os.environ['CHROMA_PATH'] = os.path.join(workdir, 'chroma_db')
+    fake = FakeGemini.from_env().install()
+
+    import embedder
+
+    cv_path = write_sample_pdf(os.path.join(workdir, 'cv.pdf'), pages=args.pages)
+    rows = []
+    for run in ['cold', 'warm']:
+        fake.reset()
+        latencies = []
+        for _ in range(args.repeat if run == 'warm' else 1):
+            start = time.perf_counter()
+            collection = embedder.embed_cv(cv_path)
+            latencies.append(time.perf_counter() - start)
+        upstream = fake.stats()
+        rows.append({
+            "run": run,
+            "pages": args.pages,
+            "chunks": collection.count(),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+            "embed_calls": upstream["embed_calls"],
+            "embedded_texts": upstream["embedded_texts"],
+        })
+    print_table(rows, ["run", "pages", "chunks", "p50_ms", "max_ms", "embed_calls", "embedded_texts"])
+    return rows
+
+
+# Retrieval backends
+
+def cold_query(backend, dimensions):
+    """Open a retrieval handle and run one query in a fresh process; prints the timings as JSON"""
+    start = time.perf_counter()
+    import embedder
+    imported = time.perf_counter()
+    collections = embedder.CollectionCache(embedder.GeminiEmbeddingFunction(document_mode=False), backend=backend)
+    collection = collections.get(embedder.DEFAULT_CV_ID)
+    opened = time.perf_counter()
+    embedder.query_collection(collection, "", query_embedding=[1.0] * dimensions)
+    done = time.perf_counter()
+    print(json.dumps({"import_ms": (imported - start) * 1000, "open_ms": (opened - imported) * 1000,
+                      "first_query_ms": (done - opened) * 1000}))
+
+
+def bench_retrieval(args):
+    from fake_gemini import FakeGemini
+    from sample_cv import write_sample_pdf
+
+    workdir = tempfile.mkdtemp(prefix='cover-letter-bench-')
+    os.environ.setdefault('GOOGLE_API_KEY', 'fake-key')
+    os.environ['CHROMA_PATH'] = os.path.join(workdir, 'chroma_db')
+    os.environ['VECTOR_INDEX_DIR'] = os.path.join(workdir, 'vector_index')
+    fake = FakeGemini.from_env().install()
+
+    import embedder
+
+    cv_path = write_sample_pdf(os.path.join(workdir, 'cv.pdf'), pages=args.pages)
+    embedder.embed_cv(cv_path)
+    query_embeddings = [fake.vector(JOB_DESCRIPTION.format(index=i)) for i in range(args.queries)]
+
+    rows = []
+    for backend in ['chroma', 'numpy']:
+        collections = embedder.CollectionCache(embedder.GeminiEmbeddingFunction(document_mode=False), backend=backend)
+        collection = collections.get(embedder.DEFAULT_CV_ID)
+        for section in [None, 'work_experience']:
+            latencies = []
+            for query_embedding in query_embeddings:
+                start = time.perf_counter()
+                embedder.query_collection(collection, "", filter_section=section, query_embedding=query_embedding)
+                latencies.append(time.perf_counter() - start)
+
+            # Cold start: a new process opening the handle and running its first query
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), 'retrieval', '--cold-child', backend,
+                 '--cold-dimensions', str(len(query_embeddings[0]))],
+                capture_output=True, text=True, env=os.environ.copy(), check=True
+            )
+            cold = json.loads(child.stdout.strip().splitlines()[-1])
+            rows.append({
+                "backend": backend,
+                "filter": section or "-",
+                "chunks": collection.count(),
+                "queries": len(latencies),
+                "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+                "p95_us": round(percentile(latencies, 95) * 1e6, 1),
+                "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+                "cold_open_ms": round(cold["open_ms"], 1),
+                "cold_first_query_ms": round(cold["first_query_ms"], 1),
+            })
+    print_table(rows, ["backend", "filter", "chunks", "queries", "p50_us", "p95_us", "p99_us",
+                       "cold_open_ms", "cold_first_query_ms"])
+    return rows
+
+
+# Cold start
+
+STARTUP_IMPORTS = ("google.generativeai", "chromadb", "langchain.text_splitter", "PyPDF2", "flask", "main", "wsgi")
+# Servers started by the startup benchmark: the app imported up front, and the app factory
+STARTUP_SERVERS = {
+    "eager": "import main; main.init(); main.app.run(host='127.0.0.1', port={port}, threaded=True)",
+    "factory": "import wsgi; from werkzeug.serving import run_simple; "
+               "run_simple('127.0.0.1', {port}, wsgi.create_app(), threaded=True)",
+}
+
+
+def timed_import(module, env):
+    """Seconds to import a module in a fresh interpreter"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, '-c', code], env=env, cwd=os.path.dirname(BENCHMARK_DIR),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+
+def time_server_start(server, port, env):
+    """Seconds until /api/health first answers 200, and until it answers from the loaded API"""
+    url = f"http://127.0.0.1:{port}/api/health"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', STARTUP_SERVERS[server].format(port=port)], env=env,
+                               cwd=os.path.dirname(BENCHMARK_DIR), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    first_ok = None
+    try:
+        while time.perf_counter() - start < 120:
+            if process.poll() is not None:
+                raise RuntimeError(f"{server} server exited with code {process.returncode}")
+            try:
+                response = requests.get(url, timeout=1)
+                if response.status_code == 200:
+                    first_ok = first_ok or time.perf_counter() - start
+                    if response.json().get('status') != 'starting':
+                        return first_ok, time.perf_counter() - start
+            except requests.RequestException:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"{server} server did not load within 120s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_startup(args):
+    from fake_gemini import FakeGemini
+    from sample_cv import write_sample_pdf
+
+    workdir = tempfile.mkdtemp(prefix='cover-letter-bench-')
+    os.environ.setdefault('GOOGLE_API_KEY', 'fake-key')
+    os.environ['CHROMA_PATH'] = os.path.join(workdir, 'chroma_db')
+    os.environ['UPLOAD_DIR'] = os.path.join(workdir, 'uploads')
+    os.environ['JOB_DB'] = os.path.join(workdir, 'jobs.db')
+    os.environ['PDF_CACHE_DIR'] = os.path.join(workdir, 'pdf_cache')
+    env = dict(os.environ)
+
+    # Index the CV up front (against the fake), so the servers find the index current and skip ingestion
+    FakeGemini.from_env().install()
+    import embedder
+
+    os.makedirs(os.environ['UPLOAD_DIR'])
+    embedder.embed_cv(write_sample_pdf(embedder.current_cv_path(), pages=args.pages))
+
+    rows = []
+    for module in STARTUP_IMPORTS:
+        times = [timed_import(module, env) for _ in range(args.repeat)]
+        rows.append({"measure": f"import {module}", "p50_ms": round(percentile(times, 50) * 1000, 1),
+                     "max_ms": round(max(times) * 1000, 1)})
+    for server in STARTUP_SERVERS:
+        runs = [time_server_start(server, args.port, env) for _ in range(args.repeat)]
+        for index, measure in enumerate(["first health 200", "API loaded"]):
+            times = [run[index] for run in runs]
+            rows.append({"measure": f"{server}: {measure}", "p50_ms": round(percentile(times, 50) * 1000, 1),
+                         "max_ms": round(max(times) * 1000, 1)})
+    print_table(rows, ["measure", "p50_ms", "max_ms"])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='write results to this file as JSON')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    http = subparsers.add_parser('http', help='load test the HTTP API')
+    http.add_argument('--mode', choices=['flask', 'async'], default='flask')
+    http.add_argument('--endpoint', choices=['cover-letter', 'chat'], default='cover-letter')
+    http.add_argument('--concurrency', default='1,8,32', help='comma separated concurrency levels')
+    http.add_argument('--requests', type=int, default=0, help='requests per level (default: 4x concurrency, min 20)')
+    http.add_argument('--same-message', action='store_true', help='send one job description instead of distinct ones')
+    http.add_argument('--workers', default='1', help='comma separated server worker process counts')
+    http.add_argument('--url', help='benchmark an already running server instead of starting one')
+    http.add_argument('--port', type=int, default=5055)
+    http.set_defaults(run=bench_http)
+
+    ingest = subparsers.add_parser('ingest', help='benchmark CV ingestion through embed_cv')
+    ingest.add_argument('--pages', type=int, default=10)
+    ingest.add_argument('--repeat', type=int, default=5, help='warm (unchanged CV) runs to time')
+    ingest.set_defaults(run=bench_ingest)
+
+    retrieval = subparsers.add_parser('retrieval', help='compare the chroma and numpy retrieval backends')
+    retrieval.add_argument('--pages', type=int, default=10)
+    retrieval.add_argument('--queries', type=int, default=1000)
+    retrieval.add_argument('--cold-child', choices=['chroma', 'numpy'], help=argparse.SUPPRESS)
+    retrieval.add_argument('--cold-dimensions', type=int, help=argparse.SUPPRESS)
+    retrieval.set_defaults(run=bench_retrieval)
+
+    startup = subparsers.add_parser('startup', help='time imports and server cold start, eager vs the app factory')
+    startup.add_argument('--pages', type=int, default=2)
+    startup.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+    startup.add_argument('--port', type=int, default=5056)
+    startup.set_defaults(run=bench_startup)
+
+    args = parser.parse_args()
+    if getattr(args, 'cold_child', None):
+        cold_query(args.cold_child, args.cold_dimensions)
+        return
+    rows = args.run(args)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(rows, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
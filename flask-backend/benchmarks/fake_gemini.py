@@ -0,0 +1,271 @@
+"""
+Local stand-in for the Gemini generation and embedding APIs.
+
+FakeGemini replaces genai.embed_content / genai.embed_content_async, genai.get_model,
+GenerativeModel.generate_content / generate_content_async and context caching
+(CachedContent.create / GenerativeModel.from_cached_content) in the current process
+with fakes that have configurable latency, token rate and error injection, and
+return deterministic embedding vectors. The real SDK entry points are patched
+rather than served over the network because the SDK's REST transport runs the
+*_async calls synchronously; patching keeps the sync and async code paths of the
+app exactly as they are in production.
+
+All settings can be given as arguments or through FAKE_GEMINI_* environment
+variables (see FakeGemini.from_env).
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import random
+import threading
+import time
+import types
+
+import numpy as np
+from google.api_core import exceptions as api_exceptions
+import google.generativeai as genai
+from google.generativeai import caching
+
+LOREM = (
+    "Dear Hiring Team, I am excited to apply for this role. My experience with React, "
+    "TypeScript and testing frameworks has prepared me to build maintainable, user-friendly "
+    "products and to collaborate closely with cross-functional teams. "
+).split()
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens, cached_tokens=0):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.cached_content_token_count = cached_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeCachedContent:
+    def __init__(self, name, model, tokens):
+        self.name = name
+        self.model = model
+        self.usage_metadata = FakeUsage(tokens, 0)
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStreamResponse:
+    """Iterates over text chunks, sleeping between them to emulate the token rate"""
+
+    def __init__(self, chunks, usage, delay):
+        self._chunks = chunks
+        self._delay = delay
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._delay)
+            yield FakeChunk(chunk)
+
+
+class SharedCounters:
+    """Dict-like integer counters in shared memory, so forked server workers add to the same totals"""
+
+    def __init__(self, counters):
+        self._names = list(counters)
+        self._values = multiprocessing.RawArray('q', [counters[name] for name in self._names])
+
+    def __getitem__(self, name):
+        return self._values[self._names.index(name)]
+
+    def __setitem__(self, name, value):
+        self._values[self._names.index(name)] = value
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def keys(self):
+        return list(self._names)
+
+
+class FakeGemini:
+    def __init__(self, latency=0.2, embed_latency=0.05, tokens_per_second=400.0, output_tokens=400,
+                 error_rate=0.0, dimensions=768, chunk_tokens=20, seed=0, context_cache=True):
+        self.latency = latency
+        self.embed_latency = embed_latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.dimensions = dimensions
+        self.chunk_tokens = chunk_tokens
+        # When False, creating cached content fails like it does for prompts under the upstream minimum
+        self.context_cache = context_cache
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {
+            "generate_calls": 0,
+            "stream_calls": 0,
+            "embed_calls": 0,
+            "embedded_texts": 0,
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+            "cached_tokens": 0,
+            "caches_created": 0,
+            "errors": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=float(os.getenv('FAKE_GEMINI_LATENCY', '0.2')),
+            embed_latency=float(os.getenv('FAKE_GEMINI_EMBED_LATENCY', '0.05')),
+            tokens_per_second=float(os.getenv('FAKE_GEMINI_TOKENS_PER_SECOND', '400')),
+            output_tokens=int(os.getenv('FAKE_GEMINI_OUTPUT_TOKENS', '400')),
+            error_rate=float(os.getenv('FAKE_GEMINI_ERROR_RATE', '0')),
+            dimensions=int(os.getenv('FAKE_GEMINI_DIMENSIONS', '768')),
+            seed=int(os.getenv('FAKE_GEMINI_SEED', '0')),
+            context_cache=os.getenv('FAKE_GEMINI_CONTEXT_CACHE', 'true').lower() == 'true',
+        )
+
+    def share(self):
+        """Keep the counters (and the lock guarding them) in shared memory; call before forking"""
+        self._lock = multiprocessing.Lock()
+        self.counters = SharedCounters(self.counters)
+        return self
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self._lock:
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def _maybe_fail(self):
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            use_429 = self._random.random() < 0.5
+        if fail:
+            self._count(errors=1)
+            if use_429:
+                raise api_exceptions.TooManyRequests("Fake quota exceeded")
+            raise api_exceptions.ServiceUnavailable("Fake upstream unavailable")
+
+    def vector(self, text):
+        """Deterministic unit vector for a text, seeded from its hash"""
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    # Embedding
+
+    def _embedding_result(self, content):
+        if isinstance(content, str):
+            self._count(embed_calls=1, embedded_texts=1)
+            return {"embedding": self.vector(content)}
+        texts = list(content)
+        self._count(embed_calls=1, embedded_texts=len(texts))
+        return {"embedding": [self.vector(text) for text in texts]}
+
+    def embed_content(self, model, content, task_type=None, **kwargs):
+        time.sleep(self.embed_latency)
+        self._maybe_fail()
+        return self._embedding_result(content)
+
+    async def embed_content_async(self, model, content, task_type=None, **kwargs):
+        await asyncio.sleep(self.embed_latency)
+        self._maybe_fail()
+        return self._embedding_result(content)
+
+    # Generation
+
+    @staticmethod
+    def _tokens(contents):
+        return max(1, len(str(contents)) // 4)
+
+    def _usage(self, contents, cached=None):
+        cached_tokens = cached.usage_metadata.total_token_count if cached is not None else 0
+        prompt_tokens = self._tokens(contents) + cached_tokens
+        self._count(prompt_tokens=prompt_tokens, output_tokens=self.output_tokens, cached_tokens=cached_tokens)
+        return FakeUsage(prompt_tokens, self.output_tokens, cached_tokens)
+
+    # Context caching
+
+    def create_cached_content(self, model, contents=None, **kwargs):
+        if not self.context_cache:
+            raise api_exceptions.InvalidArgument("Cached content is too small")
+        self._count(caches_created=1)
+        return FakeCachedContent(f"cachedContents/fake-{self.counters['caches_created']}", model,
+                                 self._tokens(contents))
+
+    def _text(self):
+        return " ".join(LOREM[i % len(LOREM)] for i in range(self.output_tokens))
+
+    def _generation_time(self):
+        return self.latency + self.output_tokens / self.tokens_per_second
+
+    def generate_content(self, contents, generation_config=None, stream=False, cached=None, **kwargs):
+        self._maybe_fail()
+        usage = self._usage(contents, cached)
+        if stream:
+            self._count(stream_calls=1)
+            time.sleep(self.latency)
+            words = self._text().split(" ")
+            chunks = [
+                " ".join(words[i:i + self.chunk_tokens]) + " "
+                for i in range(0, len(words), self.chunk_tokens)
+            ]
+            return FakeStreamResponse(chunks, usage, self.chunk_tokens / self.tokens_per_second)
+        self._count(generate_calls=1)
+        time.sleep(self._generation_time())
+        return FakeResponse(self._text(), usage)
+
+    async def generate_content_async(self, contents, generation_config=None, cached=None, **kwargs):
+        self._maybe_fail()
+        usage = self._usage(contents, cached)
+        self._count(generate_calls=1)
+        await asyncio.sleep(self._generation_time())
+        return FakeResponse(self._text(), usage)
+
+    @staticmethod
+    def get_model(name, **kwargs):
+        return types.SimpleNamespace(name=name)
+
+    def install(self):
+        """Patch the SDK entry points used by the app with this fake"""
+        fake = self
+        genai.get_model = self.get_model
+        genai.embed_content = self.embed_content
+        genai.embed_content_async = self.embed_content_async
+        genai.GenerativeModel.generate_content = (
+            lambda model, contents=None, **kwargs: fake.generate_content(
+                contents, cached=getattr(model, '_fake_cached_content', None), **kwargs)
+        )
+        genai.GenerativeModel.generate_content_async = (
+            lambda model, contents=None, **kwargs: fake.generate_content_async(
+                contents, cached=getattr(model, '_fake_cached_content', None), **kwargs)
+        )
+        caching.CachedContent.create = classmethod(
+            lambda cls, model, **kwargs: fake.create_cached_content(model, **kwargs)
+        )
+        genai.GenerativeModel.from_cached_content = classmethod(fake_from_cached_content)
+        return self
+
+
+def fake_from_cached_content(cls, cached_content, **kwargs):
+    model = cls(model_name=cached_content.model, **kwargs)
+    model._fake_cached_content = cached_content
+    return model
@@ -0,0 +1,82 @@
+"""
+Synthetic CV PDF for benchmarks, so the ingestion path can run without a real cv.pdf.
+"""
+
+SECTIONS = [
+    ("Summary", [
+        "Passionate front-end developer focused on scalable, user-friendly web applications.",
+        "Enjoys turning product requirements into clean, maintainable and well tested code.",
+    ]),
+    ("Work Experience", [
+        "Software Developer, Learnship GmbH - HALO, Elevate and Solo learning platforms.",
+        "Modernised legacy systems while shipping new features for multiple platforms.",
+        "Front-End Developer, SevenCs - built MyRA Web, a digital maritime routing service.",
+        "Created a React and TypeScript npm component library shared across products.",
+        "Integrated a third-party mapping library to display complex real-time route data.",
+    ]),
+    ("Skills", [
+        "JavaScript, TypeScript, React, Vue.js, HTML, CSS, REST APIs, Git, Python.",
+        "Testing Library, Cypress, Jest, CI/CD pipelines, code reviews.",
+    ]),
+    ("Projects", [
+        "Cover Letter AI - RAG based cover letter generator using Gemini and ChromaDB.",
+        "Assembly End Game - word guessing game built with React.",
+    ]),
+    ("Education", [
+        "M.Eng Computer Science, University of Applied Sciences.",
+        "B.Tech Information Technology.",
+    ]),
+    ("Contact", [
+        "Email: candidate@example.com  Phone: +49 000 0000000",
+    ]),
+]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_stream(page_number):
+    lines = []
+    for title, entries in SECTIONS:
+        lines.append(f"{title} (page {page_number})")
+        for entry in entries:
+            lines.append(entry)
+        lines.append("")
+    ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+    ops += [f"({_escape(line)}) '" for line in lines]
+    ops.append("ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def write_sample_pdf(path, pages=2):
+    """Write a minimal text PDF with `pages` pages of CV-like content"""
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {pages} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for i, page_id in enumerate(page_ids):
+        stream = _page_stream(i + 1)
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode()
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(out)
+    count = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % count
+    for object_id in range(1, count):
+        out += b"%010d 00000 n \n" % offsets[object_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref_offset)
+
+    with open(path, "wb") as file:
+        file.write(out)
+    return path
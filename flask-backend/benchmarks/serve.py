@@ -0,0 +1,85 @@
+"""
+Run the API against the fake Gemini upstream, for benchmarks.
+
+    python flask-backend/benchmarks/serve.py --mode flask --port 5055
+    python flask-backend/benchmarks/serve.py --mode async --port 5055
+    python flask-backend/benchmarks/serve.py --mode flask --workers 4
+
+The server runs through server.py: the CV is ingested once, then --workers
+processes are forked. The fake's call counters, shared by all workers, are
+exposed at GET /__fake/stats and reset with POST /__fake/reset. Chroma data
+goes to a temporary directory unless CHROMA_PATH is set, and the generated sample CV
+to a temporary UPLOAD_DIR.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_gemini import FakeGemini
+from sample_cv import write_sample_pdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['flask', 'async'], default='flask')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=1, help='worker processes (see server.py)')
+    parser.add_argument('--cv', help='CV PDF to ingest (default: a generated sample CV)')
+    parser.add_argument('--pages', type=int, default=2, help='pages of the generated sample CV')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cover-letter-bench-')
+    os.environ.setdefault('GOOGLE_API_KEY', 'fake-key')
+    os.environ.setdefault('CHROMA_PATH', os.path.join(workdir, 'chroma_db'))
+    # The sample CV is written where an uploaded CV would go, so it is the default CV
+    os.environ.setdefault('UPLOAD_DIR', os.path.join(workdir, 'uploads'))
+    # Measure the app rather than the client-side rate limits, unless they are set explicitly
+    os.environ.setdefault('GENERATION_RPM', '0')
+    os.environ.setdefault('EMBEDDING_RPM', '0')
+
+    # Installed before forking, so every worker uses it and counts into the same totals
+    fake = FakeGemini.from_env().share().install()
+
+    import server
+    from request_logging import configure_logging
+
+    # Request logging would dominate the measurements
+    configure_logging(logging.WARNING)
+    if args.cv:
+        cv_path = args.cv
+    else:
+        os.makedirs(os.environ['UPLOAD_DIR'], exist_ok=True)
+        cv_path = write_sample_pdf(os.path.join(os.environ['UPLOAD_DIR'], 'current.pdf'), pages=args.pages)
+
+    def setup(app):
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        if args.mode == 'flask':
+            from flask import jsonify
+
+            app.add_url_rule('/__fake/stats', 'fake_stats', lambda: jsonify(fake.stats()))
+            app.add_url_rule('/__fake/reset', 'fake_reset', lambda: (fake.reset(), ('', 204))[1], methods=['POST'])
+        else:
+            from starlette.responses import JSONResponse, Response
+
+            async def fake_stats(request):
+                return JSONResponse(fake.stats())
+
+            async def fake_reset(request):
+                fake.reset()
+                return Response(status_code=204)
+
+            app.add_route('/__fake/stats', fake_stats, methods=['GET'])
+            app.add_route('/__fake/reset', fake_reset, methods=['POST'])
+
+    server.run(args.mode, '127.0.0.1', args.port, args.workers, cv_path=cv_path, setup=setup, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different copies of a text share a cache key"""
+    return " ".join(text.split())
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters"""
+
+    def __init__(self, max_size=256, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self, key_filter=None):
+        """Drop every entry, or only those whose key key_filter accepts"""
+        with self._lock:
+            if key_filter is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key_filter(key)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SQLiteCache:
+    """On-disk key/value cache with per-entry expiry, shared by all threads of a process"""
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._connect()
+        # A SQLite connection must not be used across fork(), so a forked server worker opens its own
+        os.register_at_fork(after_in_child=self._connect)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl)
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+
+class GenerationCache:
+    """Two-tier (memory LRU, optional SQLite) cache of generated text
+
+    Entries are keyed by a hash of the final prompt and the generation config,
+    so any change to the template, retrieved chunks, job text or config misses.
+    """
+
+    def __init__(self, enabled=False, max_size=256, ttl=86400, db_path=None):
+        self.enabled = enabled
+        self.memory = TTLCache(max_size=max_size, ttl=ttl)
+        self.disk = SQLiteCache(db_path, ttl=ttl) if enabled and db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(prompt, generation_config):
+        payload = json.dumps({"prompt": prompt, "config": generation_config}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, prompt, generation_config):
+        if not self.enabled:
+            return None
+        key = self.key_for(prompt, generation_config)
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, prompt, generation_config, value):
+        if not self.enabled:
+            return
+        key = self.key_for(prompt, generation_config)
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "disk_enabled": self.disk is not None,
+            "size": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SemanticCache:
+    """Cache of generated letters looked up by job description embedding
+
+    A lookup hits when a stored job description has cosine similarity of at
+    least `threshold` with the query, so re-pasted postings with trimmed headers,
+    reordered bullets or different tracking links reuse the earlier letter.
+    """
+
+    def __init__(self, enabled=False, threshold=0.95, max_size=256, ttl=86400):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding, scope=None):
+        """Return (value, similarity) of the closest stored entry above the threshold, or None
+
+        Only entries stored with the same scope (e.g. the CV they were written for) can match.
+        """
+        if not self.enabled:
+            return None
+        query = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            for entry_id in [k for k, entry in self._entries.items() if entry[2] <= now]:
+                del self._entries[entry_id]
+            ids = [k for k, entry in self._entries.items() if entry[3] == scope]
+            if ids:
+                matrix = np.stack([self._entries[i][0] for i in ids])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                if similarity >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return self._entries[ids[best]][1], similarity
+            self.misses += 1
+            return None
+
+    def set(self, embedding, value, scope=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[self._next_id] = (self._unit(embedding), value, time.monotonic() + self.ttl, scope)
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self, scope=None):
+        """Drop the entries stored with a scope"""
+        with self._lock:
+            for entry_id in [k for k, entry in self._entries.items() if entry[3] == scope]:
+                del self._entries[entry_id]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
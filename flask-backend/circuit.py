@@ -0,0 +1,125 @@
+"""
+Circuit breaker for calls to an upstream model.
+
+The breaker keeps the outcomes of the last `window` calls. Once at least
+`min_calls` have been seen and the share of failures (errors that point at the
+upstream, or calls slower than `slow_call_seconds`) reaches `failure_rate`, it
+opens: calls are refused without touching the upstream for `open_seconds`.
+After that it goes half-open and lets `half_open_probes` calls through at a
+time; a successful probe closes it again, a failed one re-opens it.
+"""
+
+import threading
+import time
+from collections import deque
+
+from google.api_core import exceptions as api_exceptions
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# Gauge values for the metrics endpoint
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# Errors that say the upstream is unhealthy, as opposed to a bad request
+UPSTREAM_FAILURES = (
+    api_exceptions.ServerError, api_exceptions.TooManyRequests, api_exceptions.RetryError,
+    TimeoutError, ConnectionError,
+)
+
+
+def is_upstream_failure(error):
+    return isinstance(error, UPSTREAM_FAILURES)
+
+
+class CircuitBreaker:
+    def __init__(self, window=20, min_calls=10, failure_rate=0.5, open_seconds=30.0,
+                 half_open_probes=1, slow_call_seconds=None, on_change=None):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.slow_call_seconds = slow_call_seconds
+        self.on_change = on_change
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        if state == OPEN:
+            self.opened += 1
+            self._opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probes = 0
+        if self.on_change is not None:
+            self.on_change(state)
+
+    def allow(self):
+        """Whether a call may go ahead; every allowed call must be followed by record() or release()"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, failed):
+        """Record the outcome of an allowed call"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes -= 1
+                if failed:
+                    self._set_state(OPEN)
+                else:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                return
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._outcomes.clear()
+                self._set_state(OPEN)
+
+    def record_call(self, duration, error=None):
+        """Record an allowed call from its duration and the error it raised, if any"""
+        failed = is_upstream_failure(error) if error is not None else (
+            self.slow_call_seconds is not None and duration > self.slow_call_seconds
+        )
+        self.record(failed)
+
+    def release(self):
+        """Give back an allowed call that never reached the upstream"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def stats(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return {
+            "state": self.state,
+            "recent_calls": len(outcomes),
+            "recent_failures": sum(outcomes),
+            "times_opened": self.opened,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 2),
+        }
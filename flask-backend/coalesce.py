@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import json
+import threading
+
+from cache import normalize_text
+
+
+def request_key(route, message, **options):
+    """Key identifying requests that can share one upstream call"""
+    payload = json.dumps({"route": route, "message": normalize_text(message), "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one, for the threaded server
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.merged = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                self.merged += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        return {"calls": self.calls, "merged": self.merged, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent coroutine calls with the same key, for the async server
+
+    The shared call runs as its own task, so a cancelled caller (e.g. a client
+    that disconnected) doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.merged = 0
+        self._tasks = {}
+
+    async def do(self, key, fn):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self.calls += 1
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.merged += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._tasks.pop(key, None)
+        # Mark the exception as retrieved even if every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {"calls": self.calls, "merged": self.merged, "in_flight": len(self._tasks)}
@@ -0,0 +1,118 @@
+"""
+Context assembly for the cover letter prompt.
+
+Retrieved CV chunks overlap (chunk_cv_content uses a 50 character overlap) and
+often say the same thing twice. `pack_context` trims overlapping text, reranks
+the chunks with maximal marginal relevance (retrieval rank for relevance,
+token overlap for redundancy) and keeps them until the input token budget is
+used up, so the prompt only pays for context that adds something.
+"""
+
+import os
+import re
+
+# Tokens of CV context allowed in the prompt (about three chunks' worth), and how many chunks
+# to retrieve as candidates
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '350'))
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', '8'))
+# Trade-off between relevance (1.0) and novelty (0.0) when reranking
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+# Shortest shared prefix/suffix treated as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+# Chunks whose word sets overlap at least this much with a kept chunk are dropped
+NEAR_DUPLICATE_SIMILARITY = 0.9
+
+# Rough sub-word split: short word pieces and single punctuation marks, which
+# tracks SentencePiece token counts for English prose closely enough for budgeting
+TOKEN_PIECE_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """Local estimate of the number of model tokens in text"""
+    return len(TOKEN_PIECE_PATTERN.findall(text))
+
+
+def _words(text):
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def _similarity(a, b):
+    """Jaccard overlap of two word sets"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def shared_edge(left, right):
+    """Length of the longest end of left that is also the start of right (0 if under MIN_OVERLAP_CHARS)"""
+    if len(right) < MIN_OVERLAP_CHARS:
+        return 0
+    head = right[:MIN_OVERLAP_CHARS]
+    start = left.find(head, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(head, start + 1)
+    return 0
+
+
+def deduplicate(chunks):
+    """Remove repeated, contained and near-duplicate chunks, and text a chunk shares with an earlier kept one"""
+    unique = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk or any(chunk in kept for kept in unique):
+            continue
+        unique = [kept for kept in unique if kept not in chunk]
+        unique.append(chunk)
+
+    trimmed = []
+    for chunk in unique:
+        for kept in trimmed:
+            # chunk continues kept, or kept continues chunk
+            size = shared_edge(kept, chunk)
+            if size:
+                chunk = chunk[size:].strip()
+            else:
+                size = shared_edge(chunk, kept)
+                if size:
+                    chunk = chunk[:-size].strip()
+        words = _words(chunk)
+        if chunk and all(_similarity(words, _words(kept)) < NEAR_DUPLICATE_SIMILARITY for kept in trimmed):
+            trimmed.append(chunk)
+    return trimmed
+
+
+def mmr_order(chunks, lambda_=MMR_LAMBDA):
+    """Reorder chunks (given in retrieval rank order) by maximal marginal relevance"""
+    count = len(chunks)
+    relevance = [1.0 - rank / count for rank in range(count)]
+    words = [_words(chunk) for chunk in chunks]
+    remaining = list(range(count))
+    selected = []
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda i: lambda_ * relevance[i]
+            - (1 - lambda_) * max((_similarity(words[i], words[j]) for j in selected), default=0.0)
+        )
+        selected.append(best)
+        remaining.remove(best)
+    return [chunks[i] for i in selected]
+
+
+def pack_context(chunks, token_budget=CONTEXT_TOKEN_BUDGET):
+    """De-duplicate, rerank and pack retrieved chunks into the token budget
+
+    Returns (packed chunks, estimated tokens). The top chunk is always kept.
+    """
+    packed = []
+    used = 0
+    for chunk in mmr_order(deduplicate(chunks)):
+        tokens = estimate_tokens(chunk)
+        if packed and used + tokens > token_budget:
+            continue
+        packed.append(chunk)
+        used += tokens
+    return packed, used
@@ -1,95 +1,427 @@
 import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import bisect
+import fcntl
+import hashlib
+import json
+import time
+import re
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from chromadb import Documents, EmbeddingFunction, Embeddings
 from chromadb import chromadb
-from google.api_core import retry
-import google.generativeai as genai
+from chromadb.api.shared_system_client import SharedSystemClient
+from chromadb.errors import NotFoundError
 import logging
-from utils.utils import extract_text_from_pdf
+from utils.utils import extract_pages_from_pdf, file_hash, page_start_offsets
+from cache import TTLCache, normalize_text
+from vector_index import NumpyIndex, export_collection
+from lexical import BM25Index, build_from_collection, fuse_results
+from metrics import INGEST_STAGE_SECONDS, span
+from ratelimit import Upstream
+from gemini import sdk
 
 logger = logging.getLogger(__name__)
 
-# Define a helper to retry when per-minute quota is reached.
-is_retriable = lambda e: (isinstance(e, genai.errors.APIError) and e.code in {429, 503})
+# Embedding model and batching settings. The batch embedding API accepts at most
+# 100 texts per request, so larger batch sizes are clamped.
+EMBEDDING_MODEL = "text-embedding-004"
+EMBED_BATCH_SIZE = min(int(os.getenv('EMBED_BATCH_SIZE', '50')), 100)
+EMBED_MAX_WORKERS = int(os.getenv('EMBED_MAX_WORKERS', '4'))
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 50
+# Rate limit, retry budget, backoff and circuit breaker shared by every embedding call in the process
+embedding_upstream = Upstream.from_env("embedding", "EMBEDDING", 1500, 10)
 
-# Setup Chroma DB
-chroma_path = os.path.join('flask-backend', "chroma_db")
-chroma_client = chromadb.PersistentClient(path=chroma_path)
-logger.info(f"Chroma DB path: {os.path.abspath(chroma_path)}")
+# Query embeddings are cached per process, keyed by task type and normalized text,
+# so retries and regenerations of the same job skip the embedding round trip.
+query_embedding_cache = TTLCache(
+    max_size=int(os.getenv('QUERY_CACHE_SIZE', '512')),
+    ttl=int(os.getenv('QUERY_CACHE_TTL', '3600'))
+)
+
+# Setup Chroma DB. The client is opened on first use: a Chroma client doesn't
+# survive fork(), so the server (server.py) imports this module before forking
+# its workers but only opens the client in each worker.
+chroma_path = os.getenv('CHROMA_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"))
+# Touched whenever ingestion changes a collection: one file per collection, plus
+# one for any change. A Chroma client doesn't see another process's writes to the
+# vector index, so other processes reopen their client on any change, and their
+# handles to (and caches for) the collection that changed.
+INDEX_VERSION_FILE = os.path.join(chroma_path, "index_version")
+INDEX_VERSION_DIR = os.path.join(chroma_path, "index_versions")
+# What each collection was last built from (CV file hash and ingestion settings)
+INGESTED_FILE = os.path.join(chroma_path, "ingested.json")
+# Held while (re-)ingesting, so workers and upload jobs don't write the index at the same time
+INGEST_LOCK_FILE = os.path.join(chroma_path, "ingest.lock")
+_chroma_client = None
+_chroma_client_version = None
+_chroma_lock = threading.Lock()
+
+def index_version(collection_name=None):
+    """Modification time of a collection's version file (of any collection's, if None),
+    0 before it was ingested"""
+    path = INDEX_VERSION_FILE if collection_name is None else os.path.join(INDEX_VERSION_DIR, collection_name)
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def mark_index_changed(collection_name):
+    os.makedirs(INDEX_VERSION_DIR, exist_ok=True)
+    # The collection's file first, so a process that sees the new global version also sees it
+    for path in (os.path.join(INDEX_VERSION_DIR, collection_name), INDEX_VERSION_FILE):
+        with open(path, "w") as file:
+            file.write(str(time.time()))
 
 def get_client():
-    return chroma_client
+    """This process's Chroma client, reopened when another process has re-indexed since it was opened"""
+    global _chroma_client, _chroma_client_version
+    version = index_version()
+    if _chroma_client_version != version:
+        with _chroma_lock:
+            if _chroma_client_version != version:
+                if _chroma_client is not None:
+                    # Chroma keeps one client system per path; drop it so the index is loaded again
+                    SharedSystemClient.clear_system_cache()
+                else:
+                    logger.info(f"Chroma DB path: {os.path.abspath(chroma_path)}")
+                _chroma_client = chromadb.PersistentClient(path=chroma_path)
+                _chroma_client_version = version
+    return _chroma_client
+
+# Each CV (tenant) gets its own collection, so a query only searches that CV's
+# index no matter how many CVs are stored. The default CV keeps the original name.
+DEFAULT_CV_ID = "default"
+CV_ID_PATTERN = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,46}[A-Za-z0-9])?$")
+
+def collection_name_for(cv_id=DEFAULT_CV_ID):
+    """Chroma collection name for a CV id; raises ValueError for ids that aren't safe names"""
+    if cv_id == DEFAULT_CV_ID:
+        return "resumeDB"
+    if not isinstance(cv_id, str) or not CV_ID_PATTERN.match(cv_id):
+        raise ValueError("cv_id must be 1-48 letters, digits, '-' or '_', starting and ending with a letter or digit")
+    return f"resumeDB_{cv_id}"
+
+# Retrieval backend: "chroma" queries the Chroma collection; "numpy" queries a
+# memory-mapped export of it (see vector_index.py), refreshed after each re-index
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'chroma')
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', os.path.join(os.path.dirname(chroma_path), "vector_index"))
+
+def index_path_for(collection_name):
+    return os.path.join(VECTOR_INDEX_DIR, collection_name)
+
+# Retrieval mode: "vector" (embeddings only), "hybrid" (BM25 and vector results
+# fused, falling back to BM25 alone when the query can't be embedded in time)
+# or "lexical" (BM25 only, no embedding round trip)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector')
+LEXICAL_INDEX_DIR = os.getenv('LEXICAL_INDEX_DIR', os.path.join(os.path.dirname(chroma_path), "lexical_index"))
+# Candidates taken from each side, per requested result, before fusing
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '4'))
+
+def lexical_path_for(collection_name):
+    return os.path.join(LEXICAL_INDEX_DIR, f"{collection_name}.json")
+
+class CollectionCache:
+    """Bounded LRU of retrieval handles, opened on first use
+
+    Tenants are only loaded when a request needs them, and at most max_size
+    handles are kept. All handles share one (query mode) embedding function.
+    Handles are Chroma collections, or NumpyIndex views of them with the numpy
+    backend; both work with query_collection. When a collection is re-indexed,
+    by this or another process (see index_version), its handles are dropped and
+    on_index_change(cv_id) is called if given; other CVs' handles are kept.
+    """
+
+    def __init__(self, embedding_function, max_size=128, ttl=3600, backend=RETRIEVAL_BACKEND, on_index_change=None):
+        self.embedding_function = embedding_function
+        self.backend = backend
+        self.on_index_change = on_index_change
+        self._handles = TTLCache(max_size=max_size, ttl=ttl)
+        # Version of each collection when it was last seen
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _check_index(self, cv_id, name):
+        version = index_version(name)
+        with self._lock:
+            previous = self._versions.get(name, version)
+            self._versions[name] = version
+        if version != previous:
+            self._handles.clear(lambda key: key in (name, ("count", name), ("bm25", name)))
+            if self.on_index_change is not None:
+                self.on_index_change(cv_id)
+
+    def get(self, cv_id=DEFAULT_CV_ID, create=False):
+        """The collection for a CV id, or None if nothing has been ingested for it (unless create)"""
+        name = collection_name_for(cv_id)
+        self._check_index(cv_id, name)
+        collection = self._handles.get(name)
+        if collection is not None:
+            return collection
+        client = get_client()
+        if create:
+            collection = client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+        else:
+            try:
+                collection = client.get_collection(name=name, embedding_function=self.embedding_function)
+            except NotFoundError:
+                return None
+        if self.backend == "numpy":
+            if not NumpyIndex.exists(index_path_for(name)):
+                export_collection(collection, index_path_for(name))
+            collection = NumpyIndex(index_path_for(name), self.embedding_function)
+        self._handles.set(name, collection)
+        return collection
+
+    def count(self, cv_id=DEFAULT_CV_ID):
+        """Documents stored for a CV id (0 if none), kept until the collection is re-indexed"""
+        name = collection_name_for(cv_id)
+        self._check_index(cv_id, name)
+        count = self._handles.get(("count", name))
+        if count is None:
+            collection = self.get(cv_id)
+            count = collection.count() if collection is not None else 0
+            self._handles.set(("count", name), count)
+        return count
+
+    def lexical(self, cv_id=DEFAULT_CV_ID):
+        """The BM25 index for a CV id, or None if it hasn't been built"""
+        name = collection_name_for(cv_id)
+        self._check_index(cv_id, name)
+        index = self._handles.get(("bm25", name))
+        if index is None:
+            if not BM25Index.exists(lexical_path_for(name)):
+                return None
+            index = BM25Index(lexical_path_for(name))
+            self._handles.set(("bm25", name), index)
+        return index
+
+    def stats(self):
+        return self._handles.stats()
+
+# The most recently uploaded CV (see ingestion.py) takes over from the bundled cv.pdf
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+
+def current_cv_path(cv_id=DEFAULT_CV_ID):
+    """Where the last successfully ingested upload for a CV id is kept"""
+    if cv_id == DEFAULT_CV_ID:
+        return os.path.join(UPLOAD_DIR, "current.pdf")
+    return os.path.join(UPLOAD_DIR, cv_id, "current.pdf")
+
+def default_cv_path():
+    """The CV that embed_cv ingests when no path is given"""
+    if os.path.exists(current_cv_path()):
+        return current_cv_path()
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "cv.pdf")
+
+def ingestion_fingerprint(cv_path):
+    return {"cv_hash": file_hash(cv_path), "embedding_model": EMBEDDING_MODEL,
+            "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+def _read_ingested():
+    try:
+        with open(INGESTED_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def record_ingested(collection_name, fingerprint):
+    ingested = _read_ingested()
+    ingested[collection_name] = fingerprint
+    tmp_path = f"{INGESTED_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(ingested, file)
+    os.replace(tmp_path, INGESTED_FILE)
+
+@contextmanager
+def ingest_lock():
+    """Hold the ingestion lock shared by every process using chroma_path"""
+    os.makedirs(chroma_path, exist_ok=True)
+    with open(INGEST_LOCK_FILE, "w") as lock:
+        # Released when the file is closed, also if this process dies mid-ingestion
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def index_is_current(cv_path=None, cv_id=DEFAULT_CV_ID):
+    """Whether a CV's collection was built from this file with the current settings, so
+    ingesting it again would change nothing; checked without opening Chroma"""
+    cv_path = cv_path or default_cv_path()
+    name = collection_name_for(cv_id)
+    if not os.path.exists(cv_path) or not BM25Index.exists(lexical_path_for(name)):
+        return False
+    if RETRIEVAL_BACKEND == "numpy" and not NumpyIndex.exists(index_path_for(name)):
+        return False
+    return _read_ingested().get(name) == ingestion_fingerprint(cv_path)
+
+@contextmanager
+def ingest_stage(stage, progress=None):
+    """Time an ingestion stage, reporting its start to the optional progress callback"""
+    if progress is not None:
+        progress(stage)
+    with span(stage, INGEST_STAGE_SECONDS):
+        yield
     
+def embed_batch(texts, task_type):
+    """Embed a list of texts with a single batch embedding request"""
+    response = embedding_upstream.call(
+        sdk().embed_content,
+        model=EMBEDDING_MODEL,
+        content=list(texts),
+        task_type=task_type
+    )
+    return response["embedding"]
+
+async def embed_query_async(text, task_type="retrieval_query"):
+    """Async counterpart of the query-mode embedding function, sharing its cache"""
+    key = (task_type, normalize_text(text))
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        response = await embedding_upstream.call_async(
+            sdk().embed_content_async,
+            model=EMBEDDING_MODEL,
+            content=text,
+            task_type=task_type
+        )
+        embedding = response["embedding"]
+        query_embedding_cache.set(key, embedding)
+    return embedding
+
 class GeminiEmbeddingFunction(EmbeddingFunction):
-    document_mode = True
+    def __init__(self, batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_MAX_WORKERS, document_mode=True):
+        self.document_mode = document_mode
+        self.batch_size = max(1, min(batch_size, 100))
+        self.max_workers = max(1, max_workers)
 
-    @retry.Retry(predicate=is_retriable)
     def __call__(self, input: Documents) -> Embeddings:
         task_type = "retrieval_document" if self.document_mode else "retrieval_query"
-        texts = [input] if isinstance(input, str) else input
-        results = []
-        for text in texts:
-            response = genai.embed_content(
-                model="text-embedding-004",
-                content=text,
-                task_type=task_type
-            )
-            results.append(response["embedding"])
+        texts = [input] if isinstance(input, str) else list(input)
+        if self.document_mode:
+            return self._embed(texts, task_type)
+
+        keys = [(task_type, normalize_text(text)) for text in texts]
+        results = [query_embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing:
+            embeddings = self._embed([texts[i] for i in missing], task_type)
+            for i, embedding in zip(missing, embeddings):
+                query_embedding_cache.set(keys[i], embedding)
+                results[i] = embedding
+        return results
+
+    def _embed(self, texts, task_type):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        if len(batches) <= 1:
+            return embed_batch(texts, task_type) if texts else []
+
+        # Batches are embedded concurrently; executor.map keeps them in input order
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+            batch_results = executor.map(lambda batch: embed_batch(batch, task_type), batches)
+            results = []
+            for embeddings in batch_results:
+                results.extend(embeddings)
         return results
 
-def chunk_cv_content(cv_content):
-    """Split CV content into logical chunks with overlap"""
+def chunk_cv_content(cv_content, page_starts=None):
+    """Split CV content into logical chunks with overlap
+
+    page_starts are the offsets where each PDF page begins in cv_content; when
+    given, each chunk gets the (1-based) page it starts on as metadata.
+    """
+    # LangChain takes most of a second to import and is only needed for ingestion
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,
-        chunk_overlap=50,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
-        separators=["\n\n", "\n", " ", ""]
+        separators=["\n\n", "\n", " ", ""],
+        add_start_index=page_starts is not None
     )
     
     chunks = text_splitter.create_documents([cv_content], metadatas=[{"source": "cv"}])
+    if page_starts is not None:
+        for chunk in chunks:
+            start_index = chunk.metadata.pop("start_index", 0)
+            chunk.metadata["page"] = bisect.bisect_right(page_starts, start_index)
     
     print(f"Split CV into {len(chunks)} chunks")
     return chunks
 
-def create_embeddings_and_store(chunks, collection_name="resumeDB"):
-    documents = chunks
+def content_hash(text):
+    """Stable hash of a chunk's text, used as its Chroma id"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_metadata(chunk, chunk_hash):
+    """Chroma metadata for a chunk"""
+    metadata = {"section": identify_cv_section(chunk.page_content), "content_hash": chunk_hash}
+    if "page" in chunk.metadata:
+        metadata["page"] = chunk.metadata["page"]
+    return metadata
+
+def create_embeddings_and_store(chunks, collection_name="resumeDB", progress=None):
+    """Sync the collection with the given chunks, embedding only new or changed ones"""
     embed_fn = GeminiEmbeddingFunction()
     embed_fn.document_mode = True
 
-
-    # Create a collection with the embedding function
-    try:
-        # Delete the collection if it already exists
-        chroma_client.delete_collection(collection_name)
-        print(f"Deleted existing collection '{collection_name}'")
-    except:
-        pass
-
-    # Create a new collection
-    collection = chroma_client.create_collection(
-        name=collection_name, 
+    collection = get_client().get_or_create_collection(
+        name=collection_name,
         embedding_function=embed_fn
     )
-    logger.info(f"Created collection '{collection_name}'")
 
-    # Prepare documents for ChromaDB
-    documents = []
-    metadatas = []
-    ids = []
-    
-    for i, chunk in enumerate(chunks):
-        documents.append(chunk.page_content)
-        metadatas.append({"section": identify_cv_section(chunk.page_content)})
-        ids.append(f"chunk_{i}")
-    
-    # Add documents to the collection
-    collection.add(
-        documents=documents,
-        metadatas=metadatas,
-        ids=ids
-    )
+    # Chunks are keyed by content hash, so unchanged text keeps its id and embedding
+    wanted = {}
+    for chunk in chunks:
+        chunk_hash = content_hash(chunk.page_content)
+        if chunk_hash not in wanted:
+            wanted[chunk_hash] = chunk
+
+    existing = collection.get(include=["metadatas"])
+    existing_hashes = set()
+    stale_ids = []
+    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+        chunk_hash = (metadata or {}).get("content_hash")
+        # Ids stored without a hash (older drop-and-recreate layout) are always stale
+        if chunk_hash in wanted and chunk_hash not in existing_hashes:
+            existing_hashes.add(chunk_hash)
+        else:
+            stale_ids.append(chunk_id)
+
+    new_hashes = [h for h in wanted if h not in existing_hashes]
+
+    if not new_hashes and not stale_ids:
+        logger.info(f"Collection '{collection_name}' is up to date ({len(wanted)} chunks)")
+        if RETRIEVAL_BACKEND == "numpy" and not NumpyIndex.exists(index_path_for(collection_name)):
+            export_collection(collection, index_path_for(collection_name))
+        if not BM25Index.exists(lexical_path_for(collection_name)):
+            build_from_collection(collection, lexical_path_for(collection_name))
+        return collection
 
-    print(f"Added {len(documents)} documents to ChromaDB collection '{collection_name}'")
+    documents = [wanted[h].page_content for h in new_hashes]
+    if documents:
+        with ingest_stage("embed", progress):
+            embeddings = embed_fn(documents)
+    with ingest_stage("store", progress):
+        # Add before deleting so the collection is never empty mid re-index
+        if documents:
+            collection.add(
+                documents=documents,
+                embeddings=embeddings,
+                metadatas=[chunk_metadata(wanted[h], h) for h in new_hashes],
+                ids=[f"chunk_{h}" for h in new_hashes]
+            )
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        if RETRIEVAL_BACKEND == "numpy":
+            export_collection(collection, index_path_for(collection_name))
+        build_from_collection(collection, lexical_path_for(collection_name))
+        mark_index_changed(collection_name)
+
+    logger.info(
+        f"Re-indexed collection '{collection_name}': {len(new_hashes)} added, "
+        f"{len(stale_ids)} removed, {len(wanted) - len(new_hashes)} unchanged"
+    )
     return collection
 
 def identify_cv_section(text):
@@ -111,51 +443,81 @@ def identify_cv_section(text):
     else:
         return "other"
     
-def query_collection(collection, query_text, n_results=3, filter_section=None):
-    """Query the collection for relevant CV sections"""
-    query_params = {
-        "query_texts": [query_text],
-        "n_results": n_results
-    }
+def query_collection(collection, query_text, n_results=3, filter_section=None, query_embedding=None,
+                     lexical_index=None, mode="vector", embedding_function=None):
+    """Query the collection for relevant CV sections
+
+    Pass query_embedding when the query text has already been embedded, so the
+    collection doesn't embed it again. With a lexical_index, mode "lexical"
+    answers from BM25 alone and "hybrid" fuses BM25 and vector results. A query
+    that has to go to the collection without an embedding (e.g. lexical mode
+    before the BM25 index is built) is embedded with embedding_function.
+    """
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return query_collection_batch(
+        collection, [query_text], n_results, filter_section, query_embeddings, lexical_index, mode,
+        embedding_function
+    )[0]
+
+def split_results(results):
+    """Split a multi-query Chroma result into one single-query result per query"""
+    keys = [key for key in ("ids", "documents", "metadatas", "distances") if results.get(key) is not None]
+    return [{key: [results[key][i]] for key in keys} for i in range(len(results["ids"]))]
+
+def query_collection_batch(collection, query_texts, n_results=3, filter_section=None, query_embeddings=None,
+                           lexical_index=None, mode="vector", embedding_function=None):
+    """query_collection for several queries in one collection round trip; returns a result per query"""
+    where = {"section": filter_section} if filter_section else None
+    if lexical_index is not None and mode == "lexical":
+        return split_results(lexical_index.query(query_texts, n_results=n_results, where=where))
+
+    hybrid = lexical_index is not None and mode == "hybrid"
+    query_params = {"n_results": n_results * HYBRID_CANDIDATES if hybrid else n_results}
+    if query_embeddings is None:
+        # Not query_texts: the collection would embed them without the query cache
+        if embedding_function is None:
+            raise ValueError(f"No BM25 index to answer a {mode} query and no embedding function to embed it with")
+        query_embeddings = embedding_function(list(query_texts))
+    query_params["query_embeddings"] = list(query_embeddings)
     
-    if filter_section:
-        query_params["where"] = {"section": filter_section}
+    if where:
+        query_params["where"] = where
     
-    results = collection.query(**query_params)
+    results = split_results(collection.query(**query_params))
+    if hybrid:
+        lexical_results = split_results(
+            lexical_index.query(query_texts, n_results=query_params["n_results"], where=where)
+        )
+        results = [fuse_results(vector, lexical, n_results) for vector, lexical in zip(results, lexical_results)]
     
     return results
 
-def embed_cv():
-    # Later replace this with the an API where i can upload my CV
+def embed_cv(cv_path=None, progress=None, cv_id=DEFAULT_CV_ID):
+    """Extract, chunk and incrementally index a CV into its collection; a no-op when it hasn't changed
+
+    progress, if given, is called with each stage name ("extract", "chunk",
+    "embed", "store") as the stage starts.
+    """
     logger.info("============ Extracting CV text from PDF ============")
-    cv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cv.pdf")
+    if cv_path is None:
+        cv_path = default_cv_path()
     if not os.path.exists(cv_path):
         logger.error(f"CV file not found at {cv_path}")
         raise FileNotFoundError(f"CV file not found at {cv_path}")
 
-    cv_content = extract_text_from_pdf(cv_path)
-    logger.info(f"Extracted {len(cv_content)} characters from CV")
+    fingerprint = ingestion_fingerprint(cv_path)
+    with ingest_stage("extract", progress):
+        pages = extract_pages_from_pdf(cv_path)
+        cv_content = "".join(pages)
+    logger.info(f"Extracted {len(cv_content)} characters from {len(pages)} CV pages")
 
 
     # Chunk CV content
-    chunks = chunk_cv_content(cv_content)
+    with ingest_stage("chunk", progress):
+        chunks = chunk_cv_content(cv_content, page_start_offsets(pages))
     
-    # Create embeddings and store in ChromaDB
-    collection = create_embeddings_and_store(chunks)
+    # Embed new or changed chunks and store in ChromaDB
+    collection = create_embeddings_and_store(chunks, collection_name_for(cv_id), progress=progress)
+    record_ingested(collection_name_for(cv_id), fingerprint)
 
-    # Example queries for cover letter generation
-    print("\nExample Queries for Cover Letter Agent:")
-    
-    # Query for relevant work experience
-    print("\n1. Finding relevant work experience for a React developer position:")
-    results = query_collection(collection, "React developer experience frontend", filter_section="work_experience")
-    for i, doc in enumerate(results['documents'][0]):
-        print(f"\nResult {i+1}:")
-        print(doc)
-    
-    # Query for relevant skills
-    # print("\n2. Finding relevant technical skills for a fullstack position:")
-    # results = query_collection(collection, "fullstack development skills", filter_section="skills")
-    # for i, doc in enumerate(results['documents'][0]):
-    #     print(f"\nResult {i+1}:")
-    #     print(doc)
\ No newline at end of file
+    return collection
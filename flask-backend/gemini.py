@@ -0,0 +1,38 @@
+"""
+The Gemini SDK, imported and configured on first use.
+
+Importing google.generativeai takes about a second, so modules that call
+Gemini get the SDK through `sdk()` rather than importing it at the top, and the
+app can start serving before the SDK has been loaded.
+"""
+
+import os
+import threading
+
+_lock = threading.Lock()
+_sdk = None
+
+
+def sdk():
+    """The google.generativeai module, configured with GOOGLE_API_KEY"""
+    global _sdk
+    if _sdk is None:
+        with _lock:
+            if _sdk is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+                _sdk = genai
+    return _sdk
+
+
+class LazyModel:
+    """Stands in for a GenerativeModel, creating it on first use"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._model = None
+
+    def __getattr__(self, name):
+        if self._model is None:
+            self._model = sdk().GenerativeModel(model_name=self.model_name)
+        return getattr(self._model, name)
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+from cache import GenerationCache, SemanticCache, TTLCache, normalize_text
+from circuit import UPSTREAM_FAILURES
+from metrics import DEGRADED_RESPONSES, record_usage
+from prefix_cache import PrefixCache
+from ratelimit import Upstream, UpstreamOverloaded
+from request_logging import annotate
+
+logger = logging.getLogger(__name__)
+
+# Opt-in cache of generated letters, keyed by the final prompt and generation config.
+# Requests can bypass it with "regenerate": true to get a fresh letter.
+generation_cache = GenerationCache(
+    enabled=os.getenv('GENERATION_CACHE_ENABLED', 'false').lower() == 'true',
+    max_size=int(os.getenv('GENERATION_CACHE_SIZE', '256')),
+    ttl=int(os.getenv('GENERATION_CACHE_TTL', '86400')),
+    db_path=os.getenv('GENERATION_CACHE_DB') or None
+)
+
+# Opt-in cache that reuses a cover letter for near-duplicate job descriptions,
+# matched by cosine similarity of the query embedding already used for retrieval.
+semantic_cache = SemanticCache(
+    enabled=os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true',
+    threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95')),
+    max_size=int(os.getenv('SEMANTIC_CACHE_SIZE', '256')),
+    ttl=int(os.getenv('SEMANTIC_CACHE_TTL', '86400'))
+)
+
+# Last letter generated per (cv_id, job description). Only read when generation is
+# unavailable, to answer a repeat request for the same job with its earlier letter.
+fallback_letters = TTLCache(
+    max_size=int(os.getenv('FALLBACK_LETTER_CACHE_SIZE', '256')),
+    ttl=int(os.getenv('FALLBACK_LETTER_CACHE_TTL', '86400'))
+)
+
+# Model configuration for the RAG cover letter endpoint
+COVER_LETTER_GENERATION_CONFIG = {
+    "max_output_tokens": 1024,
+    "temperature": 0.2,
+    "top_p": 0.95
+}
+
+# Model configuration for the plain chat endpoint
+CHAT_GENERATION_CONFIG = {
+    "max_output_tokens": 1048,
+    "temperature": 0.4,
+    "top_p": 0.90
+}
+
+# The static part of the cover letter prompt: role, example letter and writing
+# instructions. It comes first so that it is a stable prefix that can be cached
+# upstream; only the resume context and job description after it vary.
+COVER_LETTER_PREFIX = """
+        You are an expert in writing tailored cover letters. Given a resume and a job description, write a customized, professional, and engaging cover letter.
+        
+        ### Example 1:
+        Dear Hiring Team,
+
+        When I reduced customer onboarding time by 45% through an intuitive internal application at
+        Onestoptransformation, I witnessed firsthand how thoughtful frontend engineering directly impacts user
+        experience. This powerful connection between code and human wellbeing aligns perfectly with
+        Gymondo's mission of helping people lead healthier lives through accessible digital fitness solutions.
+
+        My frontend development journey includes:
+        ● Professional experience with React, Vue.js, TypeScript and JavaScript
+        ● Designing UI components and establishing TypeScript-based npm libraries at SevenCs
+        ● Implementing robust validation and testing mechanisms for reliable application performance
+        ● Integrating and consuming REST APIs across multiple production applications
+        ● Collaborating with cross-functional teams to translate user needs into technical solutions
+
+        At SevenCs, I developed MyRA Web, a digital routing service enhancing maritime navigation, where I
+        created robust UI components while maintaining a keen focus on user experience. This project
+        demanded clean, maintainable code that could reliably display complex real-time data—skills directly
+        transferable to developing engaging fitness interfaces at Gymondo.
+
+        During my time at Learnship GmbH, I contributed to feature development for multiple platforms while
+        modernizing legacy systems. This experience taught me to balance innovation with
+        maintainability—creating code that not only works but scales efficiently. I became adept at refactoring
+        existing codebases while adding new functionality, a valuable skill for evolving applications.
+        My internship at Onestoptransformation provided hands-on experience setting up CI/CD pipelines and
+        writing comprehensive test cases, demonstrating my commitment to code quality and standardized
+        practices. I embraced peer code reviews as opportunities for growth, refining my ability to both give and
+        receive constructive feedback—an essential aspect of Gymondo's collaborative development culture.
+
+        I'm particularly excited about Gymondo's commitment to continuous learning and growth, as I
+        consistently seek out opportunities to expand my technical knowledge and stay current with frontend
+        innovations. Your collaborative approach to development, including code reviews and team
+        problem-solving, resonates with my own development philosophy of learning through shared expertise.
+        
+        I am available to relocate as needed, hold a valid work permit, and am fluent in English with intermediate
+        German proficiency. I would welcome the opportunity to discuss how my technical skills and passion for
+        creating impactful user experiences could contribute to Gymondo's mission of helping people lead
+        healthier lives through engaging digital fitness solutions.
+
+        Sincerely,
+        Mohammed Sarfaraz
+
+        ### Instructions:
+        Write a compelling and concise cover letter (max 450 words).
+
+        It should:
+
+        1. Start with an attention-grabbing and personalized opening
+        2. Highlight my relevant experience from my resume, including:
+            - Work at Learnship GmbH (HALO, Elevate, Solo platforms)
+            - React + TypeScript npm library for MyRA Web at SevenCs
+            - Use of testing frameworks (Testing Library, Cypress)
+        3. Address key job requirements like:
+            - Strong JavaScript/TypeScript and React skills
+            - Writing DRY, maintainable code
+            - Familiarity with Git, HTML, CSS, testing
+        4. Include a concrete example of overcoming a technical challenge (e.g. integrating a third-party mapping library)
+        5. Emphasize my strengths:
+            - Collaborative mindset
+            - Passion for scalable and user-friendly solutions
+            - Growth mindset toward technical leadership
+        6. Explain why I want to join ePages specifically (their mission to empower SMBs, focus on innovation, e-commerce impact)
+        7. Clearly state:
+            - I hold a valid work permit, am available to relocate
+            - Fluent in English, intermediate German
+
+        End professionally with a closing paragraph
+
+        Use this format for the closing:
+
+        Sincerely,
+        Mohammed Sarfaraz
+"""
+
+def build_cover_letter_request(matched_chunks, message):
+    """The per-request part of the cover letter prompt, sent after COVER_LETTER_PREFIX"""
+    resume_context = "\n\n".join(matched_chunks)
+    return f"""
+        ### Now Your Turn:
+        **Resume:**
+        {resume_context}
+        
+        **Job Description (Summary):**
+        {message}
+        """
+
+def build_cover_letter_prompt(matched_chunks, message):
+    """Create a structured prompt for cover letter generation from the matched CV chunks"""
+    return COVER_LETTER_PREFIX + build_cover_letter_request(matched_chunks, message)
+
+# Opt-in upstream caching of COVER_LETTER_PREFIX (Gemini context caching needs an
+# explicitly versioned model name); requests fall back to the full prompt when
+# the cache can't be created or used.
+prefix_cache = PrefixCache(
+    model_name=os.getenv('PREFIX_CACHE_MODEL', 'models/gemini-2.0-flash-001'),
+    prefix=COVER_LETTER_PREFIX,
+    enabled=os.getenv('PREFIX_CACHE_ENABLED', 'false').lower() == 'true',
+    ttl=int(os.getenv('PREFIX_CACHE_TTL', '3600')),
+    retry_after=int(os.getenv('PREFIX_CACHE_RETRY_AFTER', '600'))
+)
+
+# Rate limit, retry budget, backoff and circuit breaker shared by every generation call in the process
+generation_upstream = Upstream.from_env("generation", "GENERATION", 2000, 30)
+
+DEGRADED_NOTICE = (
+    "The cover letter generator is temporarily unavailable. "
+    "In the meantime, these are the parts of your CV that best match the job:"
+)
+
+# Errors meaning Gemini is unavailable (shed locally or failing), rather than a bad request
+UNAVAILABLE_ERRORS = (UpstreamOverloaded,) + UPSTREAM_FAILURES
+
+def remember_letter(message, cv_id, text):
+    fallback_letters.set((cv_id, normalize_text(message)), text)
+
+def degraded_cover_letter(error, message, cv_id, prompt, query_embedding, matched_chunks):
+    """Answer without generation: an earlier letter for the same job if there is one (even
+    when regenerating), otherwise the retrieved CV excerpts; None if there is neither"""
+    reason = getattr(error, 'reason', None) or type(error).__name__
+    cached_text = (generation_cache.get(prompt, COVER_LETTER_GENERATION_CONFIG)
+                   or fallback_letters.get((cv_id, normalize_text(message))))
+    if cached_text is None and query_embedding is not None:
+        semantic_hit = semantic_cache.get(query_embedding, scope=cv_id)
+        cached_text = semantic_hit[0] if semantic_hit is not None else None
+    if cached_text is None and not matched_chunks:
+        return None
+
+    kind = 'cached' if cached_text is not None else 'excerpts'
+    logger.warning(f"Generation unavailable ({reason}), answering with {kind}")
+    DEGRADED_RESPONSES.inc(kind=kind)
+    annotate(degraded=kind)
+    if cached_text is not None:
+        return {'response': cached_text, 'degraded': kind, 'reason': reason}
+    excerpts = "\n\n".join(f"- {chunk}" for chunk in matched_chunks)
+    return {'response': f"{DEGRADED_NOTICE}\n\n{excerpts}", 'degraded': kind, 'reason': reason,
+            'excerpts': matched_chunks}
+
+def build_chat_prompt(message):
+    """Create the prompt for the plain chat endpoint"""
+    prompt = f"""
+        I need to write a cover letter for a job application. Here's information about me:
+        
+        My CV/Resume:
+    
+        Job Details:
+        {message}        
+        """
+
+    prompt += """
+        Write a compelling cover letter that:
+        1. Has an attention-grabbing opening
+        2. Highlights my relevant experience from my resume
+        3. Addresses key requirements mentioned in the job description
+        4. Includes a specific example of how I overcame a challenge in a previous role
+        5. Emphasizes my unique selling points 
+        6. Explains why I'm passionate about joining this specific company
+        8. Add a personal touch. 
+        7. Mentions I am available to relocate with a valid work permit and have fluent English and intermediate German
+        8. Limit to 380 words maximum
+        
+        Structure the letter professionally with proper greeting and closing.
+        """
+    return prompt
+
+def get_response_text(response):
+    """Handle the different Gemini response formats and return the text"""
+    if hasattr(response, 'text'):
+        return response.text
+    elif hasattr(response, 'parts'):
+        return ' '.join([part.text for part in response.parts if hasattr(part, 'text')])
+    return str(response)
+
+def chunk_text(chunk):
+    """Text of a streamed chunk; chunks without text parts (e.g. the final one) give ''"""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def usage_to_dict(response):
+    """Token usage reported by Gemini for a response, as a plain dict"""
+    usage = getattr(response, 'usage_metadata', None)
+    return {
+        "prompt_token_count": getattr(usage, 'prompt_token_count', None),
+        "candidates_token_count": getattr(usage, 'candidates_token_count', None),
+        "cached_content_token_count": getattr(usage, 'cached_content_token_count', None),
+        "total_token_count": getattr(usage, 'total_token_count', None)
+    }
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_events(response, finish=None):
+    """Forward a streaming Gemini response as 'token' events, then a final 'done' event
+
+    finish is the callback from Upstream.call_stream, told how reading the stream went.
+    """
+    parts = []
+    try:
+        for chunk in response:
+            text = chunk_text(chunk)
+            if text:
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        usage = usage_to_dict(response)
+    except Exception as e:
+        logger.exception(f"Error while streaming response: {str(e)}")
+        if finish is not None:
+            finish(e)
+        yield sse_event("error", {"error": str(e)})
+        return
+    except GeneratorExit:
+        # The client went away mid-stream
+        if finish is not None:
+            finish(abandoned=True)
+        raise
+    if finish is not None:
+        finish()
+    record_usage(usage)
+    yield sse_event("done", {"response": "".join(parts), "usage": usage})
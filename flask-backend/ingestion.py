@@ -0,0 +1,179 @@
+"""
+Background CV ingestion.
+
+Uploaded CVs are queued as jobs and ingested by a single background worker
+thread through embedder.embed_cv (extract -> chunk -> embed -> store), so the
+upload request only saves the file and returns a job id. Jobs run one at a
+time because each one re-syncs the whole collection. The status of the last
+INGEST_JOB_HISTORY jobs, with per-stage progress and timings, is kept in
+SQLite, so any server worker can answer for a job another worker is running.
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from embedder import DEFAULT_CV_ID
+
+logger = logging.getLogger(__name__)
+
+INGEST_STAGES = ("extract", "chunk", "embed", "store")
+# Uploads waiting beyond this many are rejected rather than queued
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '16'))
+INGEST_JOB_HISTORY = int(os.getenv('INGEST_JOB_HISTORY', '100'))
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'ingest_jobs.db')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestionQueue:
+    """Runs ingestion jobs on a background thread and tracks their progress
+
+    `ingest(path, progress, cv_id)` does the work and returns the collection; it
+    calls `progress(stage)` as each stage starts.
+    """
+
+    def __init__(self, ingest, max_pending=INGEST_QUEUE_SIZE, history=INGEST_JOB_HISTORY, db_path=DEFAULT_DB_PATH):
+        self.ingest = ingest
+        self.history = history
+        self.db_path = db_path
+        self.completed = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._conn = None
+
+    def _db(self):
+        """The SQLite connection, opened on first use (with self._lock held)"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS ingest_jobs (id TEXT PRIMARY KEY, created_at REAL NOT NULL,"
+                    " job TEXT NOT NULL)"
+                )
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _status(job):
+        return json.dumps({key: value for key, value in job.items() if key != "cv_path"})
+
+    def _save(self, job):
+        """Update a job's status (with self._lock held); a job already dropped from the history stays dropped"""
+        with self._db() as db:
+            db.execute("UPDATE ingest_jobs SET job = ? WHERE id = ?", (self._status(job), job["id"]))
+
+    def submit(self, cv_path, job_id=None, cv_id=DEFAULT_CV_ID):
+        """Queue a CV for ingestion and return the new job's status"""
+        job_id = job_id or uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "cv_id": cv_id,
+            "status": "queued",
+            "stage": None,
+            "stages": {stage: {"status": "pending"} for stage in INGEST_STAGES},
+            "created_at": time.time(),
+            "cv_path": cv_path,
+        }
+        with self._lock:
+            self._start_worker()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"{self._queue.qsize()} CV uploads are already waiting")
+            with self._db() as db:
+                db.execute("INSERT OR REPLACE INTO ingest_jobs (id, created_at, job) VALUES (?, ?, ?)",
+                           (job_id, job["created_at"], self._status(job)))
+                db.execute(
+                    "DELETE FROM ingest_jobs WHERE id NOT IN"
+                    " (SELECT id FROM ingest_jobs ORDER BY created_at DESC LIMIT ?)",
+                    (self.history,)
+                )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """A job's status, or None for unknown (or expired) jobs"""
+        with self._lock:
+            row = self._db().execute("SELECT job FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "worker_alive": self._worker is not None and self._worker.is_alive(),
+        }
+
+    def _start_worker(self):
+        # Started lazily so importing the app doesn't spawn a thread
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="cv-ingestion", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            self._process(job)
+            self._queue.task_done()
+
+    def _process(self, job):
+        current = {"stage": None, "start": None}
+
+        def progress(stage):
+            if stage == current["stage"]:
+                return
+            now = time.perf_counter()
+            with self._lock:
+                self._close_stage(job, current, now)
+                job["stage"] = stage
+                job["stages"][stage]["status"] = "running"
+                self._save(job)
+            current["stage"], current["start"] = stage, now
+
+        with self._lock:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            self._save(job)
+        try:
+            chunks = self.ingest(job["cv_path"], progress, job["cv_id"]).count()
+            with self._lock:
+                self._close_stage(job, current, time.perf_counter())
+                for state in job["stages"].values():
+                    if state["status"] == "pending":
+                        state["status"] = "skipped"
+                job["status"] = "done"
+                job["chunks"] = chunks
+            self.completed += 1
+        except Exception as e:
+            logger.exception(f"CV ingestion job {job['id']} failed: {e}")
+            with self._lock:
+                if current["stage"] is not None:
+                    job["stages"][current["stage"]]["status"] = "failed"
+                job["status"] = "failed"
+                job["error"] = str(e)
+            self.failed += 1
+        finally:
+            with self._lock:
+                job["stage"] = None
+                job["finished_at"] = time.time()
+                self._save(job)
+
+    @staticmethod
+    def _close_stage(job, current, now):
+        if current["stage"] is None:
+            return
+        state = job["stages"][current["stage"]]
+        state["status"] = "done"
+        state["ms"] = round(state.get("ms", 0) + (now - current["start"]) * 1000, 2)
@@ -0,0 +1,359 @@
+"""
+Persistent queue for cover letter generations that run outside the HTTP request.
+
+Jobs are stored in SQLite, so queued jobs survive a restart, and are run by
+worker threads in two lanes: "interactive" (single requests sent with
+"async": true) and "bulk" (async batch requests), each with its own workers so
+a large batch can't hold up interactive jobs. Within a lane, higher priority
+jobs run first, then oldest first.
+
+A worker claims a job by taking a lease on it; a job whose lease ran out (its
+process died mid-job) is picked up again. Jobs that fail because Gemini is
+unavailable are retried later with backoff, up to JOB_MAX_ATTEMPTS. Results
+are fetched by polling the job, or POSTed as JSON to the job's callback URL.
+
+Callbacks are sent by their own threads, so a slow or failing callback URL
+doesn't hold up a generation worker. A finished job's callback is leased like
+a job, so one its process didn't get to send (it stopped or restarted first)
+is sent by another process, or this one after a restart, once the lease runs
+out. So a callback may be sent more than once, but isn't lost. A callback URL must be http(s), on an
+allowed host when an allowlist is set, and resolve only to public addresses;
+it is checked when the job is submitted and again before each delivery, and
+redirects aren't followed.
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "bulk")
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'jobs.db')
+# A running job whose worker hasn't finished it after this long is handed to another worker
+JOB_LEASE_SECONDS = 300
+# How often idle workers look for jobs queued by other processes
+POLL_INTERVAL = 1.0
+CALLBACK_ATTEMPTS = 3
+CALLBACK_TIMEOUT = 10
+CALLBACK_WORKERS = 2
+# A callback not sent this long after its job finished is picked up by another callback thread;
+# longer than delivery can take (CALLBACK_ATTEMPTS timeouts plus the backoff between them)
+CALLBACK_LEASE_SECONDS = 60
+
+
+class RefuseRedirects(urllib.request.HTTPRedirectHandler):
+    """A redirect could point a checked callback URL at an internal address, so treat it as a failure"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+callback_opener = urllib.request.build_opener(RefuseRedirects)
+
+
+def check_callback_url(url, allowed_hosts=()):
+    """Raise ValueError unless url is an http(s) URL on an allowed host that resolves only to public
+    addresses. An allowed host is an exact hostname, or ".example.com" for any subdomain of example.com."""
+    try:
+        parsed = urllib.parse.urlsplit(str(url))
+        host, port = parsed.hostname, parsed.port
+    except ValueError:
+        raise ValueError('callback_url is not a valid URL')
+    if parsed.scheme not in ('http', 'https') or not host:
+        raise ValueError('callback_url must be an http(s) URL')
+    host = host.rstrip('.')
+    if allowed_hosts and not any(host == allowed or (allowed.startswith('.') and host.endswith(allowed))
+                                 for allowed in allowed_hosts):
+        raise ValueError(f"callback_url host '{host}' is not allowed")
+    try:
+        addresses = socket.getaddrinfo(host, port or (443 if parsed.scheme == 'https' else 80),
+                                       proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"callback_url host '{host}' can't be resolved")
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split('%')[0])
+        # Not global covers private, loopback, link-local (e.g. 169.254.169.254) and reserved ranges
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"callback_url host '{host}' resolves to a non-public address")
+
+
+class RetryLater(Exception):
+    """Raised by a job runner to put the job back in the queue for a later attempt"""
+
+
+class GenerationJobQueue:
+    """SQLite-backed priority queue of generation jobs with per-lane worker threads
+
+    `run(payload, last_attempt)` does the work and returns the JSON-serializable
+    result; it raises RetryLater when the job should be attempted again later.
+    """
+
+    def __init__(self, run, db_path=DEFAULT_DB_PATH, workers=None, max_attempts=3, retry_delay=30,
+                 retention=7 * 86400, callback_hosts=()):
+        self.run = run
+        self.db_path = db_path
+        self.workers = workers or {"interactive": 4, "bulk": 2}
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = retention
+        self.callback_hosts = [host.lower() for host in callback_hosts]
+        self._threads = []
+        self._callback_threads = []
+        self._callbacks = queue.SimpleQueue()
+        self._wake = {lane: threading.Event() for lane in LANES}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        """The SQLite connection, opened on first use (with self._lock held)"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id TEXT PRIMARY KEY, lane TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL,"
+                    " payload TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+                    " callback_url TEXT, callback_status TEXT, created_at REAL NOT NULL, run_after REAL NOT NULL,"
+                    " lease_until REAL, started_at REAL, finished_at REAL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (lane, status, priority DESC, created_at)"
+                )
+            self._conn = conn
+        return self._conn
+
+    def check_callback_url(self, url):
+        """Raise ValueError if url can't be used as a callback URL"""
+        check_callback_url(url, self.callback_hosts)
+
+    def submit(self, payload, lane="interactive", priority=0, callback_url=None):
+        """Queue a job and return its status"""
+        if lane not in LANES:
+            raise ValueError(f"Unknown job lane '{lane}'")
+        if callback_url is not None:
+            self.check_callback_url(callback_url)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._db() as db:
+            db.execute(
+                "INSERT INTO jobs (id, lane, priority, status, payload, callback_url, created_at, run_after)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, lane, int(priority), json.dumps(payload), callback_url, now, now)
+            )
+        self.start()
+        self._wake[lane].set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """A job's status (with its result once done), or None for unknown or expired jobs"""
+        with self._lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row["id"],
+            "lane": row["lane"],
+            "priority": row["priority"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        if row["callback_url"]:
+            job["callback_status"] = row["callback_status"] or "pending"
+        return job
+
+    def stats(self):
+        with self._lock:
+            rows = self._db().execute("SELECT lane, status, COUNT(*) FROM jobs GROUP BY lane, status").fetchall()
+        counts = {lane: {} for lane in LANES}
+        for lane, status, count in rows:
+            counts.setdefault(lane, {})[status] = count
+        return {
+            "lanes": counts,
+            "workers": dict(self.workers),
+            "workers_alive": sum(thread.is_alive() for thread in self._threads),
+        }
+
+    def start(self):
+        """Start the worker threads (once); called on submit and at startup to resume queued jobs"""
+        with self._lock:
+            if self._threads or self._callback_threads:
+                return
+            for lane in LANES:
+                for number in range(self.workers.get(lane, 0)):
+                    thread = threading.Thread(target=self._work, args=(lane,), name=f"jobs-{lane}-{number}",
+                                              daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            for number in range(CALLBACK_WORKERS):
+                thread = threading.Thread(target=self._send_callbacks, name=f"jobs-callback-{number}", daemon=True)
+                thread.start()
+                self._callback_threads.append(thread)
+
+    def has_pending(self):
+        """Whether there are jobs to run or callbacks to send"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT 1 FROM jobs WHERE status IN ('queued', 'running')"
+                " OR (callback_url IS NOT NULL AND callback_status IS NULL) LIMIT 1"
+            ).fetchone()
+        return row is not None
+
+    def _claim(self, lane):
+        """Lease the next runnable job in a lane: queued and due, or running with an expired lease"""
+        now = time.time()
+        while True:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "SELECT id, attempts FROM jobs WHERE lane = ? AND ((status = 'queued' AND run_after <= ?)"
+                    " OR (status = 'running' AND lease_until < ?)) ORDER BY priority DESC, created_at LIMIT 1",
+                    (lane, now, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                with db:
+                    # Another process may have claimed it between the select and the update
+                    claimed = db.execute(
+                        "UPDATE jobs SET status = 'running', lease_until = ?, started_at = ?, attempts = ?"
+                        " WHERE id = ? AND attempts = ?",
+                        (now + JOB_LEASE_SECONDS, now, row["attempts"] + 1, row["id"], row["attempts"])
+                    ).rowcount
+                if claimed:
+                    return db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def _work(self, lane):
+        while True:
+            try:
+                job = self._claim(lane)
+            except Exception as e:
+                logger.exception(f"Error claiming a {lane} generation job: {e}")
+                job = None
+            if job is None:
+                self._wake[lane].wait(POLL_INTERVAL)
+                self._wake[lane].clear()
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        last_attempt = job["attempts"] >= self.max_attempts
+        try:
+            result = self.run(json.loads(job["payload"]), last_attempt)
+        except RetryLater as e:
+            if not last_attempt:
+                delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                logger.warning(f"Generation job {job['id']} will be retried in {delay}s: {e}")
+                self._update(job["id"], status="queued", run_after=time.time() + delay, lease_until=None,
+                             error=str(e))
+                return
+            self._finish(job, "failed", error=str(e))
+        except Exception as e:
+            logger.exception(f"Generation job {job['id']} failed: {e}")
+            self._finish(job, "failed", error=str(e))
+        else:
+            self._finish(job, "done", result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        now = time.time()
+        # For a job with a callback, the lease now covers sending the callback
+        lease_until = now + CALLBACK_LEASE_SECONDS if job["callback_url"] else None
+        self._update(job["id"], status=status, result=json.dumps(result) if result is not None else None,
+                     error=error, lease_until=lease_until, finished_at=now)
+        if job["callback_url"]:
+            self._callbacks.put((job["id"], job["callback_url"]))
+        self._prune()
+
+    def _claim_callback(self):
+        """Lease an unsent callback whose lease ran out (or that never had one); returns (job_id, url) or None"""
+        now = time.time()
+        while True:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "SELECT id, callback_url, lease_until FROM jobs WHERE status IN ('done', 'failed')"
+                    " AND callback_url IS NOT NULL AND callback_status IS NULL"
+                    " AND (lease_until IS NULL OR lease_until < ?) LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                with db:
+                    claimed = db.execute(
+                        "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_until IS ?",
+                        (now + CALLBACK_LEASE_SECONDS, row["id"], row["lease_until"])
+                    ).rowcount
+                if claimed:
+                    return row["id"], row["callback_url"]
+
+    def _send_callbacks(self):
+        while True:
+            try:
+                job_id, url = self._callbacks.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                try:
+                    claimed = self._claim_callback()
+                except Exception as e:
+                    logger.exception(f"Error claiming a generation job callback: {e}")
+                    claimed = None
+                if claimed is None:
+                    continue
+                job_id, url = claimed
+                logger.info(f"Sending the callback for generation job {job_id}, left unsent by a previous run")
+            try:
+                self._update(job_id, callback_status=self._deliver(url, self.get(job_id)))
+            except Exception as e:
+                logger.exception(f"Error sending the callback for generation job {job_id}: {e}")
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db() as db:
+            db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _deliver(self, url, job):
+        """POST the finished job to its callback URL, retrying with backoff; returns the delivery status"""
+        try:
+            # Checked again in case the host's DNS changed since the job was submitted
+            check_callback_url(url, self.callback_hosts)
+        except ValueError as e:
+            logger.warning(f"Callback for generation job {job['id']} not sent: {e}")
+            return f"failed: {e}"
+        body = json.dumps(job).encode("utf-8")
+        for attempt in range(CALLBACK_ATTEMPTS):
+            request = urllib.request.Request(url, data=body, method="POST",
+                                             headers={"Content-Type": "application/json"})
+            try:
+                with callback_opener.open(request, timeout=CALLBACK_TIMEOUT) as response:
+                    return f"delivered ({response.status})"
+            except Exception as e:
+                logger.warning(f"Callback for generation job {job['id']} to {url} failed: {e}")
+                error = str(e)
+                if attempt + 1 < CALLBACK_ATTEMPTS:
+                    time.sleep(2 ** attempt)
+        return f"failed: {error}"
+
+    def _prune(self):
+        """Drop finished jobs older than the retention period"""
+        with self._lock, self._db() as db:
+            db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.retention,)
+            )
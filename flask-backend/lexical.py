@@ -0,0 +1,152 @@
+"""
+BM25 lexical index over a collection's chunks, and rank fusion with vector results.
+
+The index is built at ingestion time and saved as JSON next to the Chroma
+data. `BM25Index.query` returns Chroma's result shape, so it can answer on its
+own (no embedding round trip) or be fused with vector results through
+`fuse_results` (reciprocal rank fusion), which keeps exact keyword matches such
+as "TypeScript" or "Cypress" near the top.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# Keeps tech tokens like "c++", "c#", "node.js" and "ci/cd" pieces intact
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#.]*[a-z0-9+#]|[a-z0-9]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or our that the this to we will with "
+    "you your who what which how us".split()
+)
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def build_index(path, ids, documents, metadatas):
+    """Build a BM25 index for the given chunks and save it to path"""
+    term_frequencies = [Counter(tokenize(document)) for document in documents]
+    postings = {}
+    for doc_index, frequencies in enumerate(term_frequencies):
+        for term, frequency in frequencies.items():
+            postings.setdefault(term, []).append([doc_index, frequency])
+
+    index = {
+        "ids": list(ids),
+        "documents": list(documents),
+        "metadatas": [dict(m or {}) for m in metadatas],
+        "lengths": [sum(frequencies.values()) for frequencies in term_frequencies],
+        "postings": postings,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(index, file)
+    os.replace(tmp_path, path)
+
+
+def build_from_collection(collection, path):
+    """Build the BM25 index for everything stored in a Chroma collection"""
+    data = collection.get(include=["documents", "metadatas"])
+    build_index(path, data["ids"], data["documents"], data["metadatas"])
+
+
+class BM25Index:
+    """Loaded BM25 index, queried like a Chroma collection (query_texts only)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._state = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(path)
+
+    def _refresh(self):
+        """Reload the index if it was rebuilt since it was loaded"""
+        mtime = os.stat(self.path).st_mtime_ns
+        state = self._state
+        if state is not None and state["mtime"] == mtime:
+            return state
+        with self._lock:
+            if self._state is None or self._state["mtime"] != mtime:
+                with open(self.path) as file:
+                    index = json.load(file)
+                count = len(index["ids"])
+                average_length = sum(index["lengths"]) / count if count else 0.0
+                index["idf"] = {
+                    term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for term, postings in index["postings"].items()
+                }
+                index["norms"] = [
+                    BM25_K1 * (1 - BM25_B + BM25_B * length / average_length) if average_length else BM25_K1
+                    for length in index["lengths"]
+                ]
+                index["mtime"] = mtime
+                self._state = index
+            return self._state
+
+    def count(self):
+        return len(self._refresh()["ids"])
+
+    def scores(self, query_text):
+        """BM25 score per chunk index, for chunks matching at least one query term"""
+        state = self._refresh()
+        scores = {}
+        # Job descriptions repeat keywords; each distinct term counts once
+        for term in set(tokenize(query_text)):
+            idf = state["idf"].get(term)
+            if idf is None:
+                continue
+            for doc_index, frequency in state["postings"][term]:
+                norm = state["norms"][doc_index]
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores
+
+    def query(self, query_texts, n_results=10, where=None):
+        """Top BM25 matches; returns the same shape as Chroma's collection.query"""
+        state = self._refresh()
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_text in query_texts:
+            scores = self.scores(query_text)
+            if where:
+                scores = {i: s for i, s in scores.items()
+                          if all(state["metadatas"][i].get(k) == v for k, v in where.items())}
+            top = sorted(scores, key=scores.get, reverse=True)[:n_results]
+            results["ids"].append([state["ids"][i] for i in top])
+            results["documents"].append([state["documents"][i] for i in top])
+            results["metadatas"].append([state["metadatas"][i] for i in top])
+            # Lower is better, as with Chroma distances
+            results["distances"].append([-scores[i] for i in top])
+        return results
+
+
+def fuse_results(vector_results, lexical_results, n_results, rrf_k=RRF_K):
+    """Reciprocal rank fusion of two single-query result sets, in Chroma's result shape"""
+    fused = {}
+    entries = {}
+    for results in (vector_results, lexical_results):
+        for rank, chunk_id in enumerate(results["ids"][0]):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            if chunk_id not in entries:
+                metadatas = results.get("metadatas")
+                entries[chunk_id] = (
+                    results["documents"][0][rank],
+                    metadatas[0][rank] if metadatas else None,
+                )
+    top = sorted(fused, key=fused.get, reverse=True)[:n_results]
+    return {
+        "ids": [top],
+        "documents": [[entries[chunk_id][0] for chunk_id in top]],
+        "metadatas": [[entries[chunk_id][1] for chunk_id in top]],
+        "distances": [[-fused[chunk_id] for chunk_id in top]],
+    }
@@ -1,42 +1,369 @@
-import google.generativeai as genai
-from google.api_core import retry
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import logging
 import os
+import uuid
 from dotenv import load_dotenv
-from embedder import get_client, embed_cv, query_collection, GeminiEmbeddingFunction
+from coalesce import SingleFlight, request_key
+from context import CONTEXT_CANDIDATES, pack_context
+from embedder import (
+    embed_cv, index_is_current, ingest_lock, query_collection, query_collection_batch,
+    query_embedding_cache, DEFAULT_CV_ID, collection_name_for, UPLOAD_DIR, current_cv_path, RETRIEVAL_MODE
+)
+from generation import (
+    COVER_LETTER_GENERATION_CONFIG, CHAT_GENERATION_CONFIG,
+    build_cover_letter_prompt, build_cover_letter_request, build_chat_prompt, get_response_text, stream_events,
+    sse_event, usage_to_dict, generation_cache, semantic_cache, prefix_cache, generation_upstream,
+    UNAVAILABLE_ERRORS, degraded_cover_letter, remember_letter
+)
+from ingestion import DEFAULT_DB_PATH as DEFAULT_INGEST_JOB_DB_PATH, IngestionQueue, QueueFull
+from job_queue import DEFAULT_DB_PATH as DEFAULT_JOB_DB_PATH, GenerationJobQueue, RetryLater
+import metrics
+from metrics import LEXICAL_FALLBACKS, record_usage, span
+from readiness import READY, DEGRADED
+from request_logging import annotate, configure_logging, log_payload, log_request, sample_payload
+import services
+from services import (
+    EMBED_QUERY_TIMEOUT, api_key, collections, cors_headers, forget_cached_letters, model,
+    query_embedding_function, readiness, upstream_health
+)
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Caps CV uploads; larger request bodies get a 413
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('CV_UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
 
-# Step 2: Create a model client
-model = genai.GenerativeModel(model_name="gemini-2.0-flash")
-
-# Configure CORS with explicit settings
-cors_headers = {
-    "origins": ["http://localhost:3000", "http://127.0.0.1:3000", "https://cover-letter-generator-mu.vercel.app"],
-    "methods": ["GET", "POST", "DELETE", "OPTIONS"],
-    "allow_headers": ["Content-Type", "Authorization"],
-    "supports_credentials": True,
-    "max_age": 3600
-}
 CORS(app, resources={r"/api/*": cors_headers})
 
-# Get API key from environment variable
-api_key = os.getenv('GOOGLE_API_KEY')
-if not api_key:
-    logger.error("No API key found. Please set the GOOGLE_API_KEY environment variable.")
-    raise ValueError("No API key found. Please set the GOOGLE_API_KEY environment variable.")
-
-# Step 1: Authenticate
-genai.configure(api_key=api_key)
+embed_query_executor = ThreadPoolExecutor(max_workers=int(os.getenv('EMBED_QUERY_WORKERS', '16')))
+
+# Merges identical concurrent generation requests into one upstream call
+generation_flight = SingleFlight()
+
+# Batch requests fan their generations out over this pool, shared by all batch
+# requests so bulk traffic can't take more than BATCH_CONCURRENCY upstream slots
+BATCH_MAX_JOBS = int(os.getenv('BATCH_MAX_JOBS', '50'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='batch')
+
+def ingest_uploaded_cv(cv_path, progress, cv_id):
+    """Index an uploaded CV and make it the current one for its cv_id; runs on the ingestion worker"""
+    # The same lock startup ingestion takes, so a worker re-ingesting at startup
+    # and an upload on another worker don't write the collection at once
+    with ingest_lock():
+        try:
+            collection = embed_cv(cv_path, progress, cv_id=cv_id)
+        except Exception:
+            os.remove(cv_path)
+            raise
+        os.makedirs(os.path.dirname(current_cv_path(cv_id)), exist_ok=True)
+        os.replace(cv_path, current_cv_path(cv_id))
+        # Letters cached for the old CV no longer match what retrieval returns
+        forget_cached_letters(cv_id)
+    readiness.refresh_soon()
+    return collection
+
+# Uploaded CVs are ingested on a background thread, off the request threads
+ingestion_queue = IngestionQueue(ingest_uploaded_cv, db_path=os.getenv('INGEST_JOB_DB') or DEFAULT_INGEST_JOB_DB_PATH)
+
+def run_generation_job(payload, last_attempt):
+    """Generate the letter for a queued job; runs on a job worker. Until the last
+    attempt, Gemini being unavailable puts the job back in the queue rather than
+    answering with a degraded letter."""
+    try:
+        return cover_letter_pipeline(
+            payload['message'], payload['use_cache'], payload['cv_id'], degrade=last_attempt
+        )
+    except UNAVAILABLE_ERRORS as e:
+        raise RetryLater(str(e))
+
+# Requests sent with "async": true are queued here (persisted in SQLite) and
+# generated by job workers; interactive and bulk (batch) jobs have separate workers
+generation_jobs = GenerationJobQueue(
+    run_generation_job,
+    db_path=os.getenv('JOB_DB') or DEFAULT_JOB_DB_PATH,
+    workers={'interactive': int(os.getenv('JOB_WORKERS', '4')), 'bulk': int(os.getenv('BULK_JOB_WORKERS', '2'))},
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '3')),
+    retry_delay=int(os.getenv('JOB_RETRY_DELAY', '30')),
+    retention=int(os.getenv('JOB_RETENTION', str(7 * 86400))),
+    callback_hosts=[host.strip() for host in os.getenv('CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()]
+)
+
+def init():
+    """Get the process ready to serve: check GOOGLE_API_KEY, open the default CV's collection,
+    start the readiness checks (and warmup) and resume jobs (and callbacks) left by a previous run.
+    Called by the entrypoints (wsgi.py, server.py, __main__ below) rather than on import."""
+    services.init()
+    if generation_jobs.has_pending():
+        generation_jobs.start()
+
+def resolve_cv(data):
+    """The cv_id a request asks for, or an error response if it is invalid or has no CV"""
+    cv_id = data.get('cv_id') or DEFAULT_CV_ID
+    try:
+        collection = collections.get(cv_id)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    if collection is None:
+        return None, (jsonify({'error': f"No CV found for cv_id '{cv_id}'"}), 404)
+    annotate(cv_id=cv_id)
+    return cv_id, None
+
+def embed_queries(messages):
+    """Embed job descriptions in one batched call; None when they have to be answered lexically"""
+    if RETRIEVAL_MODE == 'lexical':
+        return None
+    if RETRIEVAL_MODE != 'hybrid':
+        return query_embedding_function(messages)
+
+    future = embed_query_executor.submit(query_embedding_function, messages)
+    try:
+        return future.result(timeout=EMBED_QUERY_TIMEOUT)
+    except FuturesTimeout:
+        reason = 'timeout'
+    except UNAVAILABLE_ERRORS:
+        reason = 'unavailable'
+    LEXICAL_FALLBACKS.inc(reason=reason)
+    annotate(retrieval_fallback=reason)
+    return None
+
+def embed_query(message):
+    """Embed the job description; None when it has to be answered lexically"""
+    embeddings = embed_queries([message])
+    return embeddings[0] if embeddings is not None else None
+
+def retrieve_matched_chunks(message, query_embedding=None, cv_id=DEFAULT_CV_ID, lexical_only=False):
+    """Retrieve the CV chunks most relevant to the job description"""
+    # Relevant experience and skills for a {job_title} position at {company_name}.
+    # The job requires: {job_requirements}.
+    lexical_index = collections.lexical(cv_id) if RETRIEVAL_MODE != 'vector' else None
+    mode = 'lexical' if lexical_only else RETRIEVAL_MODE
+    with span("chroma_query"):
+        results = query_collection(
+            collections.get(cv_id), message, n_results=CONTEXT_CANDIDATES, query_embedding=query_embedding,
+            lexical_index=lexical_index, mode=mode, embedding_function=collections.embedding_function
+        )
+    with span("pack_context"):
+        matched_chunks, context_tokens = pack_context(results['documents'][0])
+    annotate(retrieved_chunks=len(results['documents'][0]), matched_chunks=len(matched_chunks),
+             context_tokens=context_tokens)
+    log_payload(matched_chunks=matched_chunks)
+    return matched_chunks
+
+def retrieve_batch(messages, query_embeddings, cv_id):
+    """retrieve_matched_chunks for several job descriptions, with one collection query"""
+    lexical_index = collections.lexical(cv_id) if RETRIEVAL_MODE != 'vector' else None
+    mode = 'lexical' if query_embeddings is None else RETRIEVAL_MODE
+    with span("chroma_query"):
+        results = query_collection_batch(
+            collections.get(cv_id), messages, n_results=CONTEXT_CANDIDATES, query_embeddings=query_embeddings,
+            lexical_index=lexical_index, mode=mode, embedding_function=collections.embedding_function
+        )
+    with span("pack_context"):
+        return [pack_context(result['documents'][0])[0] for result in results]
+
+def semantic_cache_payload(query_embedding, cv_id):
+    """Response payload for a cached letter for a near-identical job description, if there is one"""
+    semantic_hit = semantic_cache.get(query_embedding, scope=cv_id)
+    if semantic_hit is not None:
+        cached_text, similarity = semantic_hit
+        return {'response': cached_text, 'cache': 'semantic', 'similarity': round(similarity, 4)}
+    return None
+
+def cover_letter_pipeline(message, use_cache=True, cv_id=DEFAULT_CV_ID, degrade=True):
+    """Embed, retrieve and generate a cover letter; returns the JSON response payload
+
+    With degrade=False, Gemini being unavailable raises instead of giving a degraded answer.
+    """
+    with span("embed_query"):
+        query_embedding = embed_query(message)
+
+    if use_cache and query_embedding is not None:
+        cached = semantic_cache_payload(query_embedding, cv_id)
+        if cached is not None:
+            return cached
+
+    matched_chunks = retrieve_matched_chunks(message, query_embedding, cv_id, lexical_only=query_embedding is None)
+    return write_cover_letter(message, use_cache, cv_id, query_embedding, matched_chunks, degrade)
+
+def write_cover_letter(message, use_cache, cv_id, query_embedding, matched_chunks, degrade=True):
+    """Generate (or fetch from cache) the letter for already retrieved CV chunks; returns the JSON payload"""
+    with span("build_prompt"):
+        request_text = build_cover_letter_request(matched_chunks, message)
+        prompt = build_cover_letter_prompt(matched_chunks, message)
+
+    if use_cache:
+        cached_text = generation_cache.get(prompt, COVER_LETTER_GENERATION_CONFIG)
+        if cached_text is not None:
+            return {'response': cached_text, 'cache': 'exact'}
+
+    # Get a response from Gemini, through the cached prompt prefix when available
+    try:
+        with span("generate"):
+            response = generation_upstream.call(
+                prefix_cache.generate, model, request_text, prompt, COVER_LETTER_GENERATION_CONFIG
+            )
+    except UNAVAILABLE_ERRORS as e:
+        if not degrade:
+            raise
+        payload = degraded_cover_letter(e, message, cv_id, prompt, query_embedding, matched_chunks)
+        if payload is None:
+            raise
+        return payload
+    response_text = get_response_text(response)
+    record_usage(usage_to_dict(response))
+    generation_cache.set(prompt, COVER_LETTER_GENERATION_CONFIG, response_text)
+    if query_embedding is not None:
+        semantic_cache.set(query_embedding, response_text, scope=cv_id)
+    remember_letter(message, cv_id, response_text)
+
+    annotate(response_chars=len(response_text))
+    return {'response': response_text}
+
+def batch_cover_letter(message, use_cache, cv_id, query_embedding, matched_chunks):
+    """One job of a batch, whose query was embedded and retrieved together with the others"""
+    if use_cache and query_embedding is not None:
+        cached = semantic_cache_payload(query_embedding, cv_id)
+        if cached is not None:
+            return cached
+    # Shares in-flight work with identical /api/cover-letter requests
+    key = request_key('cover-letter', message, use_cache=use_cache, cv_id=cv_id)
+    return generation_flight.do(
+        key, lambda: write_cover_letter(message, use_cache, cv_id, query_embedding, matched_chunks)
+    )
+
+def batch_events(futures, job_ids):
+    """Yield a 'result' or 'error' event per job as it finishes, then a 'done' summary event
+
+    futures maps each future to the indexes of the jobs it answers (repeated job
+    descriptions in a batch are generated once).
+    """
+    failed = 0
+    try:
+        for future in as_completed(futures):
+            try:
+                payload = future.result()
+            except UNAVAILABLE_ERRORS as e:
+                logger.warning(f"Batch jobs {futures[future]} failed, Gemini unavailable: {e}")
+                payload = {"error": "The AI service is busy or unavailable, please try again shortly"}
+            except Exception as e:
+                logger.exception(f"Error generating cover letter for batch jobs {futures[future]}: {str(e)}")
+                payload = {"error": str(e)}
+            for index in futures[future]:
+                if "error" in payload:
+                    failed += 1
+                    yield sse_event("error", {"index": index, "id": job_ids[index], **payload})
+                else:
+                    yield sse_event("result", {"index": index, "id": job_ids[index], **payload})
+        yield sse_event("done", {"total": len(job_ids), "succeeded": len(job_ids) - failed, "failed": failed})
+    finally:
+        # Stop queued jobs if the client went away
+        for future in futures:
+            future.cancel()
+
+def chat_pipeline(message, use_cache=True):
+    """Generate a chat response; returns the JSON response payload"""
+    with span("build_prompt"):
+        prompt = build_chat_prompt(message)
+
+    if use_cache:
+        cached_text = generation_cache.get(prompt, CHAT_GENERATION_CONFIG)
+        if cached_text is not None:
+            return {'response': cached_text, 'cache': 'exact'}
+
+    # Get a response from Gemini
+    with span("generate"):
+        response = generation_upstream.call(
+            model.generate_content,
+            contents=prompt,
+            generation_config=CHAT_GENERATION_CONFIG
+        )
+    response_text = get_response_text(response)
+    record_usage(usage_to_dict(response))
+    generation_cache.set(prompt, CHAT_GENERATION_CONFIG, response_text)
+    return {'response': response_text}
+
+def unavailable_response(error):
+    """503 for a request shed by the upstream limits or circuit breaker, or failed by Gemini"""
+    reason = getattr(error, 'reason', None) or type(error).__name__
+    logger.warning(f"Gemini unavailable ({reason}): {error}")
+    annotate(unavailable=reason)
+    retry_after = str(max(1, round(getattr(error, 'retry_after', 1))))
+    error_body = {'error': 'The AI service is busy or unavailable, please try again shortly'}
+    return jsonify(error_body), 503, {'Retry-After': retry_after}
+
+def read_json_object():
+    """The request's JSON body if it is an object, else None"""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+def read_message(missing_error):
+    """(data, message) from a request's JSON body, or an error response if the body isn't
+    a JSON object or its message isn't a non-empty string"""
+    data = read_json_object()
+    if data is None:
+        return None, None, (jsonify({'error': 'Request body must be a JSON object'}), 400)
+    message = data.get('message')
+    if not isinstance(message, str) or not message.strip():
+        return None, None, (jsonify({'error': missing_error}), 400)
+    annotate(message_chars=len(message), message=message)
+    return data, message, None
+
+def parse_batch_jobs(jobs):
+    """(ids, messages) from a batch request's jobs (strings or {"id", "message"} objects), or an error"""
+    if not isinstance(jobs, list) or not jobs:
+        return None, None, 'No job descriptions provided'
+    if len(jobs) > BATCH_MAX_JOBS:
+        return None, None, f'At most {BATCH_MAX_JOBS} jobs can be sent in one batch'
+    ids, messages = [], []
+    for index, job in enumerate(jobs):
+        if isinstance(job, dict):
+            ids.append(job.get('id', index))
+            job = job.get('message')
+        else:
+            ids.append(index)
+        if not isinstance(job, str) or not job.strip():
+            return None, None, f'Job {index} has no job description'
+        messages.append(job)
+    return ids, messages, None
+
+def job_options(data):
+    """(priority, callback_url) for an async request, or an error message"""
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return None, None, 'priority must be an integer'
+    callback_url = data.get('callback_url') or None
+    if callback_url is not None:
+        try:
+            generation_jobs.check_callback_url(callback_url)
+        except ValueError as e:
+            return None, None, str(e)
+    return priority, callback_url, None
+
+def queue_cover_letter(message, use_cache, cv_id, lane, priority, callback_url):
+    """Queue a cover letter generation job; returns the job status with its status URL"""
+    job = generation_jobs.submit(
+        {'message': message, 'use_cache': use_cache, 'cv_id': cv_id}, lane=lane, priority=priority,
+        callback_url=callback_url
+    )
+    job['status_url'] = f"/api/jobs/{job['id']}"
+    return job
+
+def sse_response(events):
+    """Wrap a generator of Server-Sent Events in a streaming response"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/cover-letter', methods=['POST', 'OPTIONS'])
 def generate_cover_letter():
@@ -45,144 +372,126 @@ def generate_cover_letter():
         # Handle preflight request
         return '', 204
     
-    logger.info(f"Received cover letter request: {request.method} {request.path}")
-    logger.info(f"Request headers: {request.headers}")
-    
-    data = request.json
-    logger.info(f"Request data: {data}")
+    data, message, error = read_message('No job details provided')
+    if error:
+        return error
+    log_payload(headers=dict(request.headers), data=data)
+    cv_id, error = resolve_cv(data)
+    if error:
+        return error
     
-    message = data.get('message', '')
+    if data.get('async'):
+        priority, callback_url, error = job_options(data)
+        if error:
+            return jsonify({'error': error}), 400
+        use_cache = not data.get('regenerate', False)
+        job = queue_cover_letter(message, use_cache, cv_id, 'interactive', priority, callback_url)
+        annotate(job_id=job['id'])
+        return jsonify(job), 202
 
-    logger.info(f"Message: {message}")
-    # Relevant experience and skills for a {job_title} position at {company_name}.
-    # The job requires: {job_requirements}.
-    chroma_client = get_client()
-    embedding_function = GeminiEmbeddingFunction() 
-    collection = chroma_client.get_or_create_collection(name="resumeDB", embedding_function=embedding_function)
-    results = query_collection(collection, message)
-    matched_chunks = [doc for doc in results['documents'][0]]
+    try:
+        use_cache = not data.get('regenerate', False)
+        # Identical requests in flight at the same time (double clicks, client
+        # retries) share one embedding, retrieval and generation pass
+        key = request_key('cover-letter', message, use_cache=use_cache, cv_id=cv_id)
+        payload = generation_flight.do(key, lambda: cover_letter_pipeline(message, use_cache, cv_id))
+        annotate(cache=payload.get('cache'))
+        return jsonify(payload)
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception(f"Error generating cover letter: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-    logger.info(f"Matched chunks: {matched_chunks}")
+@app.route('/api/cover-letter/stream', methods=['POST', 'OPTIONS'])
+def stream_cover_letter():
+    """Streaming variant of /api/cover-letter; tokens are sent as Server-Sent Events"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    data, message, error = read_message('No job details provided')
+    if error:
+        return error
+    cv_id, error = resolve_cv(data)
+    if error:
+        return error
 
-    if not message:
-        return jsonify({'error': 'No job details provided'}), 400
-    
     try:
-        logger.info(f"Processing cover letter request")
-        
-        # Set up the model configuration
-        generation_config = {
-            "max_output_tokens": 1024,
-            "temperature": 0.2,
-            "top_p": 0.95
-        }
-        
-        # Create a structured prompt for cover letter generation
-        prompt = f"""
-        You are an expert in writing tailored cover letters. Given a resume and a job description, write a customized, professional, and engaging cover letter.
-        
-        ### Example 1:
-        Dear Hiring Team,
-
-        When I reduced customer onboarding time by 45% through an intuitive internal application at
-        Onestoptransformation, I witnessed firsthand how thoughtful frontend engineering directly impacts user
-        experience. This powerful connection between code and human wellbeing aligns perfectly with
-        Gymondo's mission of helping people lead healthier lives through accessible digital fitness solutions.
-
-        My frontend development journey includes:
-        ● Professional experience with React, Vue.js, TypeScript and JavaScript
-        ● Designing UI components and establishing TypeScript-based npm libraries at SevenCs
-        ● Implementing robust validation and testing mechanisms for reliable application performance
-        ● Integrating and consuming REST APIs across multiple production applications
-        ● Collaborating with cross-functional teams to translate user needs into technical solutions
-
-        At SevenCs, I developed MyRA Web, a digital routing service enhancing maritime navigation, where I
-        created robust UI components while maintaining a keen focus on user experience. This project
-        demanded clean, maintainable code that could reliably display complex real-time data—skills directly
-        transferable to developing engaging fitness interfaces at Gymondo.
-
-        During my time at Learnship GmbH, I contributed to feature development for multiple platforms while
-        modernizing legacy systems. This experience taught me to balance innovation with
-        maintainability—creating code that not only works but scales efficiently. I became adept at refactoring
-        existing codebases while adding new functionality, a valuable skill for evolving applications.
-        My internship at Onestoptransformation provided hands-on experience setting up CI/CD pipelines and
-        writing comprehensive test cases, demonstrating my commitment to code quality and standardized
-        practices. I embraced peer code reviews as opportunities for growth, refining my ability to both give and
-        receive constructive feedback—an essential aspect of Gymondo's collaborative development culture.
-
-        I'm particularly excited about Gymondo's commitment to continuous learning and growth, as I
-        consistently seek out opportunities to expand my technical knowledge and stay current with frontend
-        innovations. Your collaborative approach to development, including code reviews and team
-        problem-solving, resonates with my own development philosophy of learning through shared expertise.
-        
-        I am available to relocate as needed, hold a valid work permit, and am fluent in English with intermediate
-        German proficiency. I would welcome the opportunity to discuss how my technical skills and passion for
-        creating impactful user experiences could contribute to Gymondo's mission of helping people lead
-        healthier lives through engaging digital fitness solutions.
-
-        Sincerely,
-        Mohammed Sarfaraz
-
-        ### Now Your Turn:
-        **Resume:**
-        {matched_chunks}
-        
-        **Job Description (Summary):**
-        {message}
-        
-        """
-        
-        prompt += f"""
-        Write a compelling and concise cover letter (max 450 words).
-
-        It should:
-
-        1. Start with an attention-grabbing and personalized opening
-        2. Highlight my relevant experience from my resume, including:
-            - Work at Learnship GmbH (HALO, Elevate, Solo platforms)
-            - React + TypeScript npm library for MyRA Web at SevenCs
-            - Use of testing frameworks (Testing Library, Cypress)
-        3. Address key job requirements like:
-            - Strong JavaScript/TypeScript and React skills
-            - Writing DRY, maintainable code
-            - Familiarity with Git, HTML, CSS, testing
-        4. Include a concrete example of overcoming a technical challenge (e.g. integrating a third-party mapping library)
-        5. Emphasize my strengths:
-            - Collaborative mindset
-            - Passion for scalable and user-friendly solutions
-            - Growth mindset toward technical leadership
-        6. Explain why I want to join ePages specifically (their mission to empower SMBs, focus on innovation, e-commerce impact)
-        7. Clearly state:
-            - I hold a valid work permit, am available to relocate
-            - Fluent in English, intermediate German
-
-        End professionally with a closing paragraph
-
-        Use this format for the closing:
-
-        Sincerely,
-        Mohammed Sarfaraz
-        """
-        
-        # Get a response from Gemini
-        response = model.generate_content(contents=prompt, generation_config=generation_config)
-        
-        # Handle different response formats
-        response_text = ""
-        if hasattr(response, 'text'):
-            response_text = response.text
-        elif hasattr(response, 'parts'):
-            response_text = ' '.join([part.text for part in response.parts if hasattr(part, 'text')])
-        else:
-            response_text = str(response)
-            
-        logger.info(f"AI response (truncated): {response_text[:100]}...")
-        
-        return jsonify({'response': response_text})
+        query_embedding = embed_query(message)
+        matched_chunks = retrieve_matched_chunks(message, query_embedding, cv_id, lexical_only=query_embedding is None)
+        response, finish = generation_upstream.call_stream(
+            prefix_cache.generate,
+            model,
+            build_cover_letter_request(matched_chunks, message),
+            build_cover_letter_prompt(matched_chunks, message),
+            COVER_LETTER_GENERATION_CONFIG,
+            stream=True
+        )
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
     except Exception as e:
         logger.exception(f"Error generating cover letter: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    return sse_response(stream_events(response, finish))
+
+
+@app.route('/api/cover-letter/batch', methods=['POST', 'OPTIONS'])
+def batch_cover_letters():
+    """Cover letters for several job descriptions; each result is sent as a Server-Sent Event when it's ready"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    data = read_json_object()
+    if data is None:
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    job_ids, messages, error = parse_batch_jobs(data.get('jobs'))
+    if error:
+        return jsonify({'error': error}), 400
+    annotate(batch_jobs=len(messages))
+    cv_id, error = resolve_cv(data)
+    if error:
+        return error
+
+    if data.get('async'):
+        # Queued as bulk jobs, one per job description, each with its own status URL
+        priority, callback_url, error = job_options(data)
+        if error:
+            return jsonify({'error': error}), 400
+        use_cache = not data.get('regenerate', False)
+        jobs = []
+        for index, message in enumerate(messages):
+            job = queue_cover_letter(message, use_cache, cv_id, 'bulk', priority, callback_url)
+            jobs.append({'index': index, 'id': job_ids[index], 'job_id': job['id'], 'status_url': job['status_url']})
+        return jsonify({'jobs': jobs}), 202
+
+    # Repeated job descriptions are embedded, retrieved and generated once
+    indexes = {}
+    for index, message in enumerate(messages):
+        indexes.setdefault(message, []).append(index)
+    unique_messages = list(indexes)
+
+    try:
+        use_cache = not data.get('regenerate', False)
+        # One batched embedding call and one collection query for every job
+        with span("embed_query"):
+            query_embeddings = embed_queries(unique_messages)
+        chunk_lists = retrieve_batch(unique_messages, query_embeddings, cv_id)
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception(f"Error preparing cover letter batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    futures = {
+        batch_executor.submit(
+            batch_cover_letter, message, use_cache, cv_id,
+            query_embeddings[position] if query_embeddings is not None else None, chunk_lists[position]
+        ): indexes[message]
+        for position, message in enumerate(unique_messages)
+    }
+    return sse_response(batch_events(futures, job_ids))
+
 
 # Since there is no cache for example like a redis to store the CV data, we will read it from the file each time and pass it to the model
 # There is no explicit context window being defined in the technical sense.
@@ -192,94 +501,141 @@ def cover_letter():
         # Handle preflight request
         return '', 204
     
-    logger.info(f"Received request: {request.method} {request.path}")
-    logger.info(f"Request headers: {request.headers}")
-    
-    data = request.json
-    logger.info(f"Request data: {data}")
+    data, message, error = read_message('No message provided')
+    if error:
+        return error
+    log_payload(headers=dict(request.headers), data=data)
     
-    message = data.get('message', '')
-    cv_data = data.get('cv_data', '')
-    
-    logger.info(f"Message: {message}")
-    logger.info(f"CV Data: {cv_data}")
+    try:
+        use_cache = not data.get('regenerate', False)
+        key = request_key('chat', message, use_cache=use_cache)
+        payload = generation_flight.do(key, lambda: chat_pipeline(message, use_cache))
+        annotate(cache=payload.get('cache'))
+        return jsonify(payload)
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception(f"Error generating response: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/stream', methods=['POST', 'OPTIONS'])
+def stream_chat():
+    """Streaming variant of /api/chat; tokens are sent as Server-Sent Events"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    data, message, error = read_message('No message provided')
+    if error:
+        return error
 
-    if not message:
-        return jsonify({'error': 'No message provided'}), 400
-    
     try:
-        logger.info(f"Processing cover letter request")
-        
-        # Set up the model configuration
-        generation_config = {
-            "max_output_tokens": 1048,
-            "temperature": 0.4,
-            "top_p": 0.90
-        }
-
-        # Prepare content based on request type
-        # Create a structured prompt for cover letter generation
-        prompt = f"""
-        I need to write a cover letter for a job application. Here's information about me:
-        
-        My CV/Resume:
-    
-        Job Details:
-        {message}        
-        """
-
-        prompt += """
-        Write a compelling cover letter that:
-        1. Has an attention-grabbing opening
-        2. Highlights my relevant experience from my resume
-        3. Addresses key requirements mentioned in the job description
-        4. Includes a specific example of how I overcame a challenge in a previous role
-        5. Emphasizes my unique selling points 
-        6. Explains why I'm passionate about joining this specific company
-        8. Add a personal touch. 
-        7. Mentions I am available to relocate with a valid work permit and have fluent English and intermediate German
-        8. Limit to 380 words maximum
-        
-        Structure the letter professionally with proper greeting and closing.
-        """
-        
-        contents = prompt
-    
-        # Get a response from Gemini
-        response = model.generate_content(
-            contents=contents,
-            generation_config=generation_config
+        response, finish = generation_upstream.call_stream(
+            model.generate_content,
+            contents=build_chat_prompt(message),
+            generation_config=CHAT_GENERATION_CONFIG,
+            stream=True
         )
-        
-        # Handle different response formats
-        response_text = ""
-        if hasattr(response, 'text'):
-            response_text = response.text
-        elif hasattr(response, 'parts'):
-            response_text = ' '.join([part.text for part in response.parts if hasattr(part, 'text')])
-        else:
-            response_text = str(response)
-                    
-        return jsonify({'response': response_text})
+    except UNAVAILABLE_ERRORS as e:
+        return unavailable_response(e)
     except Exception as e:
         logger.exception(f"Error generating response: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    return sse_response(stream_events(response, finish))
+
 @app.route('/api/health', methods=['GET', 'OPTIONS'])
 def health_check():
     """Health check endpoint"""
     if request.method == 'OPTIONS':
         # Handle preflight request
         return '', 204
-        
-    logger.info("Health check request received")
+
+    status, upstreams = upstream_health()
     return jsonify({
-        'status': 'ok', 
+        'status': status,
         'api_key_configured': bool(api_key),
         'cors_configured': True,
-        'origins_allowed': cors_headers['origins']
+        'origins_allowed': cors_headers['origins'],
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'generation_cache': generation_cache.stats(),
+        'semantic_cache': semantic_cache.stats(),
+        'prefix_cache': prefix_cache.stats(),
+        'upstreams': upstreams,
+        'coalescing': generation_flight.stats(),
+        'collections': collections.stats(),
+        'ingestion': ingestion_queue.stats(),
+        'generation_jobs': generation_jobs.stats(),
+        'readiness': readiness.status()[1],
+        # Set by the app factory (wsgi.py): import and ingestion timings
+        'startup': app.extensions['startup']() if 'startup' in app.extensions else None
     })
 
+@app.route('/api/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_probe():
+    """Readiness probe from the cached background checks; 503 until the service can answer requests"""
+    status, details = readiness.status()
+    return jsonify(details), 200 if status in (READY, DEGRADED) else 503
+
+@app.route('/api/cv', methods=['POST', 'OPTIONS'])
+def upload_cv():
+    """Accept a CV PDF and queue it for ingestion; returns a job id to poll"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'No CV file provided'}), 400
+    cv_id = request.form.get('cv_id') or DEFAULT_CV_ID
+    try:
+        collection_name_for(cv_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if upload.stream.read(5) != b'%PDF-':
+        return jsonify({'error': 'CV must be a PDF file'}), 400
+    upload.stream.seek(0)
+
+    job_id = uuid.uuid4().hex
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    cv_path = os.path.join(UPLOAD_DIR, f"{job_id}.pdf")
+    upload.save(cv_path)
+    annotate(job_id=job_id, upload_bytes=os.path.getsize(cv_path))
+
+    try:
+        job = ingestion_queue.submit(cv_path, job_id=job_id, cv_id=cv_id)
+    except QueueFull as e:
+        os.remove(cv_path)
+        return jsonify({'error': str(e)}), 503
+
+    job['status_url'] = f"/api/cv/jobs/{job_id}"
+    return jsonify(job), 202
+
+@app.route('/api/cv/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def cv_job_status(job_id):
+    """Status of a CV ingestion job, with per-stage progress"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown ingestion job'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def generation_job_status(job_id):
+    """Status of a queued cover letter job, with the result once it's done"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown generation job'}), 404
+    return jsonify(job)
+
 # This API will check if the CV is present in the Chroma DB
 @app.route('/api/get-cv', methods=['GET', 'OPTIONS'])
 def get_cv():
@@ -287,14 +643,11 @@ def get_cv():
     if request.method == 'OPTIONS':
         return '', 204
 
-    logger.info("CV presence check in ChromaDB initiated")
-
+    cv_id = request.args.get('cv_id') or DEFAULT_CV_ID
     try:
-        chroma_client = get_client()
-        collection = chroma_client.get_or_create_collection(name="resumeDB")
-
-        count = collection.count()
-        logger.info(f"Found {count} embedded document(s) in resumeDB")
+        # Cached until the CV is re-indexed, so polling this doesn't query Chroma
+        count = collections.count(cv_id)
+        annotate(cv_id=cv_id, embedded_documents=count)
 
         if count == 0:
             return jsonify({'embedded': False, 'message': 'No CV found in Chroma DB'}), 200
@@ -306,19 +659,49 @@ def get_cv():
         # if result["documents"] and result["documents"][0] is not None:
         #     return jsonify({'embedded': True}), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception(f"Error checking Chroma DB: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latency histograms, in-flight requests, retries and token usage in Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.before_request
+def before_request():
+    """Start the per-request timing record"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_record = sample_payload(metrics.start_request(route))
+    annotate(method=request.method)
+
 @app.after_request
 def after_request(response):
-    """Log response details after each request"""
-    logger.info(f"Response status: {response.status}")
-    logger.info(f"Response headers: {response.headers}")
+    """Log one structured line per request"""
+    log_payload(response_headers=dict(response.headers))
+    record = g.pop('request_record', None)
+    if record is not None:
+        log_request(logger, metrics.finish_request(record, response.status_code))
     return response
 
+@app.teardown_request
+def teardown_request(error=None):
+    """Close the timing record of a request that failed before after_request ran"""
+    record = g.pop('request_record', None)
+    if record is not None:
+        metrics.finish_request(record, 500)
+
 if __name__ == '__main__':
-    embed_cv()
+    # With the reloader, this runs in a process that only watches the files and again in
+    # the one that serves; only the serving one ingests and starts the background work
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if index_is_current():
+            logger.info("CV index is up to date, skipping ingestion")
+        else:
+            embed_cv()
+        init()
     logger.info("Starting Flask API server...")
     app.run(debug=True, port=5001, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,320 @@
+"""
+In-process metrics exported in the Prometheus text format, plus per-request timing spans.
+
+Each request gets a record (via a context variable, so it works for both the
+threaded Flask server and the async app); `span(stage)` times a block, observes
+it in a histogram and adds it to the current request's record, which is logged
+as one structured line when the request finishes.
+
+Under a multi-process server, set METRICS_DIR to a directory shared by the
+workers (server.py does this itself): each process then writes its metrics
+there every METRICS_SYNC_INTERVAL seconds and on exit, and /api/metrics
+renders the totals of all of them, whichever worker serves the scrape.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_SYNC_INTERVAL = float(os.getenv('METRICS_SYNC_INTERVAL', '5'))
+
+
+def _label_string(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self):
+        """The current values, as JSON-friendly [labels, value] pairs"""
+        with self._lock:
+            return [[list(key), copy.deepcopy(value)] for key, value in self._values.items()]
+
+    def render(self):
+        return self.render_values({tuple(key): value for key, value in self.snapshot()})
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, snapshots, live):
+        """Add up the values of several processes' snapshots (`live` says which processes are still running)"""
+        values = {}
+        for snapshot, _ in zip(snapshots, live):
+            for key, value in snapshot:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        return values
+
+    def render_values(self, values):
+        lines = self._header()
+        lines += [f"{self.name}{_label_string(self.labelnames, key)} {value}" for key, value in values.items()]
+        return lines
+
+
+class Gauge(Counter):
+    """A value that goes up and down; across processes, the values of the running
+    ones are summed, or with `multiprocess="max"` the highest is taken"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess="sum"):
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess = multiprocess
+
+    def merge(self, snapshots, live):
+        values = {}
+        for snapshot, alive in zip(snapshots, live):
+            if not alive:
+                continue
+            for key, value in snapshot:
+                key = tuple(key)
+                if key not in values:
+                    values[key] = value
+                elif self.multiprocess == "max":
+                    values[key] = max(values[key], value)
+                else:
+                    values[key] += value
+        return values
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def merge(self, snapshots, live):
+        values = {}
+        for snapshot, _ in zip(snapshots, live):
+            for key, state in snapshot:
+                total = values.setdefault(tuple(key), {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], state["buckets"])]
+                total["sum"] += state["sum"]
+                total["count"] += state["count"]
+        return values
+
+    def render_values(self, values):
+        lines = self._header()
+        names = self.labelnames + ("le",)
+        for key, state in values.items():
+            for bound, count in zip(self.buckets, state["buckets"]):
+                lines.append(f"{self.name}_bucket{_label_string(names, key + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_label_string(names, key + ('+Inf',))} {state['count']}")
+            lines.append(f"{self.name}_sum{_label_string(self.labelnames, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_label_string(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self):
+        """This process's metrics, or with METRICS_DIR set, those of every process sharing it"""
+        directory = os.getenv('METRICS_DIR')
+        if not directory:
+            return self._join(metric.render() for metric in self._metrics)
+        save_snapshot()
+        snapshots, live = [], []
+        for name in os.listdir(directory):
+            if not (name.startswith("metrics-") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+            live.append(_is_running(int(name[len("metrics-"):-len(".json")])))
+        return self._join(
+            metric.render_values(metric.merge([snapshot.get(metric.name, []) for snapshot in snapshots], live))
+            for metric in self._metrics
+        )
+
+    @staticmethod
+    def _join(rendered):
+        return "\n".join(line for lines in rendered for line in lines) + "\n"
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+STAGE_SECONDS = registry.register(Histogram(
+    "cover_letter_stage_seconds", "Time spent in each request pipeline stage", ["stage"]))
+INGEST_STAGE_SECONDS = registry.register(Histogram(
+    "cv_ingest_stage_seconds", "Time spent in each CV ingestion stage", ["stage"]))
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["route", "status"]))
+IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ["route"]))
+UPSTREAM_RETRIES = registry.register(Counter(
+    "upstream_retries_total", "Retried calls to Gemini", ["upstream"]))
+UPSTREAM_SHED = registry.register(Counter(
+    "upstream_shed_total", "Gemini calls rejected locally by the rate limiter, retry budget or circuit breaker",
+    ["upstream", "reason"]))
+UPSTREAM_RATE = registry.register(Gauge(
+    "upstream_rate_limit_per_minute", "Current adaptive request rate allowed to each Gemini model", ["upstream"]))
+TOKENS = registry.register(Counter(
+    "llm_tokens_total", "Tokens reported by Gemini", ["kind"]))
+CIRCUIT_STATE = registry.register(Gauge(
+    "upstream_circuit_state", "Circuit breaker state per Gemini model (0 closed, 1 half-open, 2 open)", ["upstream"],
+    multiprocess="max"))
+DEGRADED_RESPONSES = registry.register(Counter(
+    "degraded_responses_total", "Cover letter requests answered without generation", ["kind"]))
+LEXICAL_FALLBACKS = registry.register(Counter(
+    "retrieval_lexical_fallbacks_total", "Hybrid retrievals answered by BM25 alone", ["reason"]))
+
+_request_record = contextvars.ContextVar("request_record", default=None)
+_sync_pid = None
+_sync_lock = threading.Lock()
+
+
+def save_snapshot():
+    """Write this process's metrics to METRICS_DIR, if set"""
+    directory = os.getenv('METRICS_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(tmp_path, path)
+
+
+def _sync():
+    while True:
+        time.sleep(METRICS_SYNC_INTERVAL)
+        try:
+            save_snapshot()
+        except OSError:
+            pass
+
+
+def start_sync():
+    """Start writing this process's metrics to METRICS_DIR in the background (once per process)"""
+    global _sync_pid
+    if not os.getenv('METRICS_DIR') or _sync_pid == os.getpid():
+        return
+    with _sync_lock:
+        # Checked by pid, since a forked worker doesn't inherit its parent's thread
+        if _sync_pid == os.getpid():
+            return
+        _sync_pid = os.getpid()
+        threading.Thread(target=_sync, name="metrics-sync", daemon=True).start()
+        atexit.register(save_snapshot)
+
+
+def start_request(route):
+    """Begin the timing record for a request in the current context"""
+    start_sync()
+    record = {"route": route, "stages": {}, "start": time.perf_counter()}
+    _request_record.set(record)
+    IN_FLIGHT.inc(route=route)
+    return record
+
+
+def current_record():
+    """The current request's record, or None outside a request"""
+    return _request_record.get()
+
+
+def finish_request(record, status):
+    """Close a request record, observe its latency and return it as a loggable dict"""
+    duration = time.perf_counter() - record.pop("start")
+    IN_FLIGHT.dec(route=record["route"])
+    REQUEST_SECONDS.observe(duration, route=record["route"], status=status)
+    record["status"] = status
+    record["duration_ms"] = round(duration * 1000, 2)
+    return record
+
+
+@contextmanager
+def span(stage, histogram=STAGE_SECONDS):
+    """Time a block, observe it in `histogram` and attach it to the current request record"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        histogram.observe(duration, stage=stage)
+        record = _request_record.get()
+        if record is not None:
+            record["stages"][stage] = round(duration * 1000, 2)
+
+
+def record_usage(usage):
+    """Count token usage (as returned by generation.usage_to_dict) for metrics and the request record"""
+    prompt_tokens = usage.get("prompt_token_count") or 0
+    output_tokens = usage.get("candidates_token_count") or 0
+    # Part of the prompt tokens, served from upstream cached content
+    cached_tokens = usage.get("cached_content_token_count") or 0
+    TOKENS.inc(prompt_tokens, kind="prompt")
+    TOKENS.inc(output_tokens, kind="output")
+    TOKENS.inc(cached_tokens, kind="cached")
+    record = _request_record.get()
+    if record is not None:
+        record["tokens"] = {"prompt": prompt_tokens, "output": output_tokens, "cached": cached_tokens}
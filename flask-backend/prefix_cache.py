@@ -0,0 +1,137 @@
+"""
+Upstream (Gemini context caching) cache of the static cover letter prompt prefix.
+
+The prefix is registered once as cached content and generation requests then
+send only the per-request part, referencing the cache by name. Creating the
+cache can fail (context caching needs an explicitly versioned model and a
+minimum prompt size, and isn't available on every API tier), and a cache can
+expire or be deleted upstream; in all of those cases requests fall back to
+sending the full prompt, and creation is retried after PREFIX_CACHE_RETRY_AFTER.
+"""
+
+import asyncio
+import datetime
+import logging
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+from context import estimate_tokens
+from gemini import sdk
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the cached content is gone or unusable, so the full prompt is sent instead
+CACHE_UNUSABLE_ERRORS = (api_exceptions.NotFound, api_exceptions.PermissionDenied, api_exceptions.InvalidArgument)
+
+
+class PrefixCache:
+    """Registers a prompt prefix as cached content and generates through it when available"""
+
+    def __init__(self, model_name, prefix, enabled=False, ttl=3600, retry_after=600):
+        self.model_name = model_name
+        self.prefix = prefix
+        self.enabled = enabled
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.prefix_tokens = estimate_tokens(prefix)
+        self.cached_requests = 0
+        self.fallback_requests = 0
+        self.cached_tokens = 0
+        self.last_error = None
+        self._cached = None
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _cached_model(self, generation_config):
+        """A model bound to the cached prefix, creating the cache if needed; None when unavailable"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            # Recreate a little before expiry so requests don't race the upstream TTL
+            if self._cached is None or now > self._expires_at - 60:
+                if now < self._retry_at:
+                    return None
+                try:
+                    cached = sdk().caching.CachedContent.create(
+                        model=self.model_name,
+                        display_name="cover-letter-prefix",
+                        contents=[self.prefix],
+                        ttl=datetime.timedelta(seconds=self.ttl),
+                    )
+                except Exception as e:
+                    logger.warning(f"Prompt prefix caching unavailable, sending full prompts: {e}")
+                    self.last_error = str(e)
+                    self._cached = None
+                    self._retry_at = now + self.retry_after
+                    return None
+                self._cached = cached
+                self._expires_at = now + self.ttl
+                self.last_error = None
+                usage = getattr(cached, 'usage_metadata', None)
+                self.prefix_tokens = getattr(usage, 'total_token_count', None) or self.prefix_tokens
+                logger.info(f"Cached prompt prefix as {cached.name} ({self.prefix_tokens} tokens)")
+            cached = self._cached
+        return sdk().GenerativeModel.from_cached_content(cached_content=cached, generation_config=generation_config)
+
+    def invalidate(self, error):
+        with self._lock:
+            logger.warning(f"Cached prompt prefix unusable, recreating: {error}")
+            self.last_error = str(error)
+            self._cached = None
+
+    def _count(self, response, cached):
+        usage = getattr(response, 'usage_metadata', None)
+        with self._lock:
+            if cached:
+                self.cached_requests += 1
+                self.cached_tokens += getattr(usage, 'cached_content_token_count', None) or 0
+            else:
+                self.fallback_requests += 1
+
+    def generate(self, model, request_text, full_prompt, generation_config, stream=False):
+        """Generate from the cached prefix plus request_text, or from full_prompt with model"""
+        cached_model = self._cached_model(generation_config)
+        if cached_model is not None:
+            try:
+                response = cached_model.generate_content(contents=request_text, stream=stream)
+                self._count(response, cached=True)
+                return response
+            except CACHE_UNUSABLE_ERRORS as e:
+                self.invalidate(e)
+        response = model.generate_content(contents=full_prompt, generation_config=generation_config, stream=stream)
+        self._count(response, cached=False)
+        return response
+
+    async def generate_async(self, model, request_text, full_prompt, generation_config):
+        """Async variant of generate"""
+        # Creating the cache is a blocking call, so it runs off the event loop
+        cached_model = await asyncio.to_thread(self._cached_model, generation_config) if self.enabled else None
+        if cached_model is not None:
+            try:
+                response = await cached_model.generate_content_async(contents=request_text)
+                self._count(response, cached=True)
+                return response
+            except CACHE_UNUSABLE_ERRORS as e:
+                self.invalidate(e)
+        response = await model.generate_content_async(contents=full_prompt, generation_config=generation_config)
+        self._count(response, cached=False)
+        return response
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "active": self._cached is not None,
+            "cache_name": getattr(self._cached, 'name', None),
+            "prefix_tokens": self.prefix_tokens,
+            "cached_requests": self.cached_requests,
+            "fallback_requests": self.fallback_requests,
+            # Input tokens served from the cache, billed at the reduced cached rate
+            "cached_tokens": self.cached_tokens,
+            # Prefix tokens re-sent in full because the cache wasn't available
+            "uncached_prefix_tokens": self.fallback_requests * self.prefix_tokens,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,326 @@
+"""
+Client-side rate limiting and retry budgeting for Gemini calls.
+
+Every call to an upstream model goes through that model's `Upstream`, shared
+by all request threads (and the async app's event loop) in the process:
+
+- a token bucket paces calls to the configured requests per minute. A 429
+  halves the bucket's rate, and each success adds back a step of the configured
+  rate, so a quota spike lowers throughput gradually instead of hammering it.
+- retriable errors (429/503) are retried with full-jitter exponential backoff,
+  but each retry spends from a retry budget that only refills as a fraction of
+  calls made, so retries can't multiply the load during an outage.
+
+Calls that would wait longer than RATE_LIMIT_MAX_WAIT for a token, that need a
+retry the budget can't cover, or that arrive while the upstream's circuit
+breaker (circuit.py) is open, fail fast with `UpstreamOverloaded`.
+
+The limits are per process. When UPSTREAM_PROCESSES processes call the same
+upstream (server.py sets it to its worker count), each gets an equal share of
+the configured rate, burst and retry reserve, so together they stay within it.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+from google.api_core import exceptions as api_exceptions
+
+from circuit import STATE_VALUES, CircuitBreaker
+from metrics import CIRCUIT_STATE, UPSTREAM_RATE, UPSTREAM_RETRIES, UPSTREAM_SHED
+
+logger = logging.getLogger(__name__)
+
+# Slowest the adaptive rate goes, as a fraction of the configured rate
+MIN_RATE_FRACTION = 0.05
+# Configured rate regained per successful call after a 429
+RECOVERY_STEP = 0.02
+
+
+def is_retriable(error):
+    """Retry when the per-minute quota is reached or the upstream is briefly unavailable"""
+    return isinstance(error, (api_exceptions.TooManyRequests, api_exceptions.ServiceUnavailable))
+
+
+class UpstreamOverloaded(Exception):
+    """A call shed locally because of the rate limit, retry budget or an open circuit"""
+
+    def __init__(self, message, upstream, reason, retry_after=1.0):
+        super().__init__(message)
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate adapts to upstream 429s (rate <= 0 means unlimited)"""
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait):
+        """Take a token, returning how long to wait before using it, or None if that's over max_wait"""
+        if self.max_rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            wait = (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return None
+            # Tokens go negative, so later callers queue up behind this one
+            self._tokens -= 1
+            return wait
+
+    def throttle(self):
+        """Halve the rate and drop any saved-up burst after an upstream 429"""
+        if self.max_rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def recover(self):
+        if self.max_rate <= 0 or self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+
+class RetryBudget:
+    """Allows retries up to `ratio` of calls made, plus a small reserve for quiet periods"""
+
+    def __init__(self, ratio, reserve):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.reserve, self._balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def balance(self):
+        return self._balance
+
+
+class Upstream:
+    """Rate limiter, retry budget and backoff shared by every call to one upstream model"""
+
+    def __init__(self, name, rate_per_minute, burst, max_wait=2.0, max_attempts=4,
+                 base_delay=0.5, max_delay=8.0, budget_ratio=0.1, budget_reserve=10, breaker=None):
+        self.name = name
+        self.max_wait = max_wait
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.budget = RetryBudget(budget_ratio, budget_reserve)
+        self.breaker = breaker or CircuitBreaker()
+        self.breaker.on_change = lambda state: CIRCUIT_STATE.set(STATE_VALUES[state], upstream=name)
+        CIRCUIT_STATE.set(STATE_VALUES[self.breaker.state], upstream=name)
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.shed = {"rate_limit": 0, "retry_budget": 0, "circuit_open": 0}
+        self._lock = threading.Lock()
+        UPSTREAM_RATE.set(rate_per_minute, upstream=name)
+
+    @classmethod
+    def from_env(cls, name, prefix, default_rate_per_minute, default_slow_call_seconds):
+        """Settings from {prefix}_RPM / {prefix}_BURST / {prefix}_SLOW_CALL_SECONDS and the
+        shared RATE_LIMIT_* / RETRY_* / CIRCUIT_* variables, split over UPSTREAM_PROCESSES"""
+        processes = max(1, int(os.getenv('UPSTREAM_PROCESSES') or '1'))
+        return cls(
+            name,
+            rate_per_minute=float(os.getenv(f'{prefix}_RPM', str(default_rate_per_minute))) / processes,
+            burst=float(os.getenv(f'{prefix}_BURST', '10')) / processes,
+            max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', '2')),
+            max_attempts=int(os.getenv('RETRY_MAX_ATTEMPTS', '4')),
+            base_delay=float(os.getenv('RETRY_BASE_DELAY', '0.5')),
+            max_delay=float(os.getenv('RETRY_MAX_DELAY', '8')),
+            budget_ratio=float(os.getenv('RETRY_BUDGET_RATIO', '0.1')),
+            budget_reserve=max(1.0, float(os.getenv('RETRY_BUDGET_RESERVE', '10')) / processes),
+            breaker=CircuitBreaker(
+                window=int(os.getenv('CIRCUIT_WINDOW', '20')),
+                min_calls=int(os.getenv('CIRCUIT_MIN_CALLS', '10')),
+                failure_rate=float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5')),
+                open_seconds=float(os.getenv('CIRCUIT_OPEN_SECONDS', '30')),
+                half_open_probes=int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', '1')),
+                slow_call_seconds=float(os.getenv(f'{prefix}_SLOW_CALL_SECONDS', str(default_slow_call_seconds))),
+            ),
+        )
+
+    def _shed(self, reason, retry_after):
+        with self._lock:
+            self.shed[reason] += 1
+        UPSTREAM_SHED.inc(upstream=self.name, reason=reason)
+        return UpstreamOverloaded(
+            f"Too many requests to {self.name}, try again shortly", self.name, reason, round(retry_after, 2)
+        )
+
+    def _admit(self):
+        """Seconds to wait for a rate limit token; raises UpstreamOverloaded if too long"""
+        wait = self.bucket.reserve(self.max_wait)
+        if wait is None:
+            raise self._shed("rate_limit", 1 / self.bucket.rate)
+        return wait
+
+    def _backoff(self, attempt, error):
+        """Full-jitter delay before retrying after `error`; raises it if no retry is allowed"""
+        if not is_retriable(error):
+            raise error
+        if isinstance(error, api_exceptions.TooManyRequests):
+            with self._lock:
+                self.throttled += 1
+            self.bucket.throttle()
+            UPSTREAM_RATE.set(round(self.bucket.rate * 60, 2), upstream=self.name)
+        if attempt + 1 >= self.max_attempts:
+            raise error
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        if not self.budget.withdraw():
+            raise self._shed("retry_budget", delay) from error
+        with self._lock:
+            self.retries += 1
+        UPSTREAM_RETRIES.inc(upstream=self.name)
+        logger.info(f"Retrying {self.name} call after {type(error).__name__} (attempt {attempt + 1})")
+        return random.uniform(0, delay)
+
+    def _succeeded(self):
+        if self.bucket.rate < self.bucket.max_rate:
+            self.bucket.recover()
+            UPSTREAM_RATE.set(round(self.bucket.rate * 60, 2), upstream=self.name)
+
+    def _begin(self):
+        with self._lock:
+            self.calls += 1
+        self.budget.deposit()
+        if not self.breaker.allow():
+            raise self._shed("circuit_open", self.breaker.retry_after())
+        return time.monotonic()
+
+    def _finish(self, start, error=None):
+        """Report a call's outcome to the circuit breaker"""
+        if isinstance(error, UpstreamOverloaded):
+            # Shed before reaching the upstream, unless the retry budget ran out after a failure
+            if error.__cause__ is None:
+                self.breaker.release()
+                return
+            error = error.__cause__
+        self.breaker.record_call(time.monotonic() - start, error)
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) under the circuit breaker and rate limit, retrying within the budget"""
+        start = self._begin()
+        result = self._attempt(start, fn, args, kwargs)
+        self._finish(start)
+        return result
+
+    def call_stream(self, fn, *args, **kwargs):
+        """Like call, for a fn that returns a stream; returns (stream, finish)
+
+        A stream's errors only show up while it is read, so the circuit breaker
+        records the call when finish(error) is called: with None once the stream
+        was read to the end, or with the error it raised. finish(abandoned=True),
+        or the stream being dropped without finish, gives the call back without
+        an outcome (e.g. when the client disconnects).
+        """
+        start = self._begin()
+        stream = self._attempt(start, fn, args, kwargs)
+        pending = [True]
+
+        def finish(error=None, abandoned=False):
+            with self._lock:
+                if not pending[0]:
+                    return
+                pending[0] = False
+            if abandoned:
+                self.breaker.release()
+            else:
+                self._finish(start, error)
+
+        try:
+            weakref.finalize(stream, finish, abandoned=True)
+        except TypeError:
+            pass
+        return stream, finish
+
+    def _attempt(self, start, fn, args, kwargs):
+        """Run fn with rate limiting and retries; reports a failure (but not a success) to the breaker"""
+        attempt = 0
+        while True:
+            try:
+                wait = self._admit()
+                if wait:
+                    time.sleep(wait)
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    time.sleep(self._backoff(attempt, e))
+                    attempt += 1
+                    continue
+            except Exception as e:
+                self._finish(start, e)
+                raise
+            self._succeeded()
+            return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """Async variant of call, for coroutine functions"""
+        start = self._begin()
+        attempt = 0
+        while True:
+            try:
+                wait = self._admit()
+                if wait:
+                    await asyncio.sleep(wait)
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    await asyncio.sleep(self._backoff(attempt, e))
+                    attempt += 1
+                    continue
+            except Exception as e:
+                self._finish(start, e)
+                raise
+            self._succeeded()
+            self._finish(start)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_minute": round(self.bucket.rate * 60, 2) if self.bucket.max_rate > 0 else None,
+                "configured_rate_per_minute": round(self.bucket.max_rate * 60, 2) if self.bucket.max_rate > 0 else None,
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "shed": dict(self.shed),
+                "retry_budget": round(self.budget.balance, 2),
+                "circuit": self.breaker.stats(),
+            }
@@ -0,0 +1,97 @@
+"""
+Readiness checks, run on a background thread so that probes never wait on Gemini or Chroma.
+
+Each check is a function that returns a short detail when its dependency is
+usable and raises when it isn't. The checks run once at startup (after the
+optional warmup) and then every `interval` seconds; /api/ready only reads the
+last results. The service is ready once the warmup has finished and every
+critical check passes; a failing non-critical check makes it "degraded" but
+still ready.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+READY = "ready"
+DEGRADED = "degraded"
+NOT_READY = "not_ready"
+
+
+class ReadinessChecks:
+    def __init__(self, interval=30.0, warmup=None):
+        self.interval = interval
+        self.warmup = warmup
+        self._checks = {}
+        self._results = {}
+        self._warmup_result = None if warmup is not None else {"ok": True, "detail": "disabled"}
+        self._warmed_up = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        if warmup is None:
+            self._warmed_up.set()
+
+    def add(self, name, check, critical=True):
+        self._checks[name] = (check, critical)
+
+    def start(self):
+        """Start the background thread (once)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="readiness", daemon=True)
+            self._thread.start()
+
+    def refresh_soon(self):
+        """Run the checks again now rather than at the next interval, e.g. after a re-index"""
+        self._wake.set()
+
+    @staticmethod
+    def _timed(function):
+        start = time.perf_counter()
+        try:
+            result = {"ok": True, "detail": function()}
+        except Exception as e:
+            result = {"ok": False, "detail": f"{type(e).__name__}: {e}"}
+        result["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["checked_at"] = time.time()
+        return result
+
+    def _run(self):
+        if self.warmup is not None:
+            self._warmup_result = self._timed(self.warmup)
+            if not self._warmup_result["ok"]:
+                logger.warning(f"Warmup failed: {self._warmup_result['detail']}")
+            self._warmed_up.set()
+        while True:
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def refresh(self):
+        for name, (check, critical) in list(self._checks.items()):
+            result = self._timed(check)
+            result["critical"] = critical
+            previous = self._results.get(name)
+            if not result["ok"] and (previous is None or previous["ok"]):
+                logger.warning(f"Readiness check '{name}' failed: {result['detail']}")
+            self._results[name] = result
+
+    def status(self):
+        """(status, details) from the last results; never runs a check"""
+        checks = {}
+        for name, (check, critical) in self._checks.items():
+            checks[name] = self._results.get(name, {"ok": False, "detail": "pending", "critical": critical})
+        if not self._warmed_up.is_set():
+            status = NOT_READY
+        elif not all(result["ok"] for result in checks.values() if result["critical"]):
+            status = NOT_READY
+        elif not all(result["ok"] for result in checks.values()):
+            status = DEGRADED
+        else:
+            status = READY
+        return status, {"status": status, "warmup": self._warmup_result or {"ok": False, "detail": "pending"},
+                        "checks": checks}
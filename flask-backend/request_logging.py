@@ -0,0 +1,112 @@
+"""
+Structured, size-capped request logging.
+
+Every request is logged as a single JSON line built from its metrics record
+(route, status, duration, stage timings, tokens) plus a few truncated fields.
+Full payload dumps (headers, request JSON, matched chunks, response headers) are
+only added for a sampled fraction of requests (LOG_PAYLOAD_SAMPLE_RATE), and
+are size-capped too, so log volume doesn't grow with payload size. Records go
+through a QueueHandler, so formatting and I/O happen on a background thread.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+from metrics import current_record
+
+# Max characters kept for each logged text field, and for sampled payload dumps
+LOG_FIELD_LIMIT = int(os.getenv('LOG_FIELD_LIMIT', '200'))
+LOG_PAYLOAD_LIMIT = int(os.getenv('LOG_PAYLOAD_LIMIT', '2000'))
+# Fraction of requests that get a verbose payload dump (1.0 logs every payload)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0'))
+# Hand log records to a background thread instead of writing them inline
+LOG_QUEUE = os.getenv('LOG_QUEUE', 'true').lower() == 'true'
+
+_listener = None
+
+
+def configure_logging(level=logging.INFO):
+    """Configure root logging, through a non-blocking queue handler unless LOG_QUEUE=false"""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if not LOG_QUEUE:
+        root.addHandler(stream_handler)
+        return
+
+    if _listener is not None:
+        atexit.unregister(_listener.stop)
+        _listener.stop()
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def stop_logging():
+    """Write out queued records and stop the listener, for processes that leave through os._exit"""
+    global _listener
+    if _listener is not None:
+        atexit.unregister(_listener.stop)
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener():
+    """Give a forked child its own listener thread; the parent's doesn't survive fork()"""
+    if _listener is not None:
+        configure_logging(logging.getLogger().level)
+
+
+os.register_at_fork(after_in_child=_restart_listener)
+
+
+def truncate(value, limit=LOG_FIELD_LIMIT):
+    """Cap a value's string form at `limit` characters, noting how much was dropped"""
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...[{len(text) - limit} more chars]"
+
+
+def sample_payload(record):
+    """Decide once per request whether its payload gets dumped"""
+    record["sampled"] = LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+    return record
+
+
+def annotate(**fields):
+    """Add truncated fields to the current request's log record"""
+    record = current_record()
+    if record is None:
+        return
+    for name, value in fields.items():
+        record[name] = value if isinstance(value, (int, float, bool)) or value is None else truncate(value)
+
+
+def log_payload(**fields):
+    """Attach a size-capped payload dump to the current request's record, if it was sampled"""
+    record = current_record()
+    if record is None or not record.get("sampled"):
+        return
+    payload = record.setdefault("payload", {})
+    for name, value in fields.items():
+        payload[name] = truncate(value, LOG_PAYLOAD_LIMIT)
+
+
+def log_request(logger, record):
+    """Write the request record as one JSON line"""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record, default=str))
@@ -0,0 +1,226 @@
+"""
+Production entry point: a pre-forking server with several worker processes.
+
+    python flask-backend/server.py --workers 4 --port 5001
+    python flask-backend/server.py --mode async --workers 4
+
+The parent process loads the configuration and imports the heavy modules (the
+Gemini SDK, Chroma, LangChain, the prompt template) once, brings the default
+CV's index up to date once, then forks the workers, which share that memory
+copy-on-write and accept connections from one listening socket. Each worker
+imports the app itself and so opens its own Chroma client and Gemini clients;
+the parent never opens either, so no connection or background thread is
+inherited across fork(). Crashed workers are restarted; SIGTERM or Ctrl-C
+stops them all. Needs fork(), so Unix only.
+
+Each worker has its own in-memory state (caches, circuit breakers). Metrics
+are shared through METRICS_DIR (a temporary directory unless set), so
+/api/metrics reports the whole server; CV upload job status is kept in SQLite,
+so any worker can report it, and after an upload the other workers reopen
+their retrieval handles (see embedder.index_version). The Gemini rate limits are split evenly
+between the workers, so together they stay within GENERATION_RPM and
+EMBEDDING_RPM.
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Settings are read at import time, so .env is loaded before any app module is imported
+load_dotenv()
+
+from metrics import save_snapshot
+from request_logging import configure_logging, stop_logging
+
+logger = logging.getLogger("server")
+
+# Imported before forking, so workers share them instead of importing them again.
+# Importing these doesn't open any connections. The app itself defers the Gemini SDK,
+# LangChain and PyPDF2 to first use; here they are loaded up front, once.
+SHARED_PRELOAD_MODULES = ("google.generativeai", "langchain.text_splitter", "PyPDF2", "embedder", "generation",
+                          "coalesce", "services")
+PRELOAD_MODULES = {
+    "flask": SHARED_PRELOAD_MODULES + ("ingestion", "job_queue", "flask", "flask_cors"),
+    "async": SHARED_PRELOAD_MODULES + ("starlette.applications", "uvicorn"),
+}
+LISTEN_BACKLOG = int(os.getenv('SERVER_BACKLOG', '2048'))
+# A worker that dies sooner than this after starting is restarted after a pause, not immediately
+MIN_WORKER_UPTIME = 5
+
+
+def preload(mode):
+    for name in PRELOAD_MODULES[mode]:
+        importlib.import_module(name)
+
+
+def run_in_child(target, *args):
+    """Run target(*args) in a forked child and wait for it; returns whether it succeeded"""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            target(*args)
+            code = 0
+        except Exception as e:
+            logger.exception(f"{target.__name__} failed: {e}")
+        finally:
+            save_snapshot()
+            stop_logging()
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def ingest_once(cv_path=None):
+    """Bring the default CV's index up to date before the workers start
+
+    Runs in a short-lived child, so the parent doesn't open the Chroma and Gemini
+    clients that ingestion needs. Skipped when the index is already current.
+    """
+    import embedder
+
+    if embedder.index_is_current(cv_path):
+        logger.info("CV index is up to date, skipping ingestion")
+        return True
+    return run_in_child(embedder.embed_cv, cv_path)
+
+
+def load_app(mode):
+    """Import the app in a worker"""
+    if mode == "flask":
+        import main
+        main.init()
+        return main.app
+    # The async app starts up in its lifespan hook
+    import async_app
+    return async_app.app
+
+
+def serve_worker(mode, sock, setup=None, log_level="info"):
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    app = load_app(mode)
+    if setup is not None:
+        setup(app)
+    if mode == "flask":
+        from werkzeug.serving import make_server
+
+        host, port = sock.getsockname()[:2]
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        # shutdown() waits for serve_forever to return, so it can't run on the serving thread
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        server.serve_forever()
+    else:
+        import uvicorn
+
+        uvicorn.Server(uvicorn.Config(app, log_level=log_level)).run(sockets=[sock])
+
+
+def run(mode="flask", host="0.0.0.0", port=5001, workers=None, ingest=True, cv_path=None, setup=None,
+        log_level="info"):
+    """Preload, ingest once, then fork `workers` processes serving the app and restart them if they die
+
+    setup, if given, is called with the app in each worker before it starts serving.
+    """
+    workers = workers or os.cpu_count() or 1
+    # The workers split the Gemini rate limits between them (see ratelimit.Upstream.from_env);
+    # set before preloading, which creates the limiters
+    os.environ['UPSTREAM_PROCESSES'] = str(workers)
+    # Where the workers (and the ingestion child) share their metrics; a fresh run
+    # starts from zero, so snapshots of a previous run are removed
+    own_metrics_dir = not os.getenv('METRICS_DIR')
+    if own_metrics_dir:
+        os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix="cover-letter-metrics-")
+    else:
+        os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+        for name in os.listdir(os.environ['METRICS_DIR']):
+            if name.startswith("metrics-"):
+                os.remove(os.path.join(os.environ['METRICS_DIR'], name))
+    preload(mode)
+    if ingest and not ingest_once(cv_path):
+        raise SystemExit("Startup ingestion failed, not starting the workers")
+
+    sock = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    logger.info(f"Listening on http://{host}:{port} with {workers} {mode} workers")
+
+    children = {}
+    stopping = []
+
+    def spawn(number):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                serve_worker(mode, sock, setup, log_level)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                logger.exception(f"Worker {number} failed: {e}")
+                code = 1
+            finally:
+                save_snapshot()
+                stop_logging()
+                os._exit(code)
+        children[pid] = (number, time.monotonic())
+
+    def stop(signum, frame):
+        # A second signal kills the workers instead of waiting for them to finish
+        kill_signal = signal.SIGKILL if stopping else signal.SIGTERM
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, kill_signal)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for number in range(workers):
+        spawn(number)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        number, started = children.pop(pid, (None, None))
+        if number is None or stopping:
+            continue
+        logger.warning(f"Worker {number} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting")
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            time.sleep(1)
+        if not stopping:
+            spawn(number)
+    sock.close()
+    if own_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['flask', 'async'], default=os.getenv('SERVER_MODE', 'flask'))
+    parser.add_argument('--host', default=os.getenv('SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5001')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SERVER_WORKERS', '0')),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--skip-ingest', action='store_true', help="don't re-index the default CV at startup")
+    args = parser.parse_args()
+
+    configure_logging()
+    run(args.mode, args.host, args.port, args.workers or None, ingest=not args.skip_ingest)
+
+
+if __name__ == '__main__':
+    main()
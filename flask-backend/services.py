@@ -0,0 +1,127 @@
+"""
+State shared by the Flask app (main.py) and the async app (async_app.py): the
+model client, the retrieval handles, the CORS settings and the readiness checks.
+
+Importing this module opens nothing and starts nothing, so either app can be
+imported without the other's side effects. init() checks the configuration,
+opens the default CV's collection and starts the readiness checks (and the
+warmup); each app calls it once before serving.
+"""
+
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from embedder import (
+    DEFAULT_CV_ID, RETRIEVAL_MODE, CollectionCache, GeminiEmbeddingFunction, embed_batch, embedding_upstream,
+    get_client, index_is_current
+)
+from gemini import LazyModel, sdk
+from generation import fallback_letters, generation_upstream, semantic_cache, usage_to_dict
+from metrics import record_usage
+from readiness import ReadinessChecks
+
+# Settings below are read at import time
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Created on first use, so importing the apps doesn't load the Gemini SDK
+model = LazyModel("gemini-2.0-flash")
+
+# Configure CORS with explicit settings
+cors_headers = {
+    "origins": ["http://localhost:3000", "http://127.0.0.1:3000", "https://cover-letter-generator-mu.vercel.app"],
+    "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+    "allow_headers": ["Content-Type", "Authorization"],
+    "supports_credentials": True,
+    "max_age": 3600
+}
+
+# gemini.sdk() configures the SDK with GOOGLE_API_KEY when it's first used
+api_key = os.getenv('GOOGLE_API_KEY')
+
+# Retrieval handles are opened per CV on first use and kept in a bounded cache;
+# queries are embedded in retrieval_query mode through the cached embedding function.
+query_embedding_function = GeminiEmbeddingFunction(document_mode=False)
+
+def forget_cached_letters(cv_id):
+    """Drop the letters cached for a CV before it was re-indexed (by this or another server worker)"""
+    semantic_cache.clear(cv_id)
+    fallback_letters.clear(lambda key: key[0] == cv_id)
+
+collections = CollectionCache(
+    query_embedding_function,
+    max_size=int(os.getenv('COLLECTION_CACHE_SIZE', '128')),
+    ttl=int(os.getenv('COLLECTION_CACHE_TTL', '3600')),
+    on_index_change=forget_cached_letters
+)
+
+# In hybrid mode a query embedding that takes longer than this is abandoned
+# (it still finishes in the background and lands in the query cache) and the
+# request is answered from the BM25 index alone
+EMBED_QUERY_TIMEOUT = float(os.getenv('EMBED_QUERY_TIMEOUT', '2'))
+
+def upstream_health():
+    """Overall status ('degraded' while a circuit breaker isn't closed) and per-upstream limiter stats"""
+    upstreams = {'generation': generation_upstream.stats(), 'embedding': embedding_upstream.stats()}
+    closed = all(stats['circuit']['state'] == 'closed' for stats in upstreams.values())
+    return ('ok' if closed else 'degraded'), upstreams
+
+WARMUP_PROMPT = "Reply with OK."
+
+def warm_up():
+    """Open the default CV's handles and make one throwaway embedding and single-token generation,
+    so the first real request doesn't pay for loading the index or for the embedding and generative
+    clients' connection setup (the readiness check's model lookup uses a third client)"""
+    collections.get(DEFAULT_CV_ID)
+    collections.lexical(DEFAULT_CV_ID)
+    collections.count(DEFAULT_CV_ID)
+    if RETRIEVAL_MODE != 'lexical':
+        # Not through query_embedding_function, whose cache would answer it on later starts
+        embed_batch([WARMUP_PROMPT], 'retrieval_query')
+    response = generation_upstream.call(
+        model.generate_content, contents=WARMUP_PROMPT, generation_config={'max_output_tokens': 1}
+    )
+    record_usage(usage_to_dict(response))
+    return 'done'
+
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '5'))
+
+def check_gemini():
+    """Gemini answers a model lookup (no tokens are spent)"""
+    sdk().get_model(f"models/{model.model_name}", request_options={'timeout': READINESS_TIMEOUT})
+    return 'reachable'
+
+def check_chroma():
+    """Chroma responds and the default CV has been indexed"""
+    get_client().heartbeat()
+    count = collections.count(DEFAULT_CV_ID)
+    if count == 0:
+        raise LookupError('No CV has been indexed yet')
+    return f'{count} document(s)'
+
+def check_index():
+    """The default CV's index was built from the current CV file and settings"""
+    if not index_is_current():
+        raise LookupError('The default CV changed since it was indexed')
+    return 'current'
+
+# Dependency checks run on a background thread; /api/ready only reads their last results.
+# Without Gemini or with a stale index, letters can still be served, so the service is degraded, not unready.
+readiness = ReadinessChecks(
+    interval=float(os.getenv('READINESS_INTERVAL', '30')),
+    warmup=warm_up if os.getenv('STARTUP_WARMUP', 'true').lower() == 'true' else None
+)
+readiness.add('chroma', check_chroma)
+readiness.add('gemini', check_gemini, critical=False)
+readiness.add('index', check_index, critical=False)
+
+def init():
+    """Check the configuration, open the default CV's collection and start the readiness checks"""
+    if not api_key:
+        logger.error("No API key found. Please set the GOOGLE_API_KEY environment variable.")
+        raise ValueError("No API key found. Please set the GOOGLE_API_KEY environment variable.")
+    collections.get(DEFAULT_CV_ID, create=True)
+    readiness.start()
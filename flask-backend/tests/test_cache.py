@@ -0,0 +1,53 @@
+import pytest
+
+from cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(max_size=4, ttl=10)
+    cache.set('a', 1)
+    clock[0] += 9.9
+    assert cache.get('a') == 1
+    clock[0] += 0.1
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_setting_again_renews_ttl(clock):
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+    clock[0] += 8
+    cache.set('a', 2)
+    clock[0] += 8
+    assert cache.get('a') == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_size=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_clear_with_filter(clock):
+    cache = TTLCache()
+    cache.set(('alice', 'x'), 1)
+    cache.set(('bob', 'x'), 2)
+    cache.clear(lambda key: key[0] == 'alice')
+    assert cache.get(('alice', 'x')) is None
+    assert cache.get(('bob', 'x')) == 2
+    cache.clear()
+    assert len(cache) == 0
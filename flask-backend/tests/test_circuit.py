@@ -0,0 +1,142 @@
+import gc
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from generation import stream_events
+from ratelimit import Upstream, UpstreamOverloaded
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('circuit.time.monotonic', clock)
+    return clock
+
+
+def test_opens_once_failure_rate_is_reached(clock):
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5)
+    for failed in (True, False, False):
+        assert breaker.allow()
+        breaker.record(failed)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    breaker = CircuitBreaker(window=2, min_calls=2, failure_rate=0.5, open_seconds=30, half_open_probes=1)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record(True)
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['recent_calls'] == 0
+
+
+def test_release_gives_back_a_half_open_probe(clock):
+    breaker = CircuitBreaker(window=1, min_calls=1, failure_rate=1.0, open_seconds=5)
+    breaker.allow()
+    breaker.record(True)
+    clock.now += 5
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_slow_calls_and_bad_requests(clock):
+    breaker = CircuitBreaker(window=2, min_calls=2, failure_rate=1.0, slow_call_seconds=10)
+    breaker.allow()
+    breaker.record_call(1.0, api_exceptions.InvalidArgument('bad prompt'))
+    breaker.allow()
+    breaker.record_call(11.0)
+    assert breaker.state == CLOSED
+    breaker.allow()
+    breaker.record_call(11.0)
+    assert breaker.state == OPEN
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class Stream:
+    def __init__(self, texts, error=None):
+        self.texts = texts
+        self.error = error
+        self.usage_metadata = None
+
+    def __iter__(self):
+        for text in self.texts:
+            yield Chunk(text)
+        if self.error is not None:
+            raise self.error
+
+
+def streaming_upstream():
+    breaker = CircuitBreaker(window=1, min_calls=1, failure_rate=1.0)
+    return Upstream("test", rate_per_minute=0, burst=1, breaker=breaker)
+
+
+def test_stream_failure_is_recorded_when_reading_fails():
+    upstream = streaming_upstream()
+    stream, finish = upstream.call_stream(lambda: Stream(['Dear'], api_exceptions.ServiceUnavailable('gone')))
+    assert upstream.breaker.state == CLOSED
+    events = list(stream_events(stream, finish))
+    assert events[-1].startswith('event: error')
+    assert upstream.breaker.state == OPEN
+    with pytest.raises(UpstreamOverloaded):
+        upstream.call_stream(lambda: Stream([]))
+
+
+def test_stream_success_is_recorded_when_read_to_the_end():
+    upstream = streaming_upstream()
+    stream, finish = upstream.call_stream(lambda: Stream(['Dear', ' team']))
+    events = list(stream_events(stream, finish))
+    assert events[-1].startswith('event: done')
+    assert upstream.breaker.stats()['recent_calls'] == 1
+    assert upstream.breaker.stats()['recent_failures'] == 0
+
+
+def test_abandoned_stream_releases_its_probe():
+    upstream = streaming_upstream()
+    upstream.breaker.state = HALF_OPEN
+    stream, finish = upstream.call_stream(lambda: Stream(['Dear', ' team']))
+    assert not upstream.breaker.allow()
+    events = stream_events(stream, finish)
+    next(events)
+    events.close()
+    assert upstream.breaker.allow()
+    upstream.breaker.release()
+
+    # Dropped without being read at all
+    stream, finish = upstream.call_stream(lambda: Stream(['Dear']))
+    del stream, finish
+    gc.collect()
+    assert upstream.breaker.allow()
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from coalesce import AsyncSingleFlight, SingleFlight, request_key
+
+
+def test_request_key_ignores_extra_whitespace():
+    assert request_key('chat', ' Hello\n  World ') == request_key('chat', 'Hello World')
+    assert request_key('chat', 'hello', use_cache=True) != request_key('chat', 'hello', use_cache=False)
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def run_concurrently(flight, fn, release, callers):
+    """Call flight.do from several threads while the first call is held, then release it"""
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(flight.do, 'key', fn)]
+        wait_until(lambda: flight.stats()['in_flight'] == 1)
+        futures += [executor.submit(flight.do, 'key', fn) for _ in range(callers - 1)]
+        wait_until(lambda: flight.merged == callers - 1)
+        release.set()
+    return futures
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def fn():
+        runs.append(1)
+        release.wait(5)
+        return 'letter'
+
+    futures = run_concurrently(flight, fn, release, callers=4)
+    assert [future.result() for future in futures] == ['letter'] * 4
+    assert len(runs) == 1
+    assert flight.stats() == {'calls': 1, 'merged': 3, 'in_flight': 0}
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise TimeoutError('gemini')
+
+    for future in run_concurrently(flight, fn, release, callers=3):
+        with pytest.raises(TimeoutError):
+            future.result()
+    # The next call runs again
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_async_calls_share_one_task():
+    flight = AsyncSingleFlight()
+    runs = []
+
+    async def fn():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return 'letter'
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', fn) for _ in range(3)))
+
+    assert asyncio.run(main()) == ['letter'] * 3
+    assert len(runs) == 1
+    assert flight.stats() == {'calls': 1, 'merged': 2, 'in_flight': 0}
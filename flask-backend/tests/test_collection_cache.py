@@ -0,0 +1,22 @@
+import embedder
+from embedder import CollectionCache, collection_name_for, mark_index_changed
+
+
+def test_reindex_only_drops_that_cvs_handles(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedder, 'INDEX_VERSION_FILE', str(tmp_path / 'index_version'))
+    monkeypatch.setattr(embedder, 'INDEX_VERSION_DIR', str(tmp_path / 'index_versions'))
+    monkeypatch.setattr(embedder, 'LEXICAL_INDEX_DIR', str(tmp_path / 'lexical_index'))
+    changed = []
+    cache = CollectionCache(None, on_index_change=changed.append)
+    for cv_id in ('alice', 'bob'):
+        cache.lexical(cv_id)
+        cache._handles.set(('count', collection_name_for(cv_id)), 3)
+
+    mark_index_changed(collection_name_for('alice'))
+    assert cache.lexical('bob') is None
+    assert changed == []
+    cache.lexical('alice')
+
+    assert changed == ['alice']
+    assert cache._handles.get(('count', collection_name_for('alice'))) is None
+    assert cache._handles.get(('count', collection_name_for('bob'))) == 3
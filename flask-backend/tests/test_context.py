@@ -0,0 +1,39 @@
+from context import deduplicate, estimate_tokens, mmr_order, pack_context, shared_edge
+
+REACT = "Built React and TypeScript frontends for a logistics dashboard used by 200 dispatchers"
+FLASK = "Designed Flask APIs backed by PostgreSQL and deployed them on Kubernetes clusters"
+TEAM = "Mentored three junior engineers and ran the weekly frontend guild meetings"
+
+
+def test_estimate_tokens_counts_word_pieces_and_punctuation():
+    assert estimate_tokens("React, Flask.") == 6
+    assert estimate_tokens("Kubernetes") == 3
+
+
+def test_overlapping_text_is_trimmed():
+    left = "Led the migration of the billing service to Python 3 and Flask"
+    right = "the billing service to Python 3 and Flask, cutting deploy time in half"
+    assert shared_edge(left, right) == len("the billing service to Python 3 and Flask")
+    assert deduplicate([left, right]) == [left, ", cutting deploy time in half"]
+
+
+def test_repeated_and_contained_chunks_are_dropped():
+    assert deduplicate([REACT, REACT, "React and TypeScript", FLASK]) == [REACT, FLASK]
+
+
+def test_mmr_moves_near_repeats_down():
+    similar = REACT + " daily"
+    assert mmr_order([REACT, similar, FLASK, TEAM]) == [REACT, FLASK, similar, TEAM]
+
+
+def test_pack_keeps_rank_order_within_budget():
+    budget = estimate_tokens(REACT) + estimate_tokens(TEAM)
+    packed, used = pack_context([REACT, FLASK, TEAM], token_budget=budget)
+    assert packed == [REACT, TEAM]
+    assert used == budget
+
+
+def test_pack_always_keeps_the_top_chunk():
+    packed, used = pack_context([REACT, FLASK], token_budget=1)
+    assert packed == [REACT]
+    assert used == estimate_tokens(REACT)
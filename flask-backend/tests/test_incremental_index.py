@@ -0,0 +1,64 @@
+import chromadb
+import pytest
+from langchain.schema import Document
+
+import embedder
+from embedder import create_embeddings_and_store
+
+
+@pytest.fixture
+def embedded(tmp_path, monkeypatch):
+    """Texts sent for embedding; the store is a throwaway Chroma database"""
+    client = chromadb.PersistentClient(path=str(tmp_path / 'chroma'))
+    monkeypatch.setattr(embedder, 'get_client', lambda: client)
+    monkeypatch.setattr(embedder, 'INDEX_VERSION_FILE', str(tmp_path / 'index_version'))
+    monkeypatch.setattr(embedder, 'INDEX_VERSION_DIR', str(tmp_path / 'index_versions'))
+    monkeypatch.setattr(embedder, 'LEXICAL_INDEX_DIR', str(tmp_path / 'lexical_index'))
+    monkeypatch.setattr(embedder, 'RETRIEVAL_BACKEND', 'chroma')
+    texts = []
+
+    def embed_batch(batch, task_type):
+        texts.extend(batch)
+        return [[float(len(text)), 1.0, 0.0] for text in batch]
+
+    monkeypatch.setattr(embedder, 'embed_batch', embed_batch)
+    return texts
+
+
+def chunks(*texts):
+    return [Document(page_content=text, metadata={'page': 1}) for text in texts]
+
+
+def test_only_new_chunks_are_embedded(embedded):
+    collection = create_embeddings_and_store(chunks("React developer", "Python skills", "Python skills"))
+    assert sorted(embedded) == ["Python skills", "React developer"]
+    assert collection.count() == 2
+
+    embedded.clear()
+    collection = create_embeddings_and_store(chunks("React developer", "Python skills", "Led a team"))
+    assert embedded == ["Led a team"]
+    assert collection.count() == 3
+
+
+def test_removed_chunks_are_deleted_and_unchanged_cv_is_a_no_op(embedded):
+    create_embeddings_and_store(chunks("React developer", "Python skills"))
+    embedded.clear()
+    collection = create_embeddings_and_store(chunks("React developer"))
+    assert embedded == []
+    assert collection.get()['documents'] == ["React developer"]
+
+    version = embedder.index_version('resumeDB')
+    create_embeddings_and_store(chunks("React developer"))
+    assert embedded == []
+    assert embedder.index_version('resumeDB') == version
+
+
+def test_each_ingestion_records_one_store_stage(embedded):
+    create_embeddings_and_store(chunks("React developer", "Python skills"))
+    store = embedder.INGEST_STAGE_SECONDS._values[("store",)]
+    before = store["count"]
+    stages = []
+    # Adds one chunk and deletes another
+    create_embeddings_and_store(chunks("React developer", "Led a team"), progress=stages.append)
+    assert stages == ["embed", "store"]
+    assert store["count"] == before + 1
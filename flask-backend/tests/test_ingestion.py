@@ -0,0 +1,59 @@
+import time
+
+from ingestion import IngestionQueue
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+class Collection:
+    def count(self):
+        return 3
+
+
+def ingest(path, progress, cv_id):
+    for stage in ('extract', 'chunk', 'embed', 'store'):
+        progress(stage)
+    return Collection()
+
+
+def test_job_status_is_visible_to_other_workers(tmp_path):
+    db_path = str(tmp_path / 'ingest_jobs.db')
+    worker = IngestionQueue(ingest, db_path=db_path)
+    other_worker = IngestionQueue(ingest, db_path=db_path)
+
+    job = worker.submit('cv.pdf', cv_id='alice')
+    assert job['status'] in ('queued', 'running', 'done')
+    assert 'cv_path' not in job
+    done = wait_for(lambda: (other_worker.get(job['id']) or {}).get('status') == 'done' and other_worker.get(job['id']))
+    assert done['chunks'] == 3
+    assert done['cv_id'] == 'alice'
+    assert {state['status'] for state in done['stages'].values()} == {'done'}
+    assert other_worker.get('unknown') is None
+
+
+def test_failed_job_records_the_failing_stage(tmp_path):
+    def failing_ingest(path, progress, cv_id):
+        progress('extract')
+        raise ValueError('not a PDF')
+
+    jobs = IngestionQueue(failing_ingest, db_path=str(tmp_path / 'ingest_jobs.db'))
+    job = jobs.submit('cv.pdf')
+    failed = wait_for(lambda: jobs.get(job['id'])['status'] == 'failed' and jobs.get(job['id']))
+    assert failed['error'] == 'not a PDF'
+    assert failed['stages']['extract']['status'] == 'failed'
+    assert jobs.stats()['failed'] == 1
+
+
+def test_only_the_latest_jobs_are_kept(tmp_path):
+    jobs = IngestionQueue(ingest, history=2, db_path=str(tmp_path / 'ingest_jobs.db'))
+    first, second, third = (jobs.submit('cv.pdf') for _ in range(3))
+    assert jobs.get(first['id']) is None
+    assert jobs.get(second['id']) is not None and jobs.get(third['id']) is not None
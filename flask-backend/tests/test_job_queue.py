@@ -0,0 +1,177 @@
+import threading
+import time
+
+import pytest
+
+import job_queue
+from job_queue import CALLBACK_LEASE_SECONDS, JOB_LEASE_SECONDS, GenerationJobQueue, RetryLater, check_callback_url
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+@pytest.mark.parametrize('url', [
+    'ftp://93.184.216.34/hook',
+    'http:///hook',
+    'http://127.0.0.1:5001/hook',
+    'http://localhost/hook',
+    'http://10.0.0.5/hook',
+    'http://192.168.1.1/hook',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[::1]/hook',
+    'http://[::ffff:127.0.0.1]/hook',
+    'http://0.0.0.0/hook',
+])
+def test_callback_url_rejects_non_public_targets(url):
+    with pytest.raises(ValueError):
+        check_callback_url(url)
+
+
+def test_callback_url_allowlist():
+    check_callback_url('https://93.184.216.34/hook')
+    check_callback_url('https://93.184.216.34/hook', ['93.184.216.34'])
+    with pytest.raises(ValueError, match='not allowed'):
+        check_callback_url('https://93.184.216.34/hook', ['hooks.example.com'])
+    with pytest.raises(ValueError, match='not allowed'):
+        check_callback_url('https://evil-example.com/hook', ['.example.com'])
+
+
+def test_submit_rejects_private_callback_url(tmp_path):
+    jobs = GenerationJobQueue(lambda payload, last_attempt: {}, db_path=str(tmp_path / 'jobs.db'),
+                              workers={'interactive': 0, 'bulk': 0})
+    with pytest.raises(ValueError):
+        jobs.submit({}, callback_url='http://169.254.169.254/')
+
+
+def test_slow_callback_does_not_hold_up_the_worker(tmp_path, monkeypatch):
+    release = threading.Event()
+    delivered = []
+
+    def deliver(url, job):
+        release.wait(5)
+        delivered.append(job['id'])
+        return 'delivered (200)'
+
+    jobs = GenerationJobQueue(lambda payload, last_attempt: {'n': payload['n']}, db_path=str(tmp_path / 'jobs.db'),
+                              workers={'interactive': 1, 'bulk': 0})
+    monkeypatch.setattr(jobs, '_deliver', deliver)
+    first = jobs.submit({'n': 1}, callback_url='http://93.184.216.34/hook')
+    second = jobs.submit({'n': 2})
+
+    # The single worker finishes the second job while the first job's callback is still being sent
+    wait_for(lambda: jobs.get(second['id'])['status'] == 'done')
+    assert jobs.get(first['id'])['callback_status'] == 'pending'
+    release.set()
+    wait_for(lambda: jobs.get(first['id'])['callback_status'] == 'delivered (200)')
+    assert delivered == [first['id']]
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(job_queue, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def jobs(tmp_path, clock):
+    """A queue without job workers, so the tests claim and process jobs themselves"""
+    return GenerationJobQueue(lambda payload, last_attempt: payload, db_path=str(tmp_path / 'jobs.db'),
+                              workers={'interactive': 0, 'bulk': 0}, retry_delay=30)
+
+
+def test_claim_takes_higher_priority_then_oldest_first(jobs, clock):
+    low = jobs.submit({'n': 1})
+    clock.now += 1
+    high = jobs.submit({'n': 2}, priority=5)
+    clock.now += 1
+    later = jobs.submit({'n': 3}, priority=5)
+    assert [jobs._claim('interactive')['id'] for _ in range(3)] == [high['id'], later['id'], low['id']]
+    assert jobs._claim('interactive') is None
+    assert jobs.get(high['id'])['status'] == 'running'
+    assert jobs.get(high['id'])['attempts'] == 1
+
+
+def test_lanes_are_claimed_separately(jobs):
+    bulk = jobs.submit({'n': 1}, lane='bulk', priority=10)
+    interactive = jobs.submit({'n': 2})
+    assert jobs._claim('interactive')['id'] == interactive['id']
+    assert jobs._claim('interactive') is None
+    assert jobs._claim('bulk')['id'] == bulk['id']
+    with pytest.raises(ValueError):
+        jobs.submit({}, lane='urgent')
+
+
+def test_expired_lease_is_claimed_again(jobs, clock):
+    job = jobs.submit({'n': 1})
+    assert jobs._claim('interactive')['id'] == job['id']
+    clock.now += JOB_LEASE_SECONDS - 1
+    assert jobs._claim('interactive') is None
+    clock.now += 2
+    reclaimed = jobs._claim('interactive')
+    assert reclaimed['id'] == job['id']
+    assert reclaimed['attempts'] == 2
+
+
+def test_retry_later_requeues_with_backoff_until_last_attempt(tmp_path, clock):
+    def run(payload, last_attempt):
+        raise RetryLater('Gemini unavailable')
+
+    jobs = GenerationJobQueue(run, db_path=str(tmp_path / 'jobs.db'), workers={'interactive': 0, 'bulk': 0},
+                              max_attempts=2, retry_delay=30)
+    job = jobs.submit({})
+    jobs._process(jobs._claim('interactive'))
+    assert jobs.get(job['id'])['status'] == 'queued'
+    assert jobs._claim('interactive') is None
+    clock.now += 30
+    jobs._process(jobs._claim('interactive'))
+    assert jobs.get(job['id'])['status'] == 'failed'
+    assert jobs.get(job['id'])['error'] == 'Gemini unavailable'
+
+
+def test_finished_job_has_its_result(jobs):
+    job = jobs.submit({'letter': 'Dear team'})
+    jobs._process(jobs._claim('interactive'))
+    assert jobs.get(job['id'])['result'] == {'letter': 'Dear team'}
+    assert jobs.stats()['lanes']['interactive'] == {'done': 1}
+
+
+def test_callback_left_unsent_is_sent_after_a_restart(tmp_path, clock, monkeypatch):
+    db_path = str(tmp_path / 'jobs.db')
+    url = 'http://93.184.216.34/hook'
+    with monkeypatch.context() as m:
+        # The first process stops before its callback threads send anything
+        m.setattr(GenerationJobQueue, 'start', lambda self: None)
+        first = GenerationJobQueue(lambda payload, last_attempt: payload, db_path=db_path,
+                                   workers={'interactive': 0, 'bulk': 0})
+        job = first.submit({'n': 1}, callback_url=url)
+        first._process(first._claim('interactive'))
+    assert first.get(job['id'])['callback_status'] == 'pending'
+
+    delivered = []
+    restarted = GenerationJobQueue(lambda payload, last_attempt: payload, db_path=db_path,
+                                   workers={'interactive': 0, 'bulk': 0})
+    monkeypatch.setattr(restarted, '_deliver', lambda url, job: delivered.append((url, job['id'])) or 'delivered (200)')
+    assert restarted.has_pending()
+    # Not taken while the first process could still be sending it
+    assert restarted._claim_callback() is None
+    clock.now += CALLBACK_LEASE_SECONDS + 1
+    restarted.start()
+    wait_for(lambda: restarted.get(job['id'])['callback_status'] == 'delivered (200)')
+    assert delivered == [(url, job['id'])]
+    assert not restarted.has_pending()
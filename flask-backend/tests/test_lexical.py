@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from embedder import query_collection
+from lexical import BM25Index, build_index, fuse_results, tokenize
+
+DOCUMENTS = [
+    "Built React and TypeScript frontends tested with Cypress",
+    "Python backend services with Flask and PostgreSQL",
+    "Led a team of engineers shipping CI/CD pipelines with Node.js",
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / 'bm25' / 'resumeDB.json')
+    build_index(path, ['react', 'python', 'lead'], DOCUMENTS,
+                [{'section': 'experience'}, {'section': 'skills'}, {'section': 'experience'}])
+    return BM25Index(path)
+
+
+def result(ids):
+    return {'ids': [ids], 'documents': [[f'doc {i}' for i in ids]], 'metadatas': [[{'id': i} for i in ids]]}
+
+
+def test_tokenize_keeps_tech_terms():
+    assert tokenize("Node.js, C++ and CI/CD for the team") == ['node.js', 'c++', 'ci', 'cd', 'team']
+
+
+def test_query_ranks_keyword_matches(index):
+    results = index.query(["TypeScript and Cypress", "Flask python python"], n_results=2)
+    assert results['ids'] == [['react'], ['python']]
+    assert results['distances'][0][0] < 0
+    assert index.count() == 3
+
+
+def test_query_filters_by_metadata(index):
+    results = index.query(["engineers python react"], n_results=3, where={'section': 'experience'})
+    assert set(results['ids'][0]) == {'react', 'lead'}
+
+
+def test_index_reloads_after_rebuild(index):
+    build_index(index.path, ['go'], ["Go microservices"], [None])
+    os.utime(index.path, ns=(1, os.stat(index.path).st_mtime_ns + 1))
+    assert index.query(["go"])['ids'] == [['go']]
+
+
+def test_fuse_results_favours_chunks_found_by_both():
+    fused = fuse_results(result(['a', 'b', 'c']), result(['c', 'd']), n_results=3)
+    assert fused['ids'] == [['c', 'a', 'b']]
+    assert fused['documents'] == [['doc c', 'doc a', 'doc b']]
+    assert fused['metadatas'][0][0] == {'id': 'c'}
+
+
+class Collection:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, **params):
+        self.queries.append(params)
+        count = len(params['query_embeddings'])
+        return {'ids': [['x']] * count, 'documents': [['doc x']] * count, 'metadatas': [[{}]] * count,
+                'distances': [[0.1]] * count}
+
+
+def test_query_without_bm25_index_embeds_through_the_embedding_function():
+    collection = Collection()
+    embedded = []
+
+    def embedding_function(texts):
+        embedded.extend(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+    query_collection(collection, "React developer", mode="lexical", embedding_function=embedding_function)
+    assert embedded == ["React developer"]
+    assert collection.queries[0]['query_embeddings'] == [[1.0, 0.0]]
+    assert 'query_texts' not in collection.queries[0]
+
+    with pytest.raises(ValueError):
+        query_collection(collection, "React developer", mode="hybrid")
@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def write_worker(directory, pid, registry):
+    with open(os.path.join(directory, f"metrics-{pid}.json"), "w") as file:
+        json.dump(registry.snapshot(), file)
+
+
+def test_render_adds_up_the_workers_metrics(tmp_path, monkeypatch, registry):
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    requests = registry.register(Counter("requests_total", "Requests", ["route"]))
+    in_flight = registry.register(Gauge("in_flight", "In flight"))
+    circuit = registry.register(Gauge("circuit", "Circuit", multiprocess="max"))
+    latency = registry.register(Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)))
+
+    # Another worker, still running, and one that has exited
+    requests.inc(3, route="chat")
+    in_flight.inc(2)
+    circuit.set(2)
+    latency.observe(0.05)
+    write_worker(tmp_path, os.getppid(), registry)
+    write_worker(tmp_path, 2 ** 22 + 1, registry)
+
+    for metric in (requests, in_flight, circuit, latency):
+        metric._values.clear()
+    requests.inc(route="chat")
+    in_flight.inc()
+    circuit.set(0)
+    latency.observe(0.5)
+
+    lines = registry.render().splitlines()
+    assert 'requests_total{route="chat"} 7' in lines
+    # Gauges only count the running processes
+    assert 'in_flight 3' in lines
+    assert 'circuit 2' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+    assert os.path.exists(tmp_path / f"metrics-{os.getpid()}.json")
+
+
+def test_render_without_metrics_dir_is_this_process_only(monkeypatch, registry):
+    monkeypatch.delenv('METRICS_DIR', raising=False)
+    registry.register(Counter("requests_total", "Requests")).inc(2)
+    assert registry.render() == "# HELP requests_total Requests\n# TYPE requests_total counter\nrequests_total 2\n"
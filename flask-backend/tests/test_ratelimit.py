@@ -0,0 +1,131 @@
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import ratelimit
+from ratelimit import MIN_RATE_FRACTION, RetryBudget, TokenBucket, Upstream, UpstreamOverloaded
+
+
+class FakeTime:
+    """Stands in for the time module inside ratelimit, so waits are instant and deterministic"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def test_from_env_splits_limits_between_processes(monkeypatch):
+    monkeypatch.setenv('TEST_RPM', '600')
+    monkeypatch.setenv('TEST_BURST', '8')
+    monkeypatch.setenv('RETRY_BUDGET_RESERVE', '10')
+    monkeypatch.setenv('UPSTREAM_PROCESSES', '4')
+    upstream = Upstream.from_env("test", "TEST", 1000, 10)
+    assert upstream.bucket.max_rate * 60 == 150
+    assert upstream.bucket.burst == 2
+    assert upstream.budget.reserve == 2.5
+
+
+def test_from_env_uses_full_limits_in_one_process(monkeypatch):
+    monkeypatch.setenv('TEST_RPM', '600')
+    monkeypatch.delenv('UPSTREAM_PROCESSES', raising=False)
+    upstream = Upstream.from_env("test", "TEST", 1000, 10)
+    assert upstream.bucket.max_rate * 60 == 600
+
+
+def test_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2.0, burst=2)
+    assert bucket.reserve(max_wait=1) == 0.0
+    assert bucket.reserve(max_wait=1) == 0.0
+    assert bucket.reserve(max_wait=1) == 0.5
+    # The queued caller's token is spoken for, so the next one waits a full second
+    assert bucket.reserve(max_wait=0.9) is None
+    assert bucket.reserve(max_wait=1) == 1.0
+    clock.now += 10
+    assert bucket.reserve(max_wait=0) == 0.0
+
+
+def test_bucket_throttles_on_429_and_recovers_gradually(clock):
+    bucket = TokenBucket(rate=1.0, burst=5)
+    bucket.throttle()
+    assert bucket.rate == 0.5
+    assert bucket.reserve(max_wait=1) is None
+    for _ in range(10):
+        bucket.throttle()
+    assert bucket.rate == MIN_RATE_FRACTION
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == 1.0
+
+
+def test_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+    assert all(bucket.reserve(max_wait=0) == 0.0 for _ in range(100))
+
+
+def test_retry_budget_refills_by_ratio_up_to_reserve():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.balance == 2
+
+
+def failing(errors, result='ok'):
+    errors = list(errors)
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+
+def test_call_retries_retriable_errors_within_budget(clock):
+    upstream = Upstream("test", rate_per_minute=0, burst=1, base_delay=1, budget_reserve=5)
+    fn = failing([api_exceptions.ServiceUnavailable('busy'), api_exceptions.TooManyRequests('quota')])
+    assert upstream.call(fn) == 'ok'
+    assert upstream.retries == 2
+    assert upstream.throttled == 1
+    assert len(clock.slept) == 2
+
+
+def test_call_does_not_retry_bad_requests(clock):
+    upstream = Upstream("test", rate_per_minute=0, burst=1)
+    with pytest.raises(api_exceptions.InvalidArgument):
+        upstream.call(failing([api_exceptions.InvalidArgument('bad')]))
+    assert upstream.retries == 0
+
+
+def test_call_sheds_when_retry_budget_is_spent(clock):
+    upstream = Upstream("test", rate_per_minute=0, burst=1, budget_ratio=0, budget_reserve=1)
+    fn = failing([api_exceptions.ServiceUnavailable('busy')] * 3)
+    with pytest.raises(UpstreamOverloaded) as error:
+        upstream.call(fn)
+    assert error.value.reason == 'retry_budget'
+    assert upstream.retries == 1
+
+
+def test_call_sheds_when_rate_limit_wait_is_too_long(clock):
+    upstream = Upstream("test", rate_per_minute=6, burst=1, max_wait=2)
+    assert upstream.call(lambda: 'ok') == 'ok'
+    with pytest.raises(UpstreamOverloaded) as error:
+        upstream.call(lambda: 'ok')
+    assert error.value.reason == 'rate_limit'
@@ -0,0 +1,41 @@
+import pytest
+from starlette.testclient import TestClient
+
+import async_app
+import main
+
+MESSAGE_ENDPOINTS = ['/api/cover-letter', '/api/cover-letter/stream', '/api/chat', '/api/chat/stream']
+BAD_BODIES = [None, [], ["a job"], "a job", 123, {}, {'message': None}, {'message': 123}, {'message': '  '}]
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize('path', MESSAGE_ENDPOINTS)
+@pytest.mark.parametrize('body', BAD_BODIES)
+def test_flask_rejects_malformed_bodies(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('body', [None, [], 123, {'jobs': None}])
+def test_flask_batch_rejects_malformed_bodies(client, body):
+    response = client.post('/api/cover-letter/batch', json=body)
+    assert response.status_code == 400
+
+
+def test_flask_rejects_invalid_json(client):
+    response = client.post('/api/chat', data='{not json', content_type='application/json')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('path', ['/api/cover-letter', '/api/chat'])
+@pytest.mark.parametrize('body', BAD_BODIES)
+def test_async_app_rejects_malformed_bodies(path, body):
+    # Not used as a context manager, so the lifespan (and init()) doesn't run
+    response = TestClient(async_app.app).post(path, json=body)
+    assert response.status_code == 400
+    assert 'error' in response.json()
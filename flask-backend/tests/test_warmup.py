@@ -0,0 +1,23 @@
+import services
+
+
+def test_warm_up_embeds_and_generates_one_token_once(monkeypatch):
+    opened, embedded, generated = [], [], []
+    for method in ('get', 'lexical', 'count'):
+        monkeypatch.setattr(services.collections, method, lambda cv_id, method=method: opened.append(method))
+    monkeypatch.setattr(services, 'RETRIEVAL_MODE', 'hybrid')
+    monkeypatch.setattr(services, 'embed_batch', lambda texts, task_type: embedded.append((texts, task_type)))
+
+    def call(fn, **kwargs):
+        generated.append((fn, kwargs))
+        return object()
+
+    monkeypatch.setattr(services.generation_upstream, 'call', call)
+
+    assert services.warm_up() == 'done'
+    assert opened == ['get', 'lexical', 'count']
+    assert embedded == [([services.WARMUP_PROMPT], 'retrieval_query')]
+    assert len(generated) == 1
+    fn, kwargs = generated[0]
+    assert fn == services.model.generate_content
+    assert kwargs['generation_config'] == {'max_output_tokens': 1}
@@ -1,15 +1,90 @@
-import PyPDF2
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF file."""
-    text = ""
+# Extracted page text is cached on disk, keyed by the PDF's content hash
+PDF_CACHE_DIR = os.getenv(
+    'PDF_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'pdf_text')
+)
+# PDFs with at least this many pages are extracted across a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '8'))
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# The server process has threads (request handlers, job workers, gRPC), so its
+# workers aren't forked from it: a fork could copy a lock held by another thread
+PDF_EXTRACT_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _extract_page_range(pdf_path, start, stop):
+    """Extract the text of pages [start, stop); runs in a worker process"""
+    import PyPDF2
+
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        for page in reader.pages:
-            text += page.extract_text()
-    return text
+        return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+def _extract_pages(pdf_path):
+    # Imported here, so only processes that extract PDFs pay for it
+    import PyPDF2
+
+    with open(pdf_path, 'rb') as file:
+        page_count = len(PyPDF2.PdfReader(file).pages)
+
+    workers = min(PDF_EXTRACT_WORKERS, page_count)
+    if page_count < PDF_PARALLEL_MIN_PAGES or workers <= 1:
+        return _extract_page_range(pdf_path, 0, page_count)
+
+    # Contiguous page ranges per worker; results come back in page order
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    context = multiprocessing.get_context(PDF_EXTRACT_START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        ranges = executor.map(_extract_page_range, [pdf_path] * workers, bounds[:-1], bounds[1:])
+        return [page for page_range in ranges for page in page_range]
+
+def extract_pages_from_pdf(pdf_path):
+    """Extract the text of each page of a PDF, using the on-disk cache when the file is unchanged"""
+    cache_path = os.path.join(PDF_CACHE_DIR, f"{file_hash(pdf_path)}.json")
+    try:
+        with open(cache_path) as file:
+            return json.load(file)["pages"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    pages = _extract_pages(pdf_path)
+
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({"pages": pages}, file)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache extracted PDF text: {e}")
+    return pages
+
+def extract_text_from_pdf(pdf_path):
+    """Extract text from a PDF file."""
+    return "".join(extract_pages_from_pdf(pdf_path))
+
+def page_start_offsets(pages):
+    """Character offset at which each page starts in the joined text"""
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page)
+    return offsets
@@ -0,0 +1,151 @@
+"""
+In-process NumPy vector index, an alternative retrieval backend to Chroma.
+
+A collection is exported to a directory holding its unit-normalized embeddings
+as one contiguous float32 matrix (memory-mapped on load) and a JSON file with
+ids, documents and metadata. Queries are a single matrix-vector product plus a
+partial sort, with the same `where={"section": ...}` equality filter and result
+shape as Chroma's `collection.query`, so `embedder.query_collection` works with
+either. Chroma stays the source of truth; the index is re-exported after writes
+and reloaded by readers when its meta file changes.
+"""
+
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+META_FILE = "meta.json"
+
+
+def _unit_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2:
+        return matrix.reshape(0, 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def write_index(path, ids, embeddings, documents, metadatas):
+    """Write an index directory; readers switch over when meta.json is replaced"""
+    os.makedirs(path, exist_ok=True)
+    version = uuid.uuid4().hex
+    matrix = _unit_rows(embeddings)
+    np.save(os.path.join(path, f"embeddings-{version}.npy"), matrix)
+
+    meta = {"version": version, "ids": list(ids), "documents": list(documents),
+            "metadatas": [dict(m or {}) for m in metadatas]}
+    tmp_path = os.path.join(path, f"{META_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+    # Readers that still map an old matrix keep it until they reload
+    for name in os.listdir(path):
+        if name.startswith("embeddings-") and name != f"embeddings-{version}.npy":
+            os.remove(os.path.join(path, name))
+
+
+def export_collection(collection, path):
+    """Export a Chroma collection to a NumPy index directory"""
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    embeddings = data["embeddings"]
+    if embeddings is None or len(embeddings) == 0:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    write_index(path, data["ids"], embeddings, data["documents"], data["metadatas"])
+
+
+class NumpyIndex:
+    """Read side of an exported index, queried like a Chroma collection"""
+
+    def __init__(self, path, embedding_function=None):
+        self.path = path
+        self.embedding_function = embedding_function
+        self._meta_path = os.path.join(path, META_FILE)
+        self._state = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    def _refresh(self):
+        """Reload the index if it was re-exported since it was loaded"""
+        mtime = os.stat(self._meta_path).st_mtime_ns
+        state = self._state
+        if state is not None and state["mtime"] == mtime:
+            return state
+        with self._lock:
+            if self._state is not None and self._state["mtime"] == mtime:
+                return self._state
+            # A concurrent re-export can remove the matrix we just read the meta
+            # for; the replacement meta file will be in place by then
+            for attempt in range(3):
+                mtime = os.stat(self._meta_path).st_mtime_ns
+                with open(self._meta_path) as file:
+                    meta = json.load(file)
+                try:
+                    matrix = self._load_matrix(meta)
+                    break
+                except FileNotFoundError:
+                    if attempt == 2:
+                        raise
+            self._state = {"mtime": mtime, "matrix": matrix, "ids": meta["ids"],
+                           "documents": meta["documents"], "metadatas": meta["metadatas"], "masks": {}}
+            return self._state
+
+    def _load_matrix(self, meta):
+        if not meta["ids"]:
+            return np.zeros((0, 0), dtype=np.float32)
+        matrix = np.load(os.path.join(self.path, f"embeddings-{meta['version']}.npy"), mmap_mode="r")
+        # Plain ndarray view of the mapping; memmap's subclass overhead dominates small matmuls
+        return matrix.view(np.ndarray)
+
+    def count(self):
+        return len(self._refresh()["ids"])
+
+    @staticmethod
+    def _rows_matching(state, where):
+        """Row indexes whose metadata equals every key/value in `where`, and their sub-matrix"""
+        key = tuple(sorted(where.items()))
+        subset = state["masks"].get(key)
+        if subset is None:
+            rows = np.array([i for i, metadata in enumerate(state["metadatas"])
+                             if all(metadata.get(k) == v for k, v in where.items())], dtype=np.intp)
+            subset = state["masks"][key] = (rows, state["matrix"][rows] if len(rows) else None)
+        return subset
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None):
+        """Cosine top-k; returns the same shape as Chroma's collection.query"""
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        state = self._refresh()
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        rows, matrix = self._rows_matching(state, where) if where else (None, state["matrix"])
+        for query_embedding in query_embeddings:
+            if not state["ids"] or (rows is not None and not len(rows)):
+                top = np.array([], dtype=np.intp)
+                similarities = np.array([], dtype=np.float32)
+            else:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                norm = np.linalg.norm(query)
+                if norm:
+                    query = query / norm
+                similarities = matrix @ query
+                k = min(n_results, len(similarities))
+                top = np.argpartition(-similarities, k - 1)[:k]
+                top = top[np.argsort(-similarities[top])]
+                similarities = similarities[top]
+                if rows is not None:
+                    top = rows[top]
+
+            results["ids"].append([state["ids"][i] for i in top])
+            results["documents"].append([state["documents"][i] for i in top])
+            results["metadatas"].append([state["metadatas"][i] for i in top])
+            results["distances"].append([float(1.0 - s) for s in similarities])
+        return results
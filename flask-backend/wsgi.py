@@ -0,0 +1,129 @@
+"""
+App factory for the Flask API, built for a fast cold start.
+
+    python flask-backend/wsgi.py
+    gunicorn --chdir flask-backend 'wsgi:create_app()'
+
+create_app() returns straight away with a WSGI app that answers /api/health
+and /api/live itself (and /api/ready with a 503) while the API (main.py, which
+imports Chroma and the rest) loads and starts (main.init) on a background
+thread; other requests wait for it, for up to APP_LOAD_TIMEOUT seconds. The
+Gemini SDK, LangChain and PyPDF2 aren't imported until they are first used.
+
+Once the API has loaded, the default CV is re-indexed in the background, unless
+the index was already built from the same file (embedder.index_is_current).
+Ingestion holds a file lock, so when several workers start together (gunicorn
+-w) one of them ingests and the others wait for it and then find the index
+current.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Settings are read at import time, so .env is loaded before the API is imported
+load_dotenv()
+
+logger = logging.getLogger("wsgi")
+
+# How long a request that arrives during startup waits for the API to load
+APP_LOAD_TIMEOUT = float(os.getenv('APP_LOAD_TIMEOUT', '60'))
+HEALTH_PATH = "/api/health"
+LIVE_PATH = "/api/live"
+READY_PATH = "/api/ready"
+
+
+class DeferredApp:
+    """WSGI app that loads the API on a background thread and hands requests to it once loaded"""
+
+    def __init__(self, ingest=True):
+        self.ingest = ingest
+        self.app = None
+        self.readiness = None
+        self.error = None
+        self.ingestion = "pending" if ingest else "disabled"
+        self.timings = {}
+        self._started = time.perf_counter()
+        self._loaded = threading.Event()
+        threading.Thread(target=self._load, name="app-loader", daemon=True).start()
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self._started) * 1000, 1)
+
+    def _load(self):
+        try:
+            import main
+            main.init()
+            main.app.extensions['startup'] = self.stats
+            self.app = main.app
+            self.readiness = main.readiness
+        except Exception as e:
+            logger.exception(f"Loading the API failed: {e}")
+            self.error = str(e)
+        finally:
+            self.timings['app_loaded_ms'] = self._elapsed_ms()
+            self._loaded.set()
+        if self.app is not None and self.ingest:
+            self._ingest()
+
+    def _ingest(self):
+        from embedder import embed_cv, index_is_current, ingest_lock
+
+        self.ingestion = "waiting for another worker"
+        with ingest_lock():
+            if index_is_current():
+                self.ingestion = "skipped, index is current"
+                return
+            self.ingestion = "running"
+            try:
+                embed_cv()
+                self.readiness.refresh_soon()
+                self.ingestion = "done"
+            except Exception as e:
+                logger.exception(f"Startup ingestion failed: {e}")
+                self.ingestion = f"failed: {e}"
+        self.timings['ingestion_done_ms'] = self._elapsed_ms()
+
+    def stats(self):
+        return {"loaded": self.app is not None, "error": self.error, "ingestion": self.ingestion, **self.timings}
+
+    @staticmethod
+    def _json(start_response, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        headers = [("Content-Type", "application/json"), ("Content-Length", str(len(payload)))]
+        if not status.startswith("200"):
+            headers.append(("Retry-After", "1"))
+        start_response(status, headers)
+        return [payload]
+
+    def __call__(self, environ, start_response):
+        if self.app is None:
+            path = environ.get("PATH_INFO")
+            if path in (HEALTH_PATH, LIVE_PATH):
+                if not self._loaded.is_set():
+                    return self._json(start_response, "200 OK", {"status": "starting", "startup": self.stats()})
+            elif path != READY_PATH:
+                self._loaded.wait(APP_LOAD_TIMEOUT)
+            if self.app is None:
+                body = {"status": "error" if self._loaded.is_set() else "starting", "startup": self.stats()}
+                return self._json(start_response, "503 SERVICE UNAVAILABLE", body)
+        return self.app(environ, start_response)
+
+
+def create_app(ingest=True):
+    """The WSGI app; returns before the API has loaded"""
+    return DeferredApp(ingest)
+
+
+if __name__ == '__main__':
+    from werkzeug.serving import run_simple
+    from request_logging import configure_logging
+
+    configure_logging()
+    run_simple(os.getenv('SERVER_HOST', '0.0.0.0'), int(os.getenv('PORT', '5001')), create_app(), threaded=True)